@@ -0,0 +1,244 @@
+"""Benchmarks of flowmason's own overhead: planning, step wrappers, cache I/O, and cold versus warm runs.
+
+Every benchmark runs on synthetic steps that do (almost) no work, in a temporary directory, so the
+times are flowmason's overhead. The results are written as JSON, so that runs on different commits
+can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    git checkout my-branch
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Use --quick for a smoke run with small sizes, and --map-items 50000 to benchmark sweeps of that size.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loguru
+
+from flowmason import conduct, MapReduceStep, SingletonStep
+from flowmason.artifact_cache import artifact_cache
+from flowmason.dag import _lookup_step, step_wrapper
+from flowmason.storage import get_artifact_path, read_artifact, write_artifact
+
+logger = loguru.logger
+
+def _step_constant(step_name, version, arg1):
+    return arg1
+
+def _step_payload(step_name, version, size: int):
+    return b"x" * size
+
+def _step_combine(step_name, version, **upstream):
+    return len(upstream)
+
+def _reduce_count(results):
+    return len(results)
+
+def make_dag(width: int, depth: int, artifact_bytes: int) -> OrderedDict:
+    """A DAG of depth layers of width steps. Each step depends on every step of the layer before it."""
+    steps = OrderedDict()
+    previous_layer: List[str] = []
+    for layer in range(depth):
+        current_layer = []
+        for i in range(width):
+            step_name = f"step_{layer}_{i}"
+            if previous_layer:
+                params = {"version": "001", **{f"upstream_{j}": name for j, name in enumerate(previous_layer)}}
+                steps[step_name] = SingletonStep(_step_combine, params)
+            else:
+                steps[step_name] = SingletonStep(_step_payload, {"version": "001", "size": artifact_bytes + i})
+            current_layer.append(step_name)
+        previous_layer = current_layer
+    return steps
+
+def make_map_reduce(num_items: int, chain_length: int = 1, batch_size: Optional[int] = None) -> OrderedDict:
+    """A single MapReduceStep over num_items map items, with chain_length steps per item.
+
+    With a batch_size, the steps are batched; _step_constant returns the list of its per-item arguments.
+    """
+    map_steps = OrderedDict()
+    for i in range(chain_length):
+        map_steps[f"step_map_{i}"] = SingletonStep(_step_constant, {"version": "001"}, batched=batch_size is not None)
+    steps = OrderedDict()
+    steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": list(range(num_items))}, {"version": "001"},
+                                             _reduce_count, executor="thread", batch_size=batch_size)
+    return steps
+
+def _time(fn: Callable[[], Any], repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+def _result(name: str, params: Dict[str, Any], times: List[float], per: Optional[int] = None,
+            num_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """A benchmark result. The best of the repeats is what is compared across runs, since it is the least noisy."""
+    result = {"name": name, "params": params, "seconds": min(times), "median_seconds": statistics.median(times),
+              "repeat": len(times)}
+    if per is not None:
+        result["us_per_item"] = min(times) / per * 1e6
+    if num_bytes is not None:
+        result["mb_per_second"] = num_bytes / min(times) / 1e6
+    return result
+
+def bench_cold_and_warm(name: str, steps: OrderedDict, params: Dict[str, Any], repeat: int, num_steps: int):
+    """Time a run with an empty cache, and a run of the same steps with everything cached."""
+    cold_times, warm_times = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            artifact_cache.clear()
+            cold_times += _time(lambda: conduct(cache_dir, steps, "benchmark"), 1)
+            warm_times += _time(lambda: conduct(cache_dir, steps, "benchmark"), 1)
+    return [_result(f"{name}.cold", params, cold_times, per=num_steps),
+            _result(f"{name}.warm", params, warm_times, per=num_steps)]
+
+def bench_planning(name: str, steps: OrderedDict, params: Dict[str, Any], repeat: int, num_steps: int):
+    """Time deciding which steps are cached (_lookup_step), once every step is."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        conduct(cache_dir, steps, "benchmark")
+        def plan():
+            cache_map = {}
+            for step_name, step_impl in steps.items():
+                _, _, cached = _lookup_step(step_name, step_impl, cache_map, cache_dir)
+                assert cached is not None, f"{step_name} should be cached"
+                cache_map[step_name] = cached[0]
+        return [_result(f"{name}.plan", params, _time(plan, repeat), per=num_steps)]
+
+def bench_step_wrapper(num_calls: int, repeat: int):
+    """Time step_wrapper around a step that does nothing: loading its input, calling it and caching its result."""
+    times = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_map = {}
+            upstream_path, _ = step_wrapper(_step_constant, cache_map, cache_dir)(
+                step_name="step_upstream", version="001", arg1=0)
+            cache_map["step_upstream"] = upstream_path
+            wrapper = step_wrapper(_step_constant, cache_map, cache_dir)
+            start = time.perf_counter()
+            for i in range(num_calls):
+                wrapper(step_name=f"step_{i}", version="001", arg1="step_upstream")
+            times.append(time.perf_counter() - start)
+    baseline = _time(lambda: [_step_constant(step_name=f"step_{i}", version="001", arg1=0) for i in range(num_calls)], repeat)
+    return [_result("step_wrapper", {"calls": num_calls}, times, per=num_calls),
+            _result("step_wrapper.direct_call", {"calls": num_calls}, baseline, per=num_calls)]
+
+def bench_cache_io(artifact_bytes: int, num_artifacts: int, repeat: int, codec: Optional[str] = None, pack: bool = False):
+    """Time writing and reading back num_artifacts artifacts of artifact_bytes bytes each, bypassing the in-memory artifact cache."""
+    params = {"artifact_bytes": artifact_bytes, "artifacts": num_artifacts, "codec": codec, "pack": pack}
+    payloads = [os.urandom(artifact_bytes) for _ in range(num_artifacts)]
+    total_bytes = artifact_bytes * num_artifacts
+    write_times, read_times = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            paths = [get_artifact_path(cache_dir, f"{i:064x}") for i in range(num_artifacts)]
+            write_times += _time(lambda: [write_artifact(path, payload, "dill", codec, pack)
+                                          for path, payload in zip(paths, payloads)], 1)
+            read_times += _time(lambda: [read_artifact(path) for path in paths], 1)
+    return [_result("cache.write", params, write_times, per=num_artifacts, num_bytes=total_bytes),
+            _result("cache.read", params, read_times, per=num_artifacts, num_bytes=total_bytes)]
+
+def run_benchmarks(map_items: int, width: int, depth: int, artifact_bytes: int, repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for num_items, batch_size in ((map_items, None), (map_items, max(1, map_items // 100))):
+        params = {"map_items": num_items, "chain_length": 2, "batch_size": batch_size}
+        steps = make_map_reduce(num_items, chain_length=2, batch_size=batch_size)
+        results += bench_cold_and_warm("map_reduce", steps, params, repeat, num_items * 2)
+        if batch_size is None:
+            results += bench_planning("map_reduce", steps, params, repeat, num_items * 2)
+    params = {"width": width, "depth": depth, "artifact_bytes": artifact_bytes}
+    dag = make_dag(width, depth, artifact_bytes)
+    results += bench_cold_and_warm("dag", dag, params, repeat, width * depth)
+    results += bench_planning("dag", dag, params, repeat, width * depth)
+    results += bench_step_wrapper(map_items, repeat)
+    num_small = max(1, map_items // 10)
+    for size, count, codec, pack in ((1024, num_small, None, False), (1024, num_small, None, True),
+                                     (artifact_bytes, 10, None, False), (artifact_bytes, 10, "zlib", False)):
+        results += bench_cache_io(size, count, repeat, codec, pack)
+    return results
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _result_key(result: Dict[str, Any]) -> str:
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+def compare(results: List[Dict[str, Any]], baseline_results: List[Dict[str, Any]]) -> List[str]:
+    """Lines comparing the best time of each benchmark to the same benchmark in baseline_results."""
+    baseline = {_result_key(result): result for result in baseline_results}
+    lines = []
+    for result in results:
+        baseline_result = baseline.get(_result_key(result))
+        if baseline_result is None:
+            lines.append(f"{_result_key(result)}: new")
+            continue
+        ratio = result["seconds"] / baseline_result["seconds"]
+        lines.append(f"{_result_key(result)}: {baseline_result['seconds']:.4f}s -> {result['seconds']:.4f}s ({ratio:.2f}x)")
+    return lines
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--map-items", type=int, default=5000, help="number of map items of the map reduce benchmarks")
+    parser.add_argument("--width", type=int, default=20, help="number of steps in each layer of the DAG benchmarks")
+    parser.add_argument("--depth", type=int, default=5, help="number of layers of the DAG benchmarks")
+    parser.add_argument("--artifact-bytes", type=int, default=1 << 20, help="size of the large artifacts")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="small sizes and a single repeat, as a smoke test")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    parser.add_argument("--log", action="store_true", help="keep flowmason's logging, which is otherwise turned off")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.map_items, args.width, args.depth, args.artifact_bytes, args.repeat = 50, 3, 2, 1 << 14, 1
+    if not args.log:
+        logger.remove()
+
+    # conduct writes its run files to outputs/, so the benchmarks run in a temporary directory.
+    output_path = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    cwd = os.getcwd()
+    started = datetime.datetime.now().isoformat()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            results = run_benchmarks(args.map_items, args.width, args.depth, args.artifact_bytes, args.repeat)
+        finally:
+            os.chdir(cwd)
+    report = {
+        "commit": _get_commit(),
+        "started": started,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "results": results
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    for result in results:
+        print(f"{_result_key(result)}: {result['seconds']:.4f}s" +
+              (f", {result['us_per_item']:.1f}us per item" if "us_per_item" in result else "") +
+              (f", {result['mb_per_second']:.1f}MB/s" if "mb_per_second" in result else ""))
+    if compare_path is not None:
+        with open(compare_path, 'r') as f:
+            print("\n".join(compare(results, json.load(f)["results"])))
+
+if __name__ == "__main__":
+    main()
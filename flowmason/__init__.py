@@ -1,2 +1,5 @@
 from .dag import conduct, SingletonStep, MapReduceStep
-from .inspector import load_artifact, load_latest_steps
\ No newline at end of file
+from .inspector import find_runs, get_step_history, load_artifact, load_latest_steps, load_run
+from .cache_gc import collect_garbage
+from .chunks import ChunkedArtifact
+from .profiling import export_chrome_trace
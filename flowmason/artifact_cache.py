@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+import os
+import threading
+
+class ArtifactCache:
+    """Process-wide LRU cache of deserialized artifacts, keyed by cache path.
+
+    An entry is only reused while the artifact's version (by default, the file's modification time and size) is unchanged.
+    The size of an artifact on disk is used as an estimate of its size in memory, and the
+    least recently used artifacts are evicted once the total exceeds max_bytes. Note that
+    a hit returns the same object to every caller, so callers should not mutate it.
+    """
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[Any, int, Any]] = OrderedDict()
+
+    def configure(self, max_bytes: int):
+        """Set the byte budget, evicting entries if the cache is now over budget."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def load(self, cache_path: str, loader: Callable[[str], Any], version: Optional[Tuple[Any, int]] = None) -> Any:
+        """Get the artifact at cache_path, calling loader(cache_path) on a miss.
+
+        Args:
+            version (Optional[Tuple[Any, int]]): An identifier that changes whenever the artifact is rewritten, and its size.
+                Defaults to the modification time and size of the file at cache_path.
+        """
+        if version is None:
+            stat = os.stat(cache_path)
+            version = (stat.st_mtime_ns, stat.st_size), stat.st_size
+        file_version, size = version
+        with self._lock:
+            entry = self._entries.get(cache_path)
+            if entry is not None and entry[0] == file_version:
+                self._entries.move_to_end(cache_path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        artifact = loader(cache_path)
+        if size <= self.max_bytes:
+            with self._lock:
+                self._remove(cache_path)
+                self._entries[cache_path] = (file_version, size, artifact)
+                self.current_bytes += size
+                self._evict()
+        return artifact
+
+    def invalidate(self, cache_path: str):
+        with self._lock:
+            self._remove(cache_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "current_bytes": self.current_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+    def _remove(self, cache_path: str):
+        entry = self._entries.pop(cache_path, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def _evict(self):
+        while self._entries and self.current_bytes > self.max_bytes:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+
+# disabled (max_bytes=0) until a budget is configured, e.g. artifact_cache.configure(8 * 1024 ** 3).
+artifact_cache = ArtifactCache()
@@ -0,0 +1,205 @@
+"""Runs the steps of an experiment on an asyncio event loop (executor="async").
+
+Steps whose step function is a coroutine function (async def) are awaited on the event loop, so that
+steps that wait on I/O (downloads, HTTP calls, subprocesses) run concurrently without a thread each.
+Other step functions, and all reads and writes of the cache, run on threads so that they do not block
+the event loop. The concurrency limit is max_workers, both for the steps of the experiment and for the
+map items (or batches) of a map reduce step. Since steps share the event loop's thread, their CPU time
+is not profiled.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, OrderedDict, Tuple, Union
+import asyncio
+import datetime
+import inspect
+
+from .dag import (MapReduceStep, SingletonStep, ASYNC_EXECUTOR, _MapChains, _cache_reduce_result, _claim_step,
+                  _finish_batch_call, _finish_step_call, _get_batched_keys, _get_map_batches, _get_step_dependencies, 
+                  _lookup_step, _prepare_batch_call, _prepare_step_call, _record_cached_step, _record_executed_step, 
+                  _reduce_results, _release_claim, _run_chunked_step, execute_map_reduce_step)
+from .profiling import profile_step, timed_reduce_fn
+
+async def _call_step_fn(step_func, **kwargs):
+    if inspect.iscoroutinefunction(step_func):
+        return await step_func(**kwargs)
+    return await asyncio.to_thread(step_func, **kwargs)
+
+def async_step_wrapper(step_func, cache_map: Dict[str, str], cache_dir: str):
+    """Like step_wrapper, but returns a coroutine function. The upstream results are loaded and the result is cached on a thread."""
+    async def wrapper(**kwargs):
+        call_kwargs = await asyncio.to_thread(_prepare_step_call, kwargs, cache_map)
+        if inspect.isgeneratorfunction(step_func):
+            return await asyncio.to_thread(_run_chunked_step, step_func, cache_dir, kwargs, cache_map, call_kwargs)
+        result = await _call_step_fn(step_func, **call_kwargs)
+        return await asyncio.to_thread(_finish_step_call, cache_dir, kwargs, cache_map, result)
+    return wrapper
+
+def _now() -> str:
+    return datetime.datetime.now().strftime("%H:%M:%S")
+
+async def _execute_map_chains_async(mapreduce_step_name: str, map_reduce_step: MapReduceStep, indices: List[int],
+                                    cache_map: Dict[str, str], cache_dir: str, semaphore: asyncio.Semaphore,
+                                    cooperative: bool = False, wait_for_others: bool = True):
+    """Like _execute_map_chains, awaiting the step functions and running the cache lookups on a thread."""
+    async with semaphore:
+        chains = _MapChains(mapreduce_step_name, map_reduce_step, indices, cache_map, cache_dir, measure_cpu=False,
+                            cooperative=cooperative, wait_for_others=wait_for_others)
+        for singleton_step_name, singleton_step_impl in map_reduce_step.step_fns.items():
+            items_to_execute = await asyncio.to_thread(chains.lookup_step, singleton_step_name)
+            while True:
+                if items_to_execute:
+                    try:
+                        timed_results = await _run_map_step_async(singleton_step_name, singleton_step_impl, 
+                                                                  map_reduce_step, items_to_execute, cache_dir)
+                    finally:
+                        await asyncio.to_thread(chains.release_claims)
+                    chains.record_step(singleton_step_name, items_to_execute, timed_results)
+                items_to_execute = await asyncio.to_thread(chains.wait_for_deferred, singleton_step_name)
+                if not items_to_execute:
+                    break
+            chains.release_results(singleton_step_name)
+        return chains.results()
+
+async def _run_map_step_async(singleton_step_name: str, singleton_step_impl: SingletonStep, map_reduce_step: MapReduceStep,
+                              items_to_execute: List[Tuple[int, Dict[str, Any], Dict[str, str]]], cache_dir: str):
+    """Like _run_map_step, awaiting the step function."""
+    if singleton_step_impl.batched:
+        items_kwargs = [fn_kwargs for _, fn_kwargs, _ in items_to_execute]
+        cache_maps = [chain_cache_map for _, _, chain_cache_map in items_to_execute]
+        start_time = _now()
+        with profile_step(measure_cpu=False) as profile:
+            profile.batch_items = len(items_kwargs)
+            batch_kwargs = await asyncio.to_thread(_prepare_batch_call, items_kwargs, cache_maps,
+                                                   _get_batched_keys(map_reduce_step, singleton_step_name))
+            results = await _call_step_fn(singleton_step_impl.step_fn, **batch_kwargs)
+            results = await asyncio.to_thread(_finish_batch_call, cache_dir, items_kwargs, cache_maps, results)
+        end_time = _now()
+        return [(start_time, end_time, result, profile) for result in results]
+    timed_results = []
+    for _, fn_kwargs, chain_cache_map in items_to_execute:
+        step_fn = async_step_wrapper(singleton_step_impl.step_fn, chain_cache_map, cache_dir)
+        start_time = _now()
+        with profile_step(measure_cpu=False) as profile:
+            result = await step_fn(**fn_kwargs)
+        timed_results.append((start_time, _now(), result, profile))
+    return timed_results
+
+async def execute_map_reduce_step_async(mapreduce_step_name: str, map_reduce_step: MapReduceStep,
+                                        cache_map: Dict[str, str], cache_dir: str, cooperative: bool = False):
+    """Like execute_map_reduce_step, running up to max_workers batches of map items concurrently on the event loop."""
+    semaphore = asyncio.Semaphore(map_reduce_step.max_workers)
+    batches = _get_map_batches(mapreduce_step_name, map_reduce_step)
+    # with cooperative, the map items claimed by other processes are waited for on a second pass (see _map_chains_cooperatively).
+    chain_results = await asyncio.gather(*(
+        _execute_map_chains_async(mapreduce_step_name, map_reduce_step, batch, cache_map, cache_dir, semaphore,
+                                  cooperative, wait_for_others=not cooperative)
+        for batch in batches))
+    incomplete = [i for i, (_, result_cache_paths) in enumerate(chain_results) if None in result_cache_paths]
+    completed = await asyncio.gather(*(
+        _execute_map_chains_async(mapreduce_step_name, map_reduce_step, batches[i], cache_map, cache_dir, semaphore,
+                                  cooperative)
+        for i in incomplete))
+    for i, chain_result in zip(incomplete, completed):
+        chain_results[i] = chain_result
+    map_reduce_mapdata = [metadata for chain_metadata, _ in chain_results for metadata in chain_metadata]
+    final_result_paths = [path for _, result_cache_paths in chain_results for path in result_cache_paths]
+    final_result = await asyncio.to_thread(_reduce_results, timed_reduce_fn(map_reduce_step.reduce_fn), 
+                                           map_reduce_step.reduce_mode, final_result_paths)
+    map_reduce_result_cache_path = await asyncio.to_thread(_cache_reduce_result, mapreduce_step_name, map_reduce_step,
+                                                           final_result_paths, cache_map, cache_dir, final_result)
+    return map_reduce_result_cache_path, map_reduce_mapdata
+
+async def _execute_step_async(exp_step_name: str, step_impl: Union[SingletonStep, MapReduceStep],
+                              cache_map: Dict[str, str], cache_dir: str, cooperative: bool = False):
+    """Like _execute_step. Map reduce steps with a "thread" or "process" executor run on their pool, from a thread."""
+    with profile_step(measure_cpu=False) as profile:
+        if cooperative:
+            step_version, step_kwargs, cached, claimed_path = await asyncio.to_thread(
+                _claim_step, exp_step_name, step_impl, cache_map, cache_dir)
+        else:
+            step_version, step_kwargs, cached = await asyncio.to_thread(_lookup_step, exp_step_name, step_impl, cache_map, cache_dir)
+            claimed_path = None
+        if cached is None:
+            start_time = _now()
+            try:
+                if isinstance(step_impl, SingletonStep):
+                    execution_result = await async_step_wrapper(step_impl.step_fn, cache_map, cache_dir)(**step_kwargs)
+                elif step_impl.executor == ASYNC_EXECUTOR:
+                    execution_result = await execute_map_reduce_step_async(exp_step_name, step_impl, cache_map, cache_dir,
+                                                                           cooperative)
+                else:
+                    execution_result = await asyncio.to_thread(execute_map_reduce_step, exp_step_name, step_impl, 
+                                                               cache_map, cache_dir, cooperative)
+            finally:
+                if claimed_path is not None:
+                    await asyncio.to_thread(_release_claim, cache_dir, claimed_path)
+            end_time = _now()
+    if cached is not None:
+        return _record_cached_step(cached, profile)
+    return _record_executed_step(exp_step_name, step_impl, step_version, step_kwargs, start_time, end_time,
+                                 execution_result, cache_dir, profile)
+
+async def schedule_steps_async(experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]],
+                               cache_map: Dict[str, str], cache_dir: str,
+                               max_workers: int, cooperative: bool = False) -> AsyncIterator[Tuple[str, asyncio.Task]]:
+    """Like _schedule_steps, running the steps as tasks on the event loop, at most max_workers at a time."""
+    step_names = list(experiment_steps.keys())
+    dependencies = {
+        step_name: _get_step_dependencies(experiment_steps[step_name], step_names[:i])
+        for i, step_name in enumerate(step_names)
+    }
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run_step(step_name: str):
+        async with semaphore:
+            return await _execute_step_async(step_name, experiment_steps[step_name], cache_map, cache_dir, cooperative)
+
+    pending_steps = step_names.copy()
+    finished_steps = set()
+    running = {}
+    try:
+        while pending_steps or running:
+            for step_name in pending_steps.copy():
+                if all(dependency in finished_steps for dependency in dependencies[step_name]):
+                    pending_steps.remove(step_name)
+                    running[asyncio.ensure_future(run_step(step_name))] = step_name
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step_name = running.pop(task)
+                yield step_name, task
+                finished_steps.add(step_name)
+    finally:
+        # e.g., a step failed; the steps still running are cancelled.
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+def iterate_async(async_iterator: AsyncIterator[Any]) -> Iterator[Any]:
+    """Iterate over an async iterator from synchronous code, running it on a new event loop.
+
+    The event loop runs on a separate thread if this thread is already running one (e.g., in a notebook).
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.get_running_loop()
+        loop_thread = ThreadPoolExecutor(max_workers=1)
+    except RuntimeError:
+        loop_thread = None
+
+    def run(coroutine):
+        if loop_thread is None:
+            return loop.run_until_complete(coroutine)
+        return loop_thread.submit(loop.run_until_complete, coroutine).result()
+
+    try:
+        while True:
+            try:
+                yield run(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run(async_iterator.aclose())
+        run(loop.shutdown_default_executor())
+        loop.close()
+        if loop_thread is not None:
+            loop_thread.shutdown()
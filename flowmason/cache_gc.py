@@ -0,0 +1,220 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+import json
+import os
+import time
+
+from .artifact_cache import artifact_cache
+from .cache_index import ENTRY_INFO_SUFFIX, CacheIndex, get_cache_index
+from .log import logger
+
+@dataclass
+class EvictedArtifact:
+    cache_path: str
+    # bytes freed by evicting the artifact: 0 while identical artifacts that share its bytes are kept.
+    size: int
+    last_used: float
+    # "unreferenced" if no run in outputs_dir refers to the artifact, "over budget" if it was evicted to meet max_bytes.
+    reason: str
+
+@dataclass
+class GCReport:
+    dry_run: bool
+    total_bytes: int
+    live_bytes: int
+    evicted: List[EvictedArtifact] = field(default_factory=list)
+
+    @property
+    def freed_bytes(self) -> int:
+        return sum(artifact.size for artifact in self.evicted)
+
+    @property
+    def remaining_bytes(self) -> int:
+        return self.total_bytes - self.freed_bytes
+
+    def summary(self) -> str:
+        verb = "Would evict" if self.dry_run else "Evicted"
+        num_unreferenced = sum(artifact.reason == "unreferenced" for artifact in self.evicted)
+        return (f"{verb} {len(self.evicted)} artifacts ({num_unreferenced} unreferenced, "
+                f"{len(self.evicted) - num_unreferenced} over budget), freeing {self.freed_bytes} of "
+                f"{self.total_bytes} bytes; {self.live_bytes} bytes are referenced by runs.")
+
+def _iter_cache_paths(metadata: Any):
+    """Yield every "cache_path" in a run's metadata, including those of the map steps of map reduce steps.
+
+    The map steps of a cached map reduce step are listed in its "map_cache_paths".
+    """
+    if isinstance(metadata, dict):
+        if isinstance(metadata.get("cache_path"), str):
+            yield metadata["cache_path"]
+        yield from metadata.get("map_cache_paths", [])
+        for value in metadata.values():
+            if isinstance(value, (dict, list)):
+                yield from _iter_cache_paths(value)
+    elif isinstance(metadata, list):
+        for value in metadata:
+            yield from _iter_cache_paths(value)
+
+def get_live_cache_paths(outputs_dir: str = "outputs", keep_runs: Optional[int] = None) -> Dict[str, Tuple[float, bool]]:
+    """Find the artifacts referenced by the runs recorded under outputs_dir/<experiment>/run_####.json.
+
+    Only the run files are read, so this is cheap regardless of the number of artifacts.
+
+    Args:
+        outputs_dir (str): Directory holding one subdirectory of run files per experiment.
+        keep_runs (Optional[int]): Only the latest keep_runs runs of each experiment keep their artifacts alive.
+            Older runs still count as uses of an artifact when ordering artifacts by recency. None keeps every run.
+
+    Returns:
+        The absolute path of every referenced artifact, mapped to the modification time of the latest run
+        referencing it and whether that artifact is kept alive.
+    """
+    cache_paths: Dict[str, Tuple[float, bool]] = {}
+    if not os.path.isdir(outputs_dir):
+        return cache_paths
+    for experiment_entry in os.scandir(outputs_dir):
+        if not experiment_entry.is_dir():
+            continue
+        run_fnames = sorted(f for f in os.listdir(experiment_entry.path) if f.startswith("run_") and f.endswith(".json"))
+        for run_num, run_fname in enumerate(reversed(run_fnames)):
+            run_path = os.path.join(experiment_entry.path, run_fname)
+            try:
+                with open(run_path, 'r') as f:
+                    metadata = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"Skipping run file {run_path}: {e}")
+                continue
+            run_time = os.path.getmtime(run_path)
+            is_kept = keep_runs is None or run_num < keep_runs
+            for cache_path in _iter_cache_paths(metadata):
+                cache_path = os.path.abspath(cache_path)
+                last_used, was_kept = cache_paths.get(cache_path, (0.0, False))
+                cache_paths[cache_path] = (max(last_used, run_time), was_kept or is_kept)
+    return cache_paths
+
+def _remove_unused_segments(index: CacheIndex, segments: Set[str], cutoff: float):
+    """Delete the segment files that no longer hold any packed artifact in the index.
+
+    Segments modified after cutoff are kept, since a run may still be appending to them.
+    """
+    used_segments = {entry.get("segment") for _, entry in index.entries()}
+    for segment in segments - used_segments:
+        segment_path = os.path.join(index.cache_dir, segment)
+        try:
+            if os.path.getmtime(segment_path) < cutoff:
+                logger.info(f"Removing segment {segment_path}, which no longer holds any artifacts")
+                os.remove(segment_path)
+        except FileNotFoundError:
+            pass
+
+def _get_storage_key(cache_path: str, entry: Dict[str, Any]):
+    """Identify the bytes on disk of an artifact, which it shares with the identical artifacts that have the same key."""
+    if "blob" in entry:
+        return entry["blob"]
+    if "segment" in entry:
+        return (entry["segment"], entry["offset"])
+    return cache_path
+
+def _remove_blob_if_unused(index: CacheIndex, blob: str):
+    """Delete a blob once no artifact file links to it anymore."""
+    blob_path = os.path.join(index.cache_dir, blob)
+    try:
+        if os.stat(blob_path).st_nlink == 1:
+            os.remove(blob_path)
+    except FileNotFoundError:
+        pass
+
+def collect_garbage(cache_dir: str, max_bytes: Optional[int] = None, outputs_dir: str = "outputs",
+                    keep_runs: Optional[int] = None, dry_run: bool = False,
+                    grace_period: float = 3600.0) -> GCReport:
+    """Delete the artifacts in cache_dir that no run refers to, and then the least recently used ones, down to a byte budget.
+
+    The artifacts and their sizes are read from the cache index, so the cache directory is never listed.
+    Artifacts superseded by a new step version, and the map results of map items that are no longer
+    run, are unreferenced once the runs that used them are no longer kept. The space taken by packed artifacts
+    is only freed once every artifact in their segment file has been evicted, and identical artifacts that
+    share their bytes (see storage.get_blob_path) only free them once they have all been evicted. The chunks of a
+    chunked artifact (see flowmason.chunks) are kept and evicted along with it.
+
+    Args:
+        cache_dir (str): The cache directory passed to conduct.
+        max_bytes (Optional[int]): Evict artifacts until the cache takes up at most max_bytes. Unreferenced artifacts
+            go first, then referenced ones, least recently used first. With None, only unreferenced artifacts are evicted.
+        outputs_dir (str): Directory of the run files whose artifacts are live (see get_live_cache_paths).
+        keep_runs (Optional[int]): Number of runs per experiment whose artifacts are live. None keeps all of them.
+        dry_run (bool): Only report what would be evicted.
+        grace_period (float): Artifacts cached within the last grace_period seconds are never evicted, since runs
+            that are still in progress have not recorded them yet.
+
+    Returns:
+        A report of the evicted artifacts.
+    """
+    index = get_cache_index(cache_dir)
+    index.refresh()
+    live_cache_paths = get_live_cache_paths(outputs_dir, keep_runs)
+    cutoff = time.time() - grace_period
+    candidates = []
+    # the bytes on disk shared by identical artifacts are counted once, and freed with the last of them.
+    references: Dict[Any, int] = {}
+    sizes: Dict[Any, int] = {}
+    live_keys = set()
+    # the chunks of a chunked artifact (see flowmason.chunks) are evicted with it rather than on their own.
+    chunks: Dict[str, List[Tuple[str, Any, Dict[str, Any]]]] = {}
+    for cache_path, entry in index.entries():
+        storage_key = _get_storage_key(cache_path, entry)
+        references[storage_key] = references.get(storage_key, 0) + 1
+        sizes[storage_key] = entry.get("size", 0)
+        manifest_path = os.path.join(index.cache_dir, entry["manifest"]) if "manifest" in entry else None
+        last_used, is_live = live_cache_paths.get(os.path.abspath(manifest_path or cache_path), (0.0, False))
+        last_used = max(last_used, entry.get("created", 0.0))
+        if is_live:
+            live_keys.add(storage_key)
+        if manifest_path is not None and index.has(manifest_path):
+            chunks.setdefault(os.path.abspath(manifest_path), []).append((cache_path, storage_key, entry))
+        elif entry.get("created", 0.0) < cutoff:
+            candidates.append((not is_live, last_used, cache_path, storage_key, entry))
+    total_bytes = sum(sizes.values())
+    live_bytes = sum(sizes[storage_key] for storage_key in live_keys)
+
+    report = GCReport(dry_run=dry_run, total_bytes=total_bytes, live_bytes=live_bytes)
+    remaining_bytes = total_bytes
+    evicted_segments = set()
+    evicted_blobs = set()
+    # unreferenced artifacts first, then the least recently used.
+    for is_unreferenced, last_used, cache_path, storage_key, entry in sorted(candidates, key=lambda c: (not c[0], c[1])):
+        should_evict = remaining_bytes > max_bytes if max_bytes is not None else is_unreferenced
+        if not should_evict:
+            break
+        for evicted_path, evicted_key, evicted_entry in [(cache_path, storage_key, entry),
+                                                         *chunks.get(os.path.abspath(cache_path), [])]:
+            references[evicted_key] -= 1
+            size = sizes[evicted_key] if references[evicted_key] == 0 else 0
+            report.evicted.append(EvictedArtifact(evicted_path, size, last_used,
+                                                  "unreferenced" if is_unreferenced else "over budget"))
+            remaining_bytes -= size
+            if "segment" in evicted_entry:
+                evicted_segments.add(evicted_entry["segment"])
+            if "blob" in evicted_entry:
+                evicted_blobs.add(evicted_entry["blob"])
+
+    for artifact in report.evicted:
+        logger.info(f"{'Would evict' if dry_run else 'Evicting'} {artifact.cache_path} ({artifact.reason}, {artifact.size} bytes)")
+        if dry_run:
+            continue
+        # removed from the index first, so that no other run picks the artifact up while it is being deleted.
+        # packed artifacts have no file of their own; their segment is deleted once it holds no artifacts.
+        index.remove(artifact.cache_path)
+        artifact_cache.invalidate(artifact.cache_path)
+        for path in (artifact.cache_path, f"{artifact.cache_path}{ENTRY_INFO_SUFFIX}"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    if not dry_run:
+        # the log no longer needs the lines of the evicted and overwritten artifacts.
+        index.compact()
+        _remove_unused_segments(index, evicted_segments, cutoff)
+        for blob in evicted_blobs:
+            _remove_blob_if_unused(index, blob)
+    logger.info(report.summary())
+    return report
@@ -0,0 +1,175 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+import json
+import os
+import threading
+import time
+
+from .jsonl_log import TMP_SUFFIX, JsonlLog
+
+INDEX_FILENAME = "index.jsonl"
+# entry info written next to each artifact, before artifacts were recorded in the index.
+ENTRY_INFO_SUFFIX = ".info.json"
+# artifacts are cached in subdirectories named after the first SHARD_WIDTH characters of their hashed names.
+SHARD_WIDTH = 2
+# packed artifacts are appended to segment files in this subdirectory.
+SEGMENTS_DIRNAME = "segments"
+# one hard link to each distinct artifact file, named after its digest, is kept in this subdirectory.
+BLOBS_DIRNAME = "blobs"
+# files in the cache directory that are not artifacts.
+_NON_ARTIFACT_SUFFIXES = (ENTRY_INFO_SUFFIX, TMP_SUFFIX, ".jsonl")
+
+# set while a run is planned, which looks the steps up in the cache without writing to it.
+_read_only: ContextVar[bool] = ContextVar("flowmason_read_only_index", default=False)
+
+@contextmanager
+def read_only_index():
+    """Look up artifacts in this block without writing to the cache directory.
+
+    A cache directory without an index is scanned without creating one, and the digests of artifacts cached
+    before digests were recorded are computed without being recorded.
+    """
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+def is_read_only() -> bool:
+    return _read_only.get()
+
+class CacheIndex(JsonlLog):
+    """Append-only log of the artifacts in a cache directory.
+
+    Each line of cache_dir/index.jsonl records an artifact (its path relative to cache_dir, size,
+    creation time, status, digest, serializer and codec, the blob it shares with identical artifacts,
+    and for packed artifacts, the segment file and offset they were appended at). The log is read once and then followed
+    as other processes append to it, so checking whether an artifact is cached does not touch the
+    file system.
+    """
+    def __init__(self, cache_dir: str):
+        super().__init__(os.path.join(cache_dir, INDEX_FILENAME))
+        self.cache_dir = cache_dir
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # (digest, codec) -> path of a packed artifact with those contents.
+        self._packed_by_digest: Dict[Tuple[str, Optional[str]], str] = {}
+
+    def has(self, cache_path: str) -> bool:
+        """Whether the artifact is in the index, as of the last refresh."""
+        return self._relative_path(cache_path) in self._entries
+
+    def get(self, cache_path: str, refresh_on_miss: bool = True) -> Optional[Dict[str, Any]]:
+        relative_path = self._relative_path(cache_path)
+        entry = self._entries.get(relative_path)
+        if entry is None and refresh_on_miss:
+            self.refresh()
+            entry = self._entries.get(relative_path)
+        return entry
+
+    def add(self, cache_path: str, entry_info: Dict[str, Any]):
+        self._append(self._make_entry(cache_path, entry_info))
+
+    def find_packed(self, digest: str, codec: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Get the entry of a packed artifact whose serialized bytes have digest, compressed with codec, if there is one."""
+        with self._lock:
+            relative_path = self._packed_by_digest.get((digest, codec))
+            entry = self._entries.get(relative_path)
+            if entry is None or "segment" not in entry or entry.get("digest") != digest or entry.get("codec") != codec:
+                return None
+            return entry
+
+    def remove(self, cache_path: str):
+        self._append({"path": self._relative_path(cache_path), "status": "deleted"})
+
+    def compact(self):
+        """Rewrite the log with one line per artifact in the index, dropping the lines of deleted and overwritten artifacts.
+
+        The rewritten log replaces the old one atomically, and other processes reload it on their next refresh.
+        Lines appended by other processes while the log is rewritten are carried over, except in the moment between
+        the last read of the old log and its replacement; artifacts whose lines are lost are recomputed when needed.
+        """
+        with self._lock:
+            self.refresh()
+            self._rewrite(list(self._entries.values()))
+
+    def entries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Iterate over (cache path, entry) for every artifact in the index."""
+        with self._lock:
+            items = list(self._entries.items())
+        for relative_path, entry in items:
+            yield os.path.join(self.cache_dir, relative_path), entry
+
+    def _apply(self, record: Dict[str, Any]):
+        if record["status"] == "deleted":
+            self._entries.pop(record["path"], None)
+        else:
+            self._entries[record["path"]] = record
+            if "segment" in record and "digest" in record:
+                self._packed_by_digest[(record["digest"], record.get("codec"))] = record["path"]
+
+    def _clear(self):
+        self._entries = {}
+        self._packed_by_digest = {}
+
+    def _on_missing(self):
+        self._import_existing_artifacts()
+
+    def _import_existing_artifacts(self):
+        """Index the artifacts cached before the cache directory had an index, with a single scan of the directory and its subdirectories.
+
+        Packed artifacts can only be found through the index, so they are not recovered. In a read_only_index block,
+        the artifacts are only indexed in memory, and the directory is scanned again once the index may be written.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        read_only = is_read_only()
+        if not read_only:
+            # create the (possibly empty) log, so that the directory is only scanned once.
+            self._create()
+        for dir_entry in self._scan_artifact_files():
+            entry_info = {"size": dir_entry.stat().st_size, "serializer": "dill", "codec": None}
+            try:
+                with open(f"{dir_entry.path}{ENTRY_INFO_SUFFIX}", 'r') as f:
+                    entry_info.update(json.load(f))
+            except FileNotFoundError:
+                pass
+            entry = self._make_entry(dir_entry.path, entry_info)
+            if read_only:
+                self._apply(entry)
+            else:
+                self._append(entry)
+        if not read_only:
+            self._skip_to_end()
+
+    def _scan_artifact_files(self) -> Iterator[os.DirEntry]:
+        for dir_entry in os.scandir(self.cache_dir):
+            if dir_entry.is_dir() and len(dir_entry.name) == SHARD_WIDTH:
+                yield from (shard_entry for shard_entry in os.scandir(dir_entry.path) 
+                            if shard_entry.is_file() and not shard_entry.name.endswith(_NON_ARTIFACT_SUFFIXES))
+            elif dir_entry.is_file() and not dir_entry.name.endswith(_NON_ARTIFACT_SUFFIXES):
+                yield dir_entry
+
+    def _make_entry(self, cache_path: str, entry_info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "path": self._relative_path(cache_path),
+            "created": time.time(),
+            "status": "complete",
+            **entry_info
+        }
+
+    def _relative_path(self, cache_path: str) -> str:
+        return os.path.relpath(cache_path, self.cache_dir)
+
+_indexes: Dict[str, CacheIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_cache_index(cache_dir: str) -> CacheIndex:
+    """Get the process-wide index of a cache directory, reading it on first use."""
+    key = os.path.abspath(cache_dir)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CacheIndex(cache_dir)
+            index.refresh()
+    return index
@@ -0,0 +1,87 @@
+"""Chunked artifacts: the results of steps whose step function is a generator.
+
+Each chunk a step yields is cached as an artifact of its own as soon as it is yielded, so the step never holds more
+than one chunk. Once the generator is exhausted, a ChunkedArtifact listing the chunks is cached as the step's result.
+An interrupted step leaves its chunks behind without the ChunkedArtifact, and the next run resumes after them.
+"""
+from typing import Any, Iterable, Iterator, List, Optional
+import hashlib
+import os
+
+from .serializers import DEFAULT_SERIALIZER
+from .storage import (CacheRelativeArtifact, artifact_exists, get_artifact_digest, get_artifact_path, get_cache_dir, 
+                      read_artifact, write_artifact)
+
+# the argument through which a step function that accepts it is told which chunk to resume from.
+START_CHUNK_PARAM = "start_chunk"
+
+class ChunkedArtifact(CacheRelativeArtifact):
+    """The result of a step that yielded its result in chunks.
+
+    Iterating over it loads one chunk at a time, so a downstream step that streams through it holds a single chunk
+    rather than the whole result. The chunks are read from the cache every time, bypassing the artifact cache.
+    """
+    def __init__(self, cache_dir: str, chunk_names: List[str], digests: List[str]):
+        super().__init__(cache_dir)
+        # relative to the cache directory, which is set when the ChunkedArtifact is loaded.
+        self.chunk_names = chunk_names
+        # the digests of the chunks make the digest of the ChunkedArtifact, and so the cache names of the
+        # steps downstream of it, change whenever a chunk does.
+        self.digests = digests
+
+    @property
+    def chunk_paths(self) -> List[str]:
+        return [os.path.join(self.cache_dir, chunk_name) for chunk_name in self.chunk_names]
+
+    def __len__(self) -> int:
+        return len(self.chunk_names)
+
+    def __iter__(self) -> Iterator[Any]:
+        for chunk_path in self.chunk_paths:
+            yield read_artifact(chunk_path)
+
+    def load_chunk(self, chunk_num: int) -> Any:
+        return read_artifact(self.chunk_paths[chunk_num])
+
+    def __repr__(self) -> str:
+        return f"ChunkedArtifact({len(self)} chunks)"
+
+def get_chunk_path(cache_path: str, chunk_num: int) -> str:
+    """Get the cache path of a chunk of the step cached at cache_path, next to the other artifacts of its cache directory."""
+    hashed_name = hashlib.sha256(f"{os.path.basename(cache_path)}:chunk:{chunk_num}".encode()).hexdigest()
+    return get_artifact_path(get_cache_dir(cache_path), hashed_name)
+
+def count_cached_chunks(cache_path: str) -> int:
+    """Get the number of leading chunks of the step cached at cache_path that are already cached, e.g. by an interrupted run."""
+    num_chunks = 0
+    while artifact_exists(get_chunk_path(cache_path, num_chunks)):
+        num_chunks += 1
+    return num_chunks
+
+def write_chunked_artifact(cache_path: str, chunks: Iterable[Any], serializer_name: str, codec: Optional[str] = None,
+                           pack: bool = False, first_chunk: int = 0, num_cached_chunks: int = 0) -> ChunkedArtifact:
+    """Cache each chunk as it is produced, and then the ChunkedArtifact listing them at cache_path.
+
+    Args:
+        chunks (Iterable[Any]): The chunks, starting with chunk number first_chunk.
+        serializer_name (str): The serializer of the chunks; the ChunkedArtifact itself always uses the default serializer.
+        first_chunk (int): The number of the first chunk in chunks; the chunks before it are already cached.
+        num_cached_chunks (int): The number of leading chunks that are already cached. Those in chunks are not written again.
+
+    Returns:
+        The ChunkedArtifact.
+    """
+    # recorded with each chunk, so that collect_garbage keeps and evicts the chunks together with the step's result.
+    cache_dir = get_cache_dir(cache_path)
+    manifest = os.path.relpath(cache_path, cache_dir)
+    num_chunks = first_chunk
+    for chunk_num, chunk in enumerate(chunks, first_chunk):
+        if chunk_num >= num_cached_chunks:
+            write_artifact(get_chunk_path(cache_path, chunk_num), chunk, serializer_name, codec, pack,
+                           extra_entry_info={"manifest": manifest})
+        num_chunks = chunk_num + 1
+    chunk_paths = [get_chunk_path(cache_path, chunk_num) for chunk_num in range(num_chunks)]
+    artifact = ChunkedArtifact(cache_dir, [os.path.relpath(chunk_path, cache_dir) for chunk_path in chunk_paths],
+                               [get_artifact_digest(chunk_path) for chunk_path in chunk_paths])
+    write_artifact(cache_path, artifact, DEFAULT_SERIALIZER)
+    return artifact
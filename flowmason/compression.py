@@ -0,0 +1,55 @@
+from contextlib import nullcontext
+from typing import BinaryIO, Dict, Optional, Tuple
+import bz2
+import gzip
+import lzma
+
+# default compression level of each codec, used when the codec is given without a level (e.g., "lzma" rather than "lzma:9").
+CODEC_DEFAULT_LEVELS: Dict[str, int] = {
+    "zlib": 6,
+    "lzma": 6,
+    "bz2": 9
+}
+_default_codec: Optional[str] = None
+
+def parse_codec(codec: str) -> Tuple[str, int]:
+    """Split a codec spec such as "zlib" or "lzma:9" into the codec name and compression level."""
+    name, _, level = codec.partition(":")
+    if name not in CODEC_DEFAULT_LEVELS:
+        raise ValueError(f"Unknown codec {name}. Expected one of {list(CODEC_DEFAULT_LEVELS.keys())}.")
+    return name, int(level) if level else CODEC_DEFAULT_LEVELS[name]
+
+def set_default_codec(codec: Optional[str]):
+    """Set the codec used by steps that do not pick one with the "codec" step param. None disables compression."""
+    global _default_codec
+    if codec is not None:
+        parse_codec(codec)
+    _default_codec = codec
+
+def resolve_codec(step_kwargs: Dict) -> Optional[str]:
+    return step_kwargs.get("codec", _default_codec)
+
+def open_compressed_writer(f: BinaryIO, codec: Optional[str]):
+    """Wrap a binary file so that everything written to it is compressed with the codec.
+
+    Closing the returned stream finishes the compressed stream but does not close f.
+    """
+    if codec is None:
+        return nullcontext(f)
+    name, level = parse_codec(codec)
+    if name == "zlib":
+        # no file name or timestamp in the header, so that the same bytes always compress to the same output.
+        return gzip.GzipFile(filename="", fileobj=f, mode='wb', compresslevel=level, mtime=0)
+    if name == "lzma":
+        return lzma.LZMAFile(f, 'wb', preset=level)
+    return bz2.BZ2File(f, 'wb', compresslevel=level)
+
+def open_compressed_reader(f: BinaryIO, codec: Optional[str]):
+    if codec is None:
+        return nullcontext(f)
+    name, _ = parse_codec(codec)
+    if name == "zlib":
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if name == "lzma":
+        return lzma.LZMAFile(f, 'rb')
+    return bz2.BZ2File(f, 'rb')
@@ -1,20 +1,36 @@
-import ipdb
-# import ipdb
-import pdb
+from collections import deque
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dataclasses import dataclass
+import contextvars
 import hashlib
-from typing import Any, Tuple, Callable, Dict, OrderedDict, List, Union
-import dill
+import inspect
+from typing import Any, Tuple, Callable, Dict, Iterable, Iterator, OrderedDict, List, Optional, Union
 import datetime 
-import loguru
 import os
 import json
+import time
+import tracemalloc
+import warnings
+
+from .result_registry import result_registry
+from .cache_index import get_cache_index
+from .chunks import START_CHUNK_PARAM, count_cached_chunks, write_chunked_artifact
+from .compression import resolve_codec
+from .leases import get_lease_manager
+from .log import logger
+from .prefetch import PREFETCH_THREADS, prefetcher
+from .profiling import StepProfile, profile_step, timed_reduce_fn
+from .run_store import get_run_store
+from .serializers import DEFAULT_SERIALIZER, resolve_serializer_name
+from .storage import (MissingArtifactError, artifact_exists, find_artifact, get_artifact_digest, get_artifact_path, 
+                      load_cached_artifact, read_artifact, serialize_artifact, write_artifact, write_serialized_artifact)
 
 @dataclass
 class SingletonStep:
     step_fn: Callable
     step_params: Dict[str, Any]
+    batched: bool = False # in a MapReduceStep, called once per batch of map items with lists of per-item values; see batch_step_wrapper
 
 @dataclass
 class MapReduceStep:
@@ -22,16 +38,32 @@ class MapReduceStep:
     map_params: Dict[str, List] 
     constant_params: Dict[str, Any]
     reduce_fn: Callable
+    max_workers: int = 1 # number of map parameter settings (or batches, see batch_size) to run at the same time
+    executor: str = "thread" # "thread", "process" or "async" (see ASYNC_EXECUTOR), as for conduct
+    reduce_mode: str = "all" # one of REDUCE_MODES; see _reduce_results
+    batch_size: Optional[int] = None # number of map parameter settings passed to each call of a batched step
 
 CACHE_DIR = "cache"
-logger = loguru.logger
+EXECUTORS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor
+}
+# runs async def step functions concurrently on an event loop, with max_workers as the concurrency limit; see async_dag.
+ASYNC_EXECUTOR = "async"
+REDUCE_MODES = ("all", "fold", "tree")
+# step params that configure flowmason rather than the step; they are not passed to the step function.
+RESERVED_STEP_PARAMS = ("serializer", "codec", "pack")
+NO_RESULT_TO_CACHE = "no result to cache"
+_NO_RESULT = object()
 
 def create_metadata(step_version, 
                  step_kwargs, start_time: str, end_time: str,
-                 cache_dir: str, execution_status: str):
-    cache_name = _get_step_cache_name(step_kwargs['step_name'], step_version, step_kwargs)
-    hash_name = hashlib.sha256(cache_name.encode()).hexdigest()
-    hashed_fcache_name = os.path.join(cache_dir, hash_name)
+                 cache_dir: str, execution_status: str, cache_path: Optional[str] = None,
+                 profile: Optional[StepProfile] = None):
+    if cache_path is None:
+        cache_name = _get_step_cache_name(step_kwargs['step_name'], step_version, step_kwargs)
+        hash_name = hashlib.sha256(cache_name.encode()).hexdigest()
+        cache_path = get_artifact_path(cache_dir, hash_name)
     return {
             "version": step_version,
             "date": datetime.datetime.now().strftime("%Y-%m-%d"),
@@ -39,31 +71,67 @@ def create_metadata(step_version,
             "end_time": end_time,
             "kwargs": step_kwargs,
             "execution_status": execution_status,
-            "cache_path": hashed_fcache_name
+            "cache_path": cache_path,
+            "serializer": resolve_serializer_name(step_kwargs),
+            **({"profile": profile.to_dict()} if profile is not None else {})
     }
 
 def cache_result(cache_dir: str, step_name, step_version, step_kwargs, result: Any):
     cache_name = _get_step_cache_name(step_name, step_version, step_kwargs)
+    serializer_name = resolve_serializer_name(step_kwargs)
+    codec = resolve_codec(step_kwargs)
+    pack = step_kwargs.get("pack", False)
 
     os.makedirs(cache_dir, exist_ok=True)
     # with open(cache_name, 'wb') as f:
     cache_hashed_name = hashlib.sha256(cache_name.encode()).hexdigest()
     logger.info(f"Caching result of step {step_name} at {cache_hashed_name}")
-    with open(os.path.join(cache_dir, str(cache_hashed_name)), 'wb') as f:
-        dill.dump(result, f)
+    cache_path = get_artifact_path(cache_dir, cache_hashed_name)
+    if result_registry.active:
+        # downstream steps get the live result, and their cache names the digest, right away; 
+        # only compressing and writing the serialized result happens on the registry's writer thread.
+        data, digest = serialize_artifact(result, serializer_name)
+        result_registry.put(cache_path, result, digest, len(data),
+                            partial(write_serialized_artifact, cache_path, data, serializer_name, codec, pack))
+    else:
+        write_artifact(cache_path, result, serializer_name, codec, pack)
     # return the cache path
-    return os.path.join(cache_dir, cache_hashed_name)
+    return cache_path
+
+def _load_result(result_cache_path: str):
+    if result_cache_path in result_registry:
+        return result_registry.get(result_cache_path)
+    prefetched = prefetcher.take(result_cache_path)
+    if prefetched is not None:
+        return prefetched.result()
+    # a result released from the registry may still be being written.
+    result_registry.wait_for_write(result_cache_path)
+    return load_cached_artifact(result_cache_path)
+
+def _release_result(result_cache_path: Optional[str]):
+    """Drop the in-memory copies of a result (see ResultRegistry.release) once no step of the run needs it anymore."""
+    if result_cache_path is None or result_cache_path == NO_RESULT_TO_CACHE:
+        return
+    result_registry.release(result_cache_path)
+    prefetcher.discard(result_cache_path)
+
+def _take_map_result(result_cache_path: str):
+    """Load the result of a map item for the reduce, which is the only step that needs it."""
+    result = _load_result(result_cache_path)
+    _release_result(result_cache_path)
+    return result
 
 def load_from_cache(cache_dir, step_name, step_version, step_kwargs):
     cache_name = _get_step_cache_name(step_name, step_version, step_kwargs)
     cache_hashed_name = hashlib.sha256(cache_name.encode()).hexdigest()
 
-    try:
-        with open(os.path.join(cache_dir, f"{cache_hashed_name}"), 'rb') as f:
-            return dill.load(f)
-    except FileNotFoundError: # we started using hashed names later on, so we need to check for both.
-        with open(os.path.join(cache_dir, cache_name), 'rb') as f:
-            return dill.load(f)
+    cache_path, is_cached = find_artifact(cache_dir, cache_hashed_name)
+    if is_cached:
+        return read_artifact(cache_path)
+    # we started using hashed names later on, so we need to check for both.
+    import dill
+    with open(os.path.join(cache_dir, cache_name), 'rb') as f:
+        return dill.load(f)
 
 def _get_step_cache_name(step_name, step_version, step_kwargs):
     kwargs = step_kwargs.copy()
@@ -72,6 +140,11 @@ def _get_step_cache_name(step_name, step_version, step_kwargs):
         kwargs.pop("version")
     if "step_name" in kwargs:
         kwargs.pop("step_name")
+    # the codec and packing are recorded with each artifact, so they do not change the cache entry.
+    if "codec" in kwargs:
+        kwargs.pop("codec")
+    if "pack" in kwargs:
+        kwargs.pop("pack")
     # remove k-v pairs where the key ends in "_ignore"
     for k in list(kwargs.keys()):
         if k.endswith("_ignore"):
@@ -79,30 +152,97 @@ def _get_step_cache_name(step_name, step_version, step_kwargs):
     kwarg_str = "-".join([f"{k}={v}" for k, v in sorted(kwargs.items())])
     return f"{step_name}-{step_version}-{kwarg_str}.dill" if kwarg_str else f"{step_name}-{step_version}.dill"
 
-# TODO: need to re-write this so it can check for both types of steps.
-def _check_should_execute(cache_name: str, curr_step_arguments: Dict[str, Any], 
-                          cache_dir: str,
-                          previous_steps_to_execute: List[str]):
-    hash_name = hashlib.sha256(cache_name.encode()).hexdigest()
-    hashed_fcache_name = os.path.join(cache_dir, hash_name)
-    for step in previous_steps_to_execute:
-        if step in curr_step_arguments.values(): # TODO: in this case, we should delete the previously cached value for this step. This will fix a substantial bug.
-            return True 
-    if not os.path.exists(hashed_fcache_name):
-        return True
-    return False
+def _get_cache_key_kwargs(step_kwargs: Dict[str, Any], cache_map: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Replace each argument that names an upstream step with the digest of that step's cached artifact.
+
+    The cache name of a step then depends on the contents of its inputs rather than on whether the
+    upstream steps were re-executed: an upstream step that is re-run and produces the same bytes does not
+    invalidate the steps that consume it (early cutoff).
+
+    Returns:
+        The keyword arguments to build the cache name from, or None if an upstream step has no cached
+        artifact (e.g., it returned None), in which case the step cannot be looked up in the cache.
+    """
+    key_kwargs = step_kwargs.copy()
+    for key, value in step_kwargs.items():
+        if not isinstance(value, str) or value == step_kwargs.get("step_name") or value not in cache_map:
+            continue
+        if not artifact_exists(cache_map[value]):
+            return None
+        key_kwargs[key] = f"{value}@{get_artifact_digest(cache_map[value])}"
+    # results written with a non-default serializer get their own cache entries, even when the 
+    # serializer was picked with set_default_serializer rather than the step params.
+    serializer_name = resolve_serializer_name(step_kwargs)
+    if serializer_name != DEFAULT_SERIALIZER:
+        key_kwargs["serializer"] = serializer_name
+    return key_kwargs
+
+def _cache_step_result(cache_dir: str, step_name: str, step_version: str, step_kwargs: Dict[str, Any],
+                       cache_map: Dict[str, str], result: Any) -> str:
+    key_kwargs = _get_cache_key_kwargs(step_kwargs, cache_map)
+    return cache_result(cache_dir, step_name, step_version, step_kwargs if key_kwargs is None else key_kwargs, result)
+
+def _get_metadata_cache_path(result_cache_path: str) -> Optional[str]:
+    # steps that returned None have no cache path of their own; create_metadata falls back to the name-based path.
+    return None if result_cache_path == NO_RESULT_TO_CACHE else result_cache_path
+
+def _lookup_cache(step_name: str, step_version: str, step_kwargs: Dict[str, Any], 
+                  cache_map: Dict[str, str], cache_dir: str) -> Tuple[Optional[str], bool]:
+    """Get the cache path of a step given the artifacts of its upstream steps, and whether it is already cached."""
+    key_kwargs = _get_cache_key_kwargs(step_kwargs, cache_map)
+    if key_kwargs is None:
+        return None, False
+    cache_name = _get_step_cache_name(step_name, step_version, key_kwargs)
+    # entries that are superseded by a new version are deleted by flowmason.cache_gc.collect_garbage.
+    # the index was refreshed when the run started, so this does not touch the file system.
+    return find_artifact(cache_dir, hashlib.sha256(cache_name.encode()).hexdigest(), refresh=False)
+
+def _get_map_items(map_params: Dict[str, List]) -> List[Dict[str, Any]]:
+    """Split the map params of a MapReduceStep into one dictionary of keyword arguments per map iteration."""
+    num_map_param_settings = len(map_params[list(map_params.keys())[0]])
+    return [{k: v[i] for k, v in map_params.items()} for i in range(num_map_param_settings)]
+
+def get_map_item_key(map_item: Dict[str, Any]) -> str:
+    """Get the identity of a map iteration from its map parameter values.
+
+    The key does not depend on the position of the item in the map params, so inserting
+    or reordering items does not change the cache names of the other items.
+    """
+    return "-".join([f"{k}={v}" for k, v in sorted(map_item.items())])
+
+def _get_map_singleton_step_name(map_reduce_step_name: str, singleton_step_name: str, map_item_key: str) -> str:
+    return f"{map_reduce_step_name}_{singleton_step_name}_{map_item_key}"
+
+def _get_map_chain_kwargs(mapreduce_step_name: str, map_reduce_step: MapReduceStep, 
+                          map_item: Dict[str, Any]) -> OrderedDict[str, Dict[str, Any]]:
+    """Get the keyword arguments of each singleton step in the chain for one map item."""
+    map_item_key = get_map_item_key(map_item)
+    # add the constant params to the map_kwargs
+    map_kwargs = {**map_item, **map_reduce_step.constant_params}
+    chain_kwargs = OrderedDict()
+    for singleton_step_name, singleton_step_impl in map_reduce_step.step_fns.items():
+        # the singleton step params override the map kwargs when there is a conflict.
+        chain_kwargs[singleton_step_name] = {
+            **map_kwargs, 
+            **singleton_step_impl.step_params, 
+            "step_name": _get_map_singleton_step_name(mapreduce_step_name, singleton_step_name, map_item_key)
+        }
+    return chain_kwargs
 
 def get_singleton_map_reduce_cache_name(map_reduce_step_name: str, 
-                                        map_reduce_iteration: int,
+                                        map_item_key: str,
                                         singleton_step_name: str,
                                         singleton_step_version: str,
                                         singleton_step_kwargs: Dict[str, Any], 
                                         map_kwargs: Dict[str, Any]):
     """Get the cache name for a singleton step in a map reduce step.
 
+    Deprecated: the cache names of steps that refer to the results of other steps now include the digests of
+    those results (see _get_cache_key_kwargs), which this name leaves out. Use _lookup_map_chain instead.
+
     Args:
         map_reduce_step_name (str): Name of the map reduce step
-        map_reduce_iteration (int): Index of the current map reduce iteration
+        map_item_key (str): Key of the current map reduce iteration (from get_map_item_key)
         singleton_step_name (str): Name of the singleton step
         singleton_step_version (str): Version of the singleton step
         singleton_step_kwargs (Dict[str, Any]): Keyword arguments
@@ -110,248 +250,956 @@ def get_singleton_map_reduce_cache_name(map_reduce_step_name: str,
         map_kwargs (Dict[str, Any]): Keyword arguments from the MapReduceStep.map_params
             and MapReduceStep.constant_params
     """
-    # use _get_step_cache_name function with all of the provided parameters to get the cache name for the singleton step
-    step_name = f"{map_reduce_step_name}_{singleton_step_name}_{map_reduce_iteration}"
-    singleton_step_cache_name = _get_step_cache_name(
-        f"{map_reduce_step_name}_{singleton_step_name}_{map_reduce_iteration}",
-        singleton_step_version,
-        {**map_kwargs, **singleton_step_kwargs, "step_name": step_name}, # NOTE: watch out for inconsistencies in the ordering of the map_kwargs and singleton_step_kwargs
-    )
-    return singleton_step_cache_name
-
-def _check_should_execute_map_reduce(curr_step_name: str, 
-                                     cache_dir: str,
-                                     map_reduce_arguments: Dict[str, Any], 
-                                     constant_params: Dict[str, Any],
-                                     previous_steps_to_execute_names: List[str], 
-                                     singleton_steps: OrderedDict[str, SingletonStep]):
-    # Conditions under which the map reduce step should be re-executed
-        #1 Change to the map parameters (e.g., adding another user)
-        #2 Change to the constant parameters
-        #3 any of the previous steps to execute are dependencies of the map reduce step
-        #4 Changes to the singleton steps that are used in the map reduce step
-    # 1,2,3 are covered by the _check_should_execute function
-    # NOTE: we should probably add a check to ensure that the keys in map_reduce_arguments and constant_params are disjoint.
-    cache_name = _get_step_cache_name(curr_step_name, constant_params['version'], {**map_reduce_arguments, **constant_params}) 
-    should_execute_general = _check_should_execute(cache_name,  map_reduce_arguments, cache_dir, previous_steps_to_execute_names)
-    singletons_changed = False
-    for i in range(len(map_reduce_arguments[list(map_reduce_arguments.keys())[0]])):
-        map_kwargs = {k: v[i] for k, v in map_reduce_arguments.items()}
-        # add the constant params to the map_kwargs
-        map_kwargs = {**map_kwargs, **constant_params}
-        for singleton_step_name, singleton_step_impl in singleton_steps.items():
-        # TODO: need to fix: we need to use both the map params and the constant params to check if the singleton step should be re-executed.
-            fn_kwargs = {
-                            **map_kwargs, 
-                            **singleton_step_impl.step_params, 
-                            "step_name": f"{curr_step_name}_{singleton_step_name}_{i}"
-                    }
-            cache_name = get_singleton_map_reduce_cache_name(curr_step_name, i, singleton_step_name, singleton_step_impl.step_params['version'], singleton_step_impl.step_params, map_kwargs)
-            should_execute_singleton = _check_should_execute(cache_name,  fn_kwargs, cache_dir, previous_steps_to_execute_names)
-            if should_execute_singleton:
-                singletons_changed = True
-    return should_execute_general or singletons_changed
-
-
-    # for 4, we need to iterate through 
-
-    
-
-    pass
+    warnings.warn("get_singleton_map_reduce_cache_name is deprecated; the cache names of steps that refer to other "
+                  "steps include the digests of their results.", DeprecationWarning, stacklevel=2)
+    step_name = _get_map_singleton_step_name(map_reduce_step_name, singleton_step_name, map_item_key)
+    return _get_step_cache_name(step_name, singleton_step_version,
+                                {**map_kwargs, **singleton_step_kwargs, "step_name": step_name})
 
+def _lookup_map_chain(mapreduce_step_name: str, map_reduce_step: MapReduceStep, map_item: Dict[str, Any],
+                      cache_map: Dict[str, str], cache_dir: str) -> Optional[List[str]]:
+    """Get the cache paths of the chain of singleton steps for one map item, or None if any of them is not cached."""
+    map_param_setting_cache = {}
+    for singleton_step_name, fn_kwargs in _get_map_chain_kwargs(mapreduce_step_name, map_reduce_step, map_item).items():
+        cache_path, is_cached = _lookup_cache(fn_kwargs["step_name"], fn_kwargs["version"], fn_kwargs,
+                                              {**cache_map, **map_param_setting_cache}, cache_dir)
+        if not is_cached:
+            return None
+        map_param_setting_cache[singleton_step_name] = cache_path
+    return list(map_param_setting_cache.values())
+
+def get_map_items_to_execute(mapreduce_step_name: str, map_reduce_step: MapReduceStep,
+                             cache_map: Dict[str, str], cache_dir: str) -> List[Dict[str, Any]]:
+    """Get the map items of a map reduce step whose chain of singleton steps is not fully cached.
+
+    Args:
+        mapreduce_step_name (str): Name of the map reduce step
+        map_reduce_step (MapReduceStep): The map reduce step
+        cache_map (Dict[str, str]): Paths to the results of the steps that come before the map reduce step
+        cache_dir (str): The cache directory
+
+    Returns:
+        The map parameter values (one dictionary per item) of the items that need to be executed, in map order.
+    """
+    return [map_item for map_item in _get_map_items(map_reduce_step.map_params)
+            if _lookup_map_chain(mapreduce_step_name, map_reduce_step, map_item, cache_map, cache_dir) is None]
+
+def _get_reduce_kwargs(mapreduce_step_name: str, map_reduce_step: MapReduceStep, final_result_paths: List[str]) -> Dict[str, Any]:
+    """Get the keyword arguments the reduce is cached under, which include the digests of the results of all map items."""
+    map_results_sha = hashlib.sha256()
+    for path in final_result_paths:
+        map_results_sha.update(get_artifact_digest(path).encode())
+    return {
+        **map_reduce_step.map_params, 
+        **map_reduce_step.constant_params, 
+        "step_name": mapreduce_step_name,
+        "map_results": map_results_sha.hexdigest()
+    }
+
+def _lookup_map_reduce_cache(mapreduce_step_name: str, map_reduce_step: MapReduceStep,
+                             cache_map: Dict[str, str], cache_dir: str) -> Tuple[Optional[str], List[Dict[str, Any]], List[str]]:
+    """Look up the result of a map reduce step.
+
+    Returns:
+        Tuple of the path to the cached result (None if the step needs to be executed), the map items 
+        whose chain needs to be executed, and the paths to the results of the chains that are cached.
+    """
+    final_result_paths = []
+    chain_result_paths = []
+    map_items_to_execute = []
+    for map_item in _get_map_items(map_reduce_step.map_params):
+        chain_cache_paths = _lookup_map_chain(mapreduce_step_name, map_reduce_step, map_item, cache_map, cache_dir)
+        if chain_cache_paths is None:
+            map_items_to_execute.append(map_item)
+        else:
+            final_result_paths.append(chain_cache_paths[-1])
+            chain_result_paths.extend(chain_cache_paths)
+    if map_items_to_execute:
+        return None, map_items_to_execute, chain_result_paths
+    cache_path, is_cached = _lookup_cache(mapreduce_step_name, map_reduce_step.constant_params["version"],
+                                          _get_reduce_kwargs(mapreduce_step_name, map_reduce_step, final_result_paths),
+                                          cache_map, cache_dir)
+    return cache_path if is_cached else None, map_items_to_execute, chain_result_paths
+
+def _substitute_result(value: Any, step_name: str, cache_map: Dict[str, str]) -> Any:
+    if value != step_name and isinstance(value, str) and value in cache_map: # substitute the value with the result of the step.
+        return _load_result(cache_map[value])
+    return value
+
+def _get_input_paths(kwargs: Dict[str, Any], cache_map: Dict[str, str]) -> List[str]:
+    """Get the paths to the results of the upstream steps that _substitute_result loads for a step."""
+    return [cache_map[value] for value in kwargs.values()
+            if value != kwargs.get("step_name") and isinstance(value, str) and value in cache_map 
+            and cache_map[value] != NO_RESULT_TO_CACHE]
+
+def _prefetch_ahead(result_paths: Iterable[str], window: int = 2 * PREFETCH_THREADS) -> Iterator[str]:
+    """Iterate over result paths, prefetching the next window of them."""
+    if not prefetcher.active:
+        yield from result_paths
+        return
+    upcoming = deque()
+    for path in result_paths:
+        upcoming.append(path)
+        prefetcher.prefetch([path])
+        if len(upcoming) > window:
+            yield upcoming.popleft()
+    yield from upcoming
+
+def _check_executor(executor: str):
+    if executor not in EXECUTORS and executor != ASYNC_EXECUTOR:
+        raise ValueError(f"Unknown executor {executor}. Expected one of {list(EXECUTORS.keys()) + [ASYNC_EXECUTOR]}.")
+
+def _run_coroutine(coroutine):
+    """Run a coroutine to completion on a new event loop, from synchronous code."""
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # this thread already runs an event loop (e.g., in a notebook), so the coroutine gets its own thread,
+    # with a copy of this thread's context (e.g., the profile of the running step).
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
+
+def _call_step_fn(step_func, *args, **kwargs):
+    """Call a step function. Coroutine functions (async def) are run to completion on a new event loop."""
+    if not inspect.iscoroutinefunction(step_func):
+        return step_func(*args, **kwargs)
+    return _run_coroutine(step_func(*args, **kwargs))
+
+def _prepare_step_call(kwargs: Dict[str, Any], cache_map: Dict[str, str]) -> Dict[str, Any]:
+    """Get the arguments to call a step function with: the results of upstream steps are loaded, and reserved params removed."""
+    step_name = kwargs["step_name"]
+    logger.info(f"Running step {step_name}")
+    # the inputs load concurrently.
+    prefetcher.prefetch(_get_input_paths(kwargs, cache_map))
+    #### DAG input logic goes here. ####:
+    call_kwargs = {key: _substitute_result(value, step_name, cache_map) for key, value in kwargs.items()}
+    for reserved_param in RESERVED_STEP_PARAMS:
+        call_kwargs.pop(reserved_param, None)
+    return call_kwargs
+
+def _finish_step_call(cache_dir: str, kwargs: Dict[str, Any], cache_map: Dict[str, str], result: Any) -> Tuple[str, str]:
+    if result is not None:
+        cache_path = _cache_step_result(cache_dir, kwargs["step_name"], kwargs["version"], kwargs, cache_map, result)
+        return cache_path, "executed"
+    else:
+        logger.info(f"Step {kwargs['step_name']} returned None, not caching.")
+        return NO_RESULT_TO_CACHE, "executed"
+
+def _run_chunked_step(step_func, cache_dir: str, kwargs: Dict[str, Any], cache_map: Dict[str, str],
+                      call_kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    """Run a step whose step function is a generator, caching each chunk it yields as it is yielded (see flowmason.chunks).
+
+    The chunks cached by an interrupted run of the step are reused: a step function with a start_chunk argument
+    is asked to start from the first chunk that is missing, and the chunks any other generator yields before it are dropped.
+    """
+    step_name = kwargs["step_name"]
+    key_kwargs = _get_cache_key_kwargs(kwargs, cache_map)
+    cache_name = _get_step_cache_name(step_name, kwargs["version"], kwargs if key_kwargs is None else key_kwargs)
+    cache_path = get_artifact_path(cache_dir, hashlib.sha256(cache_name.encode()).hexdigest())
+    num_cached_chunks = count_cached_chunks(cache_path)
+    if num_cached_chunks:
+        logger.info(f"Reusing the {num_cached_chunks} chunks of step {step_name} cached by an interrupted run")
+    first_chunk = 0
+    if START_CHUNK_PARAM in inspect.signature(step_func).parameters:
+        call_kwargs = {**call_kwargs, START_CHUNK_PARAM: num_cached_chunks}
+        first_chunk = num_cached_chunks
+    logger.info(f"Caching the chunks of step {step_name} at {os.path.basename(cache_path)}")
+    os.makedirs(cache_dir, exist_ok=True)
+    write_chunked_artifact(cache_path, step_func(**call_kwargs), resolve_serializer_name(kwargs), resolve_codec(kwargs),
+                           kwargs.get("pack", False), first_chunk, num_cached_chunks)
+    return cache_path, "executed"
 
 def step_wrapper(step_func, cache_map: Dict[str, str], cache_dir: str):
     def wrapper(*args, **kwargs):
-        step_name = kwargs["step_name"]
-        step_version = kwargs["version"]
-        # TODO: right now, the step does not get re-executed when one of the dependencies are out of date.
-        logger.info(f"Running step {step_name}")
-
-        #### DAG input logic goes here. ####:
-        original_kwargs = kwargs.copy()
-        for key, value in kwargs.items(): 
-            if value == step_name:
-                continue
-            if value in cache_map: # substitute the value with the result of the step.
-                kwargs[key] = dill.load(open(cache_map[value], 'rb'))
-        result = step_func(*args, **kwargs)
-        if result is not None:
-            cache_path = cache_result(cache_dir, step_name, step_version, original_kwargs, result)
-            return cache_path, "executed"
-        else:
-            logger.info(f"Step {step_name} returned None, not caching.")
-            return "no result to cache", "executed"
+        if inspect.isgeneratorfunction(step_func):
+            return _run_chunked_step(step_func, cache_dir, kwargs, cache_map, _prepare_step_call(kwargs, cache_map))
+        result = _call_step_fn(step_func, *args, **_prepare_step_call(kwargs, cache_map))
+        return _finish_step_call(cache_dir, kwargs, cache_map, result)
     return wrapper
 
+def batch_step_wrapper(step_func, cache_maps: List[Dict[str, str]], cache_dir: str, batched_keys: Iterable[str]):
+    """Wrap a batched step so that it is called once for several map items, caching each of its results under its own map item.
+
+    Args:
+        step_func: Takes a list of values (one per map item) for each argument in batched_keys, and a single value
+            for the other arguments, which are the same for every map item. Returns a sequence with one result per map item.
+        cache_maps (List[Dict[str, str]]): The cache map of each map item.
+        cache_dir (str): The cache directory.
+        batched_keys (Iterable[str]): The arguments that differ between map items.
+    """
+    def wrapper(items_kwargs: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        results = _call_step_fn(step_func, **_prepare_batch_call(items_kwargs, cache_maps, batched_keys))
+        return _finish_batch_call(cache_dir, items_kwargs, cache_maps, results)
+    return wrapper
+
+def _prepare_batch_call(items_kwargs: List[Dict[str, Any]], cache_maps: List[Dict[str, str]], 
+                        batched_keys: Iterable[str]) -> Dict[str, Any]:
+    step_names = [kwargs["step_name"] for kwargs in items_kwargs]
+    logger.info(f"Running step {step_names[0]} as a batch of {len(step_names)} map items")
+    prefetcher.prefetch(path for kwargs, cache_map in zip(items_kwargs, cache_maps) 
+                        for path in _get_input_paths(kwargs, cache_map))
+    batch_kwargs = {}
+    for key, value in items_kwargs[0].items():
+        if key in RESERVED_STEP_PARAMS:
+            continue
+        if key in batched_keys:
+            batch_kwargs[key] = [_substitute_result(kwargs[key], step_name, cache_map) 
+                                 for kwargs, step_name, cache_map in zip(items_kwargs, step_names, cache_maps)]
+        else:
+            batch_kwargs[key] = _substitute_result(value, step_names[0], cache_maps[0])
+    return batch_kwargs
+
+def _finish_batch_call(cache_dir: str, items_kwargs: List[Dict[str, Any]], cache_maps: List[Dict[str, str]], 
+                       results) -> List[Tuple[str, str]]:
+    if len(results) != len(items_kwargs):
+        raise ValueError(f"Batched step {items_kwargs[0]['step_name']} returned {len(results)} results for {len(items_kwargs)} map items.")
+    return [_finish_step_call(cache_dir, kwargs, cache_map, result) 
+            for kwargs, cache_map, result in zip(items_kwargs, cache_maps, results)]
+
+def _get_batched_keys(map_reduce_step: MapReduceStep, singleton_step_name: str) -> List[str]:
+    """Get the arguments of a singleton step in a map reduce step that differ between map items.
+
+    These are its step name, the map params (unless the step overrides them), and the arguments that refer to 
+    the results of the previous steps in the chain.
+    """
+    step_params = map_reduce_step.step_fns[singleton_step_name].step_params
+    batched_keys = ["step_name"] + [key for key in map_reduce_step.map_params if key not in step_params]
+    for key, value in step_params.items():
+        if isinstance(value, str) and value in map_reduce_step.step_fns and value != singleton_step_name:
+            batched_keys.append(key)
+    return batched_keys
+
+def _release_claim(cache_dir: str, cache_path: str):
+    """Release the lease on a step's result, once the result is in the cache directory."""
+    try:
+        # with write_behind, the result is written in the background.
+        result_registry.wait_for_write(cache_path)
+    finally:
+        get_lease_manager(cache_dir).release(cache_path)
+
+def _get_chain_releases(map_reduce_step: MapReduceStep) -> Dict[str, List[str]]:
+    """Get the steps of a map chain whose results can be released once each step of the chain has run.
+
+    The result of a step is released after the last step of the chain that refers to it, or right away if
+    no later step does. The results of the last step are released by the reduce.
+    """
+    chain_step_names = list(map_reduce_step.step_fns.keys())
+    last_consumers = {}
+    for i, singleton_step_impl in enumerate(map_reduce_step.step_fns.values()):
+        for value in singleton_step_impl.step_params.values():
+            if isinstance(value, str) and value in chain_step_names[:i]:
+                last_consumers[value] = chain_step_names[i]
+    releases = {singleton_step_name: [] for singleton_step_name in chain_step_names}
+    for singleton_step_name in chain_step_names[:-1]:
+        releases[last_consumers.get(singleton_step_name, singleton_step_name)].append(singleton_step_name)
+    return releases
+
+class _MapChains:
+    """The chains of singleton steps of a map reduce step for a batch of map parameter settings, as they are run one step at a time."""
+    def __init__(self, mapreduce_step_name: str, map_reduce_step: MapReduceStep, indices: List[int],
+                 cache_map: Dict[str, str], cache_dir: str, measure_cpu: bool = True, cooperative: bool = False,
+                 wait_for_others: bool = True):
+        self.map_reduce_step = map_reduce_step
+        self.measure_cpu = measure_cpu
+        self.cache_map = cache_map
+        self.cache_dir = cache_dir
+        # see conduct's cooperative argument. Map items claimed by other processes are waited for once the items
+        # claimed by this process have run, or with wait_for_others=False, left incomplete.
+        self.leases = get_lease_manager(cache_dir) if cooperative else None
+        self.wait_for_others = wait_for_others
+        self.claimed: Dict[int, str] = {} # index in the batch -> cache path, for the current step
+        self.deferred: List[Tuple[int, Dict[str, Any], Dict[str, str], str]] = []
+        self.incomplete = set()
+        self.items_metadata = [[] for _ in indices]
+        self.items_cache = [{} for _ in indices]
+        self.releases = _get_chain_releases(map_reduce_step)
+        self.items_chain_kwargs = [_get_map_chain_kwargs(mapreduce_step_name, map_reduce_step, 
+                                                         {k: v[i] for k, v in map_reduce_step.map_params.items()})
+                                   for i in indices]
+
+    def lookup_step(self, singleton_step_name: str) -> List[Tuple[int, Dict[str, Any], Dict[str, str]]]:
+        """Look up a singleton step in the cache for each map item, recording the cached ones.
+
+        Returns:
+            The index in the batch, step kwargs and cache map of each map item the step needs to be executed for.
+        """
+        items_to_execute = []
+        for j, chain_kwargs in enumerate(self.items_chain_kwargs):
+            if j in self.incomplete:
+                continue
+            fn_kwargs = chain_kwargs[singleton_step_name]
+            # combine cache map with the results of the previous steps in the chain
+            chain_cache_map = {**self.cache_map, **self.items_cache[j]} # NOTE: there will be an overwrite issue here, if one of the map reduce step was also an external singleton step. But that shouldn't be happening anyway, since step names should be unique.
+            with profile_step(self.measure_cpu) as profile:
+                result_cache_path, is_cached = _lookup_cache(fn_kwargs["step_name"], fn_kwargs["version"], fn_kwargs,
+                                                             chain_cache_map, self.cache_dir)
+            if is_cached:
+                logger.info(f"Step {singleton_step_name} is cached at {result_cache_path}, continuing.")
+                profile.cache = "hit"
+                self._record_cached(singleton_step_name, j, fn_kwargs, result_cache_path, profile)
+            elif self.leases is None or result_cache_path is None or self.leases.claim(result_cache_path):
+                if self.leases is not None and result_cache_path is not None:
+                    self.claimed[j] = result_cache_path
+                items_to_execute.append((j, fn_kwargs, chain_cache_map))
+            elif artifact_exists(result_cache_path):
+                # cached by another process since it was looked up.
+                self._record_cached(singleton_step_name, j, fn_kwargs, result_cache_path, profile)
+            else:
+                self.deferred.append((j, fn_kwargs, chain_cache_map, result_cache_path))
+        return items_to_execute
+
+    def _record_cached(self, singleton_step_name: str, j: int, fn_kwargs: Dict[str, Any], result_cache_path: str,
+                       profile: Optional[StepProfile] = None):
+        metadata = create_metadata(
+            self.map_reduce_step.step_fns[singleton_step_name].step_params['version'], 
+            fn_kwargs, "00:00:00", "00:00:00",
+        self.cache_dir, "cached", result_cache_path, profile)
+        self.items_metadata[j].append([singleton_step_name, metadata])
+        # add to cache map
+        self.items_cache[j][singleton_step_name] = result_cache_path
+
+    def release_claims(self):
+        """Release the leases on the map items of the current step, once their results are in the cache directory."""
+        claimed, self.claimed = self.claimed, {}
+        for cache_path in claimed.values():
+            _release_claim(self.cache_dir, cache_path)
+
+    def wait_for_deferred(self, singleton_step_name: str) -> List[Tuple[int, Dict[str, Any], Dict[str, str]]]:
+        """Wait for the map items of a step that other processes claimed.
+
+        Returns:
+            The map items that this process has claimed instead, since their lease was released (or abandoned)
+            without their result being cached. They need to be executed.
+        """
+        if not self.wait_for_others:
+            self.incomplete.update(j for j, _, _, _ in self.deferred)
+            self.deferred = []
+            return []
+        if self.deferred:
+            logger.info(f"Waiting for {len(self.deferred)} map items of step {singleton_step_name} that other processes are running.")
+        items_to_execute = []
+        while self.deferred and not items_to_execute:
+            still_deferred = []
+            for j, fn_kwargs, chain_cache_map, result_cache_path in self.deferred:
+                status = self.leases.poll(result_cache_path)
+                if status is None:
+                    still_deferred.append((j, fn_kwargs, chain_cache_map, result_cache_path))
+                elif status:
+                    self._record_cached(singleton_step_name, j, fn_kwargs, result_cache_path)
+                else:
+                    self.claimed[j] = result_cache_path
+                    items_to_execute.append((j, fn_kwargs, chain_cache_map))
+            self.deferred = still_deferred
+            if self.deferred and not items_to_execute:
+                time.sleep(self.leases.poll_interval)
+        return items_to_execute
+
+    def record_step(self, singleton_step_name: str, items_to_execute: List[Tuple[int, Dict[str, Any], Dict[str, str]]], 
+                    timed_results: List[Tuple[str, str, Tuple[str, str], StepProfile]]):
+        """Record the (start time, end time, (result path, execution status), profile) of each executed map item."""
+        step_version = self.map_reduce_step.constant_params["version"]
+        for (j, fn_kwargs, _), (start_time, end_time, (result_cache_path, execution_status), profile) in zip(items_to_execute, timed_results):
+            metadata = create_metadata(step_version, fn_kwargs, start_time, end_time,
+                                    self.cache_dir, execution_status, _get_metadata_cache_path(result_cache_path), profile)
+            self.items_metadata[j].append([singleton_step_name, metadata])
+            self.items_cache[j][singleton_step_name] = result_cache_path
+
+    def release_results(self, singleton_step_name: str):
+        """Release the results of the earlier steps of the chains that no step after this one needs."""
+        for released_step_name in self.releases[singleton_step_name]:
+            for item_cache in self.items_cache:
+                _release_result(item_cache.get(released_step_name))
+
+    def results(self) -> Tuple[List, List[str]]:
+        """Get the metadata of every step of every map item (in map order) and the path to the result of the last step of each map item."""
+        last_step_name = list(self.map_reduce_step.step_fns.keys())[-1]
+        return ([metadata for item_metadata in self.items_metadata for metadata in item_metadata], 
+                # None for incomplete map items.
+                [item_cache.get(last_step_name) for item_cache in self.items_cache])
+
+def _execute_map_chains(mapreduce_step_name: str, 
+                        map_reduce_step: MapReduceStep, 
+                        indices: List[int],
+                        cache_map: Dict[str, str], cache_dir: str,
+                        cooperative: bool = False, wait_for_others: bool = True):
+    """Run the chain of singleton steps of a map reduce step for a batch of map parameter settings.
+
+    Each step is looked up in the cache per map item. Batched steps are then called once for the map items 
+    that are not cached; other steps are called once per map item.
+
+    Returns:
+        Tuple of the metadata for each singleton step in the chain of each map item (in map order) and the
+        paths to the result of the last step of each map item (None for the map items left to other processes,
+        with wait_for_others=False).
+    """
+    chains = _MapChains(mapreduce_step_name, map_reduce_step, indices, cache_map, cache_dir, 
+                        cooperative=cooperative, wait_for_others=wait_for_others)
+    for singleton_step_name, singleton_step_impl in map_reduce_step.step_fns.items():
+        items_to_execute = chains.lookup_step(singleton_step_name)
+        while True:
+            if items_to_execute:
+                try:
+                    timed_results = _run_map_step(singleton_step_name, singleton_step_impl, map_reduce_step, 
+                                                  items_to_execute, cache_dir)
+                finally:
+                    chains.release_claims()
+                chains.record_step(singleton_step_name, items_to_execute, timed_results)
+            items_to_execute = chains.wait_for_deferred(singleton_step_name)
+            if not items_to_execute:
+                break
+        chains.release_results(singleton_step_name)
+    return chains.results()
+
+def _run_map_step(singleton_step_name: str, singleton_step_impl: SingletonStep, map_reduce_step: MapReduceStep,
+                  items_to_execute: List[Tuple[int, Dict[str, Any], Dict[str, str]]], cache_dir: str):
+    """Run a singleton step of a map reduce step for the map items that need it, timing and profiling each call."""
+    if singleton_step_impl.batched:
+        step_fn = batch_step_wrapper(singleton_step_impl.step_fn, [chain_cache_map for _, _, chain_cache_map in items_to_execute], 
+                                     cache_dir, _get_batched_keys(map_reduce_step, singleton_step_name))
+        start_time = datetime.datetime.now().strftime("%H:%M:%S")
+        with profile_step() as profile:
+            profile.batch_items = len(items_to_execute)
+            results = step_fn([fn_kwargs for _, fn_kwargs, _ in items_to_execute])
+        end_time = datetime.datetime.now().strftime("%H:%M:%S")
+        # the map items of a batch share its profile.
+        return [(start_time, end_time, result, profile) for result in results]
+    timed_results = []
+    for k, (_, fn_kwargs, chain_cache_map) in enumerate(items_to_execute):
+        if prefetcher.active and k + 1 < len(items_to_execute):
+            # the inputs of the next map item load while this one runs.
+            _, next_fn_kwargs, next_chain_cache_map = items_to_execute[k + 1]
+            prefetcher.prefetch(_get_input_paths(next_fn_kwargs, next_chain_cache_map))
+        step_fn = step_wrapper(singleton_step_impl.step_fn, chain_cache_map, cache_dir)
+        start_time = datetime.datetime.now().strftime("%H:%M:%S")
+        with profile_step() as profile:
+            result = step_fn(**fn_kwargs)
+        end_time = datetime.datetime.now().strftime("%H:%M:%S")
+        timed_results.append((start_time, end_time, result, profile))
+    return timed_results
+
+def _reduce_results(reduce_fn: Callable, reduce_mode: str, result_paths: Iterable[str]):
+    """Combine the results of the map iterations of a map reduce step.
+
+    Args:
+        reduce_fn (Callable): With reduce_mode "all", called once on the list of all results.
+            With "fold" or "tree", an associative function combining two results into one.
+        reduce_mode (str): "all" loads every result into memory before calling reduce_fn.
+            "fold" combines the results left to right as they are loaded, keeping one result in memory at a time.
+            "tree" combines the results pairwise as a balanced tree, keeping O(log n) results in memory.
+        result_paths (Iterable[str]): Paths to the results, in map parameter order.
+    """
+    result_paths = _prefetch_ahead(result_paths)
+    if reduce_mode == "all":
+        return reduce_fn([_take_map_result(path) for path in result_paths])
+    if reduce_mode == "fold":
+        accumulated = _NO_RESULT
+        for path in result_paths:
+            result = _take_map_result(path)
+            accumulated = result if accumulated is _NO_RESULT else reduce_fn(accumulated, result)
+        if accumulated is _NO_RESULT:
+            raise ValueError("Cannot fold an empty list of map results.")
+        return accumulated
+    # each entry is (height of the subtree, combined result). Two subtrees of the same height are
+    # merged as soon as they are both available, like the carries of a binary counter.
+    subtrees = []
+    for path in result_paths:
+        subtrees.append((0, _take_map_result(path)))
+        while len(subtrees) >= 2 and subtrees[-1][0] == subtrees[-2][0]:
+            height, right = subtrees.pop()
+            _, left = subtrees.pop()
+            subtrees.append((height + 1, reduce_fn(left, right)))
+    if not subtrees:
+        raise ValueError("Cannot reduce an empty list of map results.")
+    _, combined = subtrees.pop()
+    while subtrees:
+        _, left = subtrees.pop()
+        combined = reduce_fn(left, combined)
+    return combined
+
 def execute_map_reduce_step(mapreduce_step_name: str, 
                             map_reduce_step: MapReduceStep, 
-                            cache_map: Dict[str, str], cache_dir: str):
+                            cache_map: Dict[str, str], cache_dir: str, cooperative: bool = False):
     # thing to be careful about: ensure that map_param invariant steps are not cached
     ## in order to do that, we should:
     ### create a different cache directory for map reduce steps
     ### or suffix the cache name with the map param values, for all steps in the map reduce step (regarless of whether they are invariant or not)
+    if map_reduce_step.executor == ASYNC_EXECUTOR:
+        from .async_dag import execute_map_reduce_step_async
+        return _run_coroutine(execute_map_reduce_step_async(mapreduce_step_name, map_reduce_step, cache_map, cache_dir,
+                                                            cooperative))
     map_reduce_mapdata = []
-    map_params = map_reduce_step.map_params
-    num_map_param_settings = map_params[list(map_params.keys())[0]]
+    run_chains = partial(_execute_map_chains, mapreduce_step_name, map_reduce_step, 
+                         cache_map=cache_map, cache_dir=cache_dir, cooperative=cooperative)
+    batches = _get_map_batches(mapreduce_step_name, map_reduce_step)
     final_result_paths = []
-    for i in range(len(num_map_param_settings)):
-        map_param_setting_cache = {}
-        map_kwargs = {k: v[i] for k, v in map_params.items()}
-        # add the constant params to the map_kwargs
-        map_kwargs = {**map_kwargs, **map_reduce_step.constant_params}
-        # TODO: the map reduce step does not give information about what singleton steps are cached already
-        map_steps_to_execute = []
-        for singleton_step_name, singleton_step_impl in map_reduce_step.step_fns.items():
-            fn_kwargs = {
-                            **map_kwargs, 
-                            **singleton_step_impl.step_params, 
-                            "step_name": f"{mapreduce_step_name}_{singleton_step_name}_{i}"
-                    }
-            cache_name = get_singleton_map_reduce_cache_name(mapreduce_step_name, i, singleton_step_name, singleton_step_impl.step_params['version'], singleton_step_impl.step_params, map_kwargs)
-            should_execute = _check_should_execute(cache_name, 
-                                                fn_kwargs, 
-                                                cache_dir, 
-                                                map_steps_to_execute)
-            if should_execute:
-                map_steps_to_execute.append(singleton_step_name)
-        for singleton_step_name, singleton_step_impl in map_reduce_step.step_fns.items():
-            # TODO: we never checked if the singleton step is cached or not. We should do that here.
-            fn_kwargs = {
-                **map_kwargs, 
-                **singleton_step_impl.step_params, 
-                "step_name": f"{mapreduce_step_name}_{singleton_step_name}_{i}"
-            }
-
-            if singleton_step_name not in map_steps_to_execute:
-                cache_name = _get_step_cache_name(
-                        f"{mapreduce_step_name}_{singleton_step_name}_{i}", 
-                        singleton_step_impl.step_params['version'], 
-                        fn_kwargs
-                    )
-                hash_name = hashlib.sha256(cache_name.encode()).hexdigest()
-                result_cache_path = os.path.join(cache_dir, hash_name)
-                logger.info(f"Step {singleton_step_name} is cached at {result_cache_path}, continuing.")
-                metadata = create_metadata(
-                    singleton_step_impl.step_params['version'], 
-                    fn_kwargs, "00:00:00", "00:00:00",
-                cache_dir, "cached")
-                map_reduce_mapdata.append([singleton_step_name, metadata])
-                # add to cache map
-                map_param_setting_cache[singleton_step_name] = result_cache_path
-                continue
-            # combine cache map with map_param_setting_cache
-            step_fn = step_wrapper(singleton_step_impl.step_fn, 
-                                   {**cache_map, **map_param_setting_cache}, # NOTE: there will be an overwrite issue here, if one of the map reduce step was also an external singleton step. But that shouldn't be happening anyway, since step names should be unique.
-                                   cache_dir)
-            step_version = map_kwargs["version"]
-            start_time = datetime.datetime.now().strftime("%H:%M:%S")
-            # call step fn on the union of the map kwargs and the singleton step kwargs, overriding the map kwargs when there is a conflict.
-            result_cache_path, execution_status = step_fn(**fn_kwargs) 
-            end_time = datetime.datetime.now().strftime("%H:%M:%S")
-            metadata = create_metadata(step_version, fn_kwargs, start_time, end_time,
-                                    cache_dir, execution_status)
-            map_reduce_mapdata.append([singleton_step_name, metadata])
-            map_param_setting_cache[singleton_step_name] = result_cache_path
-        final_result_paths.append(result_cache_path) 
-    # use the reduce function to combine the results.
-    reduce_fn = map_reduce_step.reduce_fn
-    # load all of the results from the final_result_paths using dill.load
-    final_results = [dill.load(open(path, 'rb')) for path in final_result_paths]
-    final_result = reduce_fn(final_results)
-    # create all_map_kwargs by combining constant_params and map_kwargs
-    all_map_kwargs = {**map_reduce_step.map_params, **map_reduce_step.constant_params, "step_name": mapreduce_step_name}
-    map_reduce_result_cache_path = cache_result(cache_dir, mapreduce_step_name, map_kwargs["version"], all_map_kwargs, final_result)
+
+    def iterate_result_paths(chain_results):
+        # chain results arrive in index order; the metadata is recorded as the reducer consumes them.
+        for chain_metadata, result_cache_paths in chain_results:
+            map_reduce_mapdata.extend(chain_metadata)
+            for result_cache_path in result_cache_paths:
+                final_result_paths.append(result_cache_path)
+                yield result_cache_path
+
+    if map_reduce_step.max_workers > 1:
+        _check_executor(map_reduce_step.executor)
+        if map_reduce_step.executor == "process":
+            # worker processes read their inputs from the cache directory.
+            result_registry.flush()
+        with EXECUTORS[map_reduce_step.executor](max_workers=map_reduce_step.max_workers) as pool:
+            # pool.map yields the batches in index order, so the metadata and result paths are deterministic.
+            chain_results = (_map_chains_cooperatively(pool.map, run_chains, batches) if cooperative 
+                             else pool.map(run_chains, batches))
+            final_result = _reduce_results(timed_reduce_fn(map_reduce_step.reduce_fn), map_reduce_step.reduce_mode, 
+                                           iterate_result_paths(chain_results))
+    else:
+        chain_results = (_map_chains_cooperatively(map, run_chains, batches) if cooperative 
+                         else _run_batches_with_lookahead(run_chains, batches, partial(
+                             _prefetch_map_chains, mapreduce_step_name, map_reduce_step, cache_map=cache_map, 
+                             cache_dir=cache_dir)))
+        final_result = _reduce_results(timed_reduce_fn(map_reduce_step.reduce_fn), map_reduce_step.reduce_mode, 
+                                       iterate_result_paths(chain_results))
+    map_reduce_result_cache_path = _cache_reduce_result(mapreduce_step_name, map_reduce_step, final_result_paths,
+                                                       cache_map, cache_dir, final_result)
     return map_reduce_result_cache_path, map_reduce_mapdata
+
+def _run_batches_with_lookahead(run_chains: Callable, batches: List[List[int]], lookahead: Callable):
+    """Run the batches of map chains one after another, prefetching the inputs of each batch while the previous one runs."""
+    for i, batch in enumerate(batches):
+        if i + 1 < len(batches):
+            prefetcher.submit(lookahead, batches[i + 1])
+        yield run_chains(batch)
+
+def _prefetch_map_chains(mapreduce_step_name: str, map_reduce_step: MapReduceStep, indices: List[int],
+                         cache_map: Dict[str, str], cache_dir: str):
+    """Prefetch the inputs of the first step that needs to run in the chain of each map item of a batch."""
+    for i in indices:
+        chain_kwargs = _get_map_chain_kwargs(mapreduce_step_name, map_reduce_step, 
+                                             {k: v[i] for k, v in map_reduce_step.map_params.items()})
+        chain_cache_map = dict(cache_map)
+        for singleton_step_name, fn_kwargs in chain_kwargs.items():
+            result_cache_path, is_cached = _lookup_cache(fn_kwargs["step_name"], fn_kwargs["version"], fn_kwargs,
+                                                         chain_cache_map, cache_dir)
+            if not is_cached:
+                # the later steps of the chain need the result of this step, which does not exist yet.
+                if result_cache_path is not None:
+                    prefetcher.prefetch(_get_input_paths(fn_kwargs, chain_cache_map))
+                break
+            chain_cache_map[singleton_step_name] = result_cache_path
+
+def _map_chains_cooperatively(map_fn: Callable, run_chains: Callable, batches: List[List[int]]) -> List:
+    """Run the batches of map chains of a map reduce step alongside other processes.
+
+    A first pass over all batches skips the map items claimed by other processes, so that each process works on
+    different items. The batches left incomplete are then run again, waiting for the other processes' results.
+    """
+    chain_results = list(map_fn(partial(run_chains, wait_for_others=False), batches))
+    incomplete = [i for i, (_, result_cache_paths) in enumerate(chain_results) if None in result_cache_paths]
+    for i, chain_result in zip(incomplete, map_fn(run_chains, [batches[i] for i in incomplete])):
+        chain_results[i] = chain_result
+    return chain_results
+
+def _get_map_batches(mapreduce_step_name: str, map_reduce_step: MapReduceStep) -> List[List[int]]:
+    """Check the settings of a map reduce step, and split its map parameter settings into batches of batch_size (by default, 1)."""
+    if map_reduce_step.reduce_mode not in REDUCE_MODES:
+        raise ValueError(f"Unknown reduce mode {map_reduce_step.reduce_mode}. Expected one of {REDUCE_MODES}.")
+    batch_size = map_reduce_step.batch_size or 1
+    if batch_size < 1:
+        raise ValueError(f"The batch size of step {mapreduce_step_name} must be positive, not {batch_size}.")
+    map_params = map_reduce_step.map_params
+    num_map_param_settings = len(map_params[list(map_params.keys())[0]])
+    return [list(range(start, min(start + batch_size, num_map_param_settings))) 
+            for start in range(0, num_map_param_settings, batch_size)]
+
+def _cache_reduce_result(mapreduce_step_name: str, map_reduce_step: MapReduceStep, final_result_paths: List[str],
+                         cache_map: Dict[str, str], cache_dir: str, final_result: Any) -> str:
+    return _cache_step_result(cache_dir, mapreduce_step_name, map_reduce_step.constant_params["version"],
+                              _get_reduce_kwargs(mapreduce_step_name, map_reduce_step, final_result_paths),
+                              cache_map, final_result)
         
-def conduct(cache_dir: str, experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]], experiment_name: str):
-    experiment_dir = os.path.join("outputs", experiment_name)
-    if not os.path.exists(experiment_dir):
-        run_fname = os.path.join(experiment_dir, "run_0000.json")
-        os.makedirs(experiment_dir)
+def _get_step_version_and_kwargs(step_name: str, step_impl: Union[SingletonStep, MapReduceStep]):
+    if isinstance(step_impl, SingletonStep):
+        step_kwargs = step_impl.step_params
+        step_version = step_kwargs["version"]
+    elif isinstance(step_impl, MapReduceStep):
+        step_kwargs = {
+            **step_impl.map_params,
+            **step_impl.constant_params
+        }
+        step_version = step_impl.constant_params["version"]
     else:
-        run_num = len(os.listdir(experiment_dir))
-        run_num_str = str(run_num).zfill(4)
-        run_fname = os.path.join(experiment_dir, f"run_{run_num_str}.json")
-    steps_to_execute = []
-    for curr_step_name, curr_step_impl in experiment_steps.items():
-        if isinstance(curr_step_impl, SingletonStep):
-            cache_name = _get_step_cache_name(curr_step_name, curr_step_impl.step_params['version'], curr_step_impl.step_params)
-            should_execute = _check_should_execute(cache_name, 
-                                                curr_step_impl.step_params, 
-                                                cache_dir, 
-                                                steps_to_execute)
-        elif isinstance(curr_step_impl, MapReduceStep):
-            # the params are the combination of the map params and the constant params.
-            # TODO: the execution check should be differnt for map reduce steps --
-            # we should also check if any of the underlying singleton step implementations have changed.
-            should_execute = _check_should_execute_map_reduce(curr_step_name,
-                                                cache_dir,
-                                                curr_step_impl.map_params, 
-                                                curr_step_impl.constant_params,
-                                                steps_to_execute, 
-                                                curr_step_impl.step_fns)
+        raise ValueError(f"Step {step_name} is not a valid step type.")
+    step_kwargs["step_name"] = step_name
+    return step_version, step_kwargs
+
+def _get_step_dependencies(step_impl: Union[SingletonStep, MapReduceStep], upstream_step_names: List[str]) -> List[str]:
+    """Get the names of the upstream steps whose results are substituted into a step's arguments.
+
+    Args:
+        step_impl (Union[SingletonStep, MapReduceStep]): The step to get the dependencies for.
+        upstream_step_names (List[str]): Names of the steps that come before this step in the experiment.
+    """
+    if isinstance(step_impl, SingletonStep):
+        candidate_values = list(step_impl.step_params.values())
+    else:
+        candidate_values = list(step_impl.constant_params.values())
+        for map_values in step_impl.map_params.values():
+            candidate_values.extend(map_values)
+        for singleton_step_impl in step_impl.step_fns.values():
+            candidate_values.extend(singleton_step_impl.step_params.values())
+    dependencies = []
+    for value in candidate_values:
+        if isinstance(value, str) and value in upstream_step_names and value not in dependencies:
+            dependencies.append(value)
+    return dependencies
+
+class _ResultLiveness:
+    """Counts the steps of a run that have yet to consume each step's result, releasing the result
+    (see _release_result) once they have all finished."""
+    def __init__(self, experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]]):
+        step_names = list(experiment_steps.keys())
+        self.dependencies = {step_name: _get_step_dependencies(experiment_steps[step_name], step_names[:i])
+                             for i, step_name in enumerate(step_names)}
+        self.remaining_consumers = {step_name: 0 for step_name in step_names}
+        for step_dependencies in self.dependencies.values():
+            for dependency in step_dependencies:
+                self.remaining_consumers[dependency] += 1
+
+    def step_finished(self, step_name: str, cache_map: Dict[str, str]):
+        for dependency in self.dependencies[step_name]:
+            self.remaining_consumers[dependency] -= 1
+            if self.remaining_consumers[dependency] == 0:
+                _release_result(cache_map.get(dependency))
+        if self.remaining_consumers[step_name] == 0:
+            _release_result(cache_map.get(step_name))
+
+def _prefetch_step(exp_step_name: str, step_impl: Union[SingletonStep, MapReduceStep], 
+                   cache_map: Dict[str, str], cache_dir: str, experiment_steps: OrderedDict):
+    """Prefetch the inputs of a step that is not cached, if the steps it depends on have finished."""
+    if not prefetcher.active or not isinstance(step_impl, SingletonStep):
+        return
+    step_version, step_kwargs = _get_step_version_and_kwargs(exp_step_name, step_impl)
+    if any(isinstance(value, str) and value != exp_step_name and value in experiment_steps and value not in cache_map
+           for value in step_kwargs.values()):
+        return
+    cache_path, is_cached = _lookup_cache(exp_step_name, step_version, step_kwargs, cache_map, cache_dir)
+    if cache_path is not None and not is_cached:
+        prefetcher.prefetch(_get_input_paths(step_kwargs, cache_map))
+
+def _lookup_step(exp_step_name: str, step_impl: Union[SingletonStep, MapReduceStep], 
+                 cache_map: Dict[str, str], cache_dir: str):
+    """Look up the cached result of a single step of the experiment.
+
+    Returns:
+        Tuple of the step's version, its kwargs, and (if it is cached) the path to its result and its entry
+        in the run metadata, or None if the step needs to be executed.
+    """
+    step_version, step_kwargs = _get_step_version_and_kwargs(exp_step_name, step_impl)
+    chain_result_paths = []
+    if isinstance(step_impl, SingletonStep):
+        cache_path, is_cached = _lookup_cache(exp_step_name, step_version, step_kwargs, cache_map, cache_dir)
+    else:
+        cache_path, map_items_to_execute, chain_result_paths = _lookup_map_reduce_cache(exp_step_name, step_impl, 
+                                                                                        cache_map, cache_dir)
+        is_cached = cache_path is not None
+        if map_items_to_execute:
+            logger.info(f"Step {exp_step_name}: {len(map_items_to_execute)} map items need to be executed: "
+                        f"{[get_map_item_key(map_item) for map_item in map_items_to_execute]}")
+    if not is_cached:
+        return step_version, step_kwargs, None
+    logger.info(f"Step {exp_step_name} is cached at {cache_path}, continuing.")
+    metadata = create_metadata(step_version, step_kwargs, "00:00:00", "00:00:00",
+                            cache_dir, "cached", cache_path)
+    if chain_result_paths:
+        # the run refers to the results of the map items too, so that collect_garbage keeps them for the next run.
+        metadata["map_cache_paths"] = chain_result_paths
+    return step_version, step_kwargs, (cache_path, (exp_step_name, metadata))
+
+def _claim_step(exp_step_name: str, step_impl: Union[SingletonStep, MapReduceStep], 
+                cache_map: Dict[str, str], cache_dir: str):
+    """Like _lookup_step, but a singleton step that is not cached is claimed for this process, so that other processes
+    sharing cache_dir wait for its result rather than running it too. If another process has claimed it, its result
+    is waited for.
+
+    Map reduce steps are not claimed as a whole; their map items are claimed as they run (see _MapChains).
+
+    Returns:
+        Like _lookup_step, along with the cache path of the claimed step (None if no step was claimed).
+    """
+    leases = get_lease_manager(cache_dir)
+    while True:
+        step_version, step_kwargs, cached = _lookup_step(exp_step_name, step_impl, cache_map, cache_dir)
+        if cached is not None or isinstance(step_impl, MapReduceStep):
+            return step_version, step_kwargs, cached, None
+        cache_path, _ = _lookup_cache(exp_step_name, step_version, step_kwargs, cache_map, cache_dir)
+        if cache_path is None:
+            return step_version, step_kwargs, None, None
+        if leases.claim(cache_path):
+            return step_version, step_kwargs, None, cache_path
+        if not artifact_exists(cache_path):
+            logger.info(f"Step {exp_step_name} is being run by another process, waiting for its result.")
+            if not leases.wait_for(cache_path):
+                return step_version, step_kwargs, None, cache_path
+        # the result is in the (refreshed) index, so it is found on the next lookup.
+
+def _record_cached_step(cached, profile: StepProfile):
+    """Add the profile of the cache lookup to the metadata of a cached step."""
+    cache_path, (exp_step_name, metadata) = cached
+    profile.cache = "hit"
+    return cache_path, (exp_step_name, {**metadata, "profile": profile.to_dict()})
+
+def _record_executed_step(exp_step_name: str, step_impl: Union[SingletonStep, MapReduceStep], step_version: str, 
+                          step_kwargs: Dict[str, Any], start_time: str, end_time: str, execution_result, cache_dir: str,
+                          profile: StepProfile):
+    """Get the path to the result of an executed step and its entry in the run metadata.
+
+    Args:
+        execution_result: The result path and execution status of a singleton step, or the result path
+            and map metadata of a map reduce step.
+    """
+    if isinstance(step_impl, SingletonStep):
+        result_cache_path, execution_status = execution_result
+        metadata = create_metadata(step_version, step_kwargs, start_time, end_time,
+                                cache_dir, execution_status, _get_metadata_cache_path(result_cache_path), profile)
+        return result_cache_path, (exp_step_name, metadata)
+    result_cache_path, map_red_metadata = execution_result
+    final_metadata = create_metadata(step_version, step_kwargs,
+                                    start_time, end_time, execution_status="executed",
+                                    cache_dir=cache_dir, cache_path=result_cache_path, profile=profile)
+    map_red_metadata.append(final_metadata)
+    return result_cache_path, [exp_step_name, map_red_metadata]
+
+def _execute_step(exp_step_name: str, step_impl: Union[SingletonStep, MapReduceStep], 
+                  cache_map: Dict[str, str], cache_dir: str, cooperative: bool = False):
+    """Execute (or look up the cached result of) a single step of the experiment.
+
+    Whether the step is cached is decided here rather than up front, since the cache name
+    of the step depends on the contents of the results of its upstream steps.
+
+    Returns:
+        Tuple of the path to the step's result and the step's entry in the run metadata.
+    """
+    with profile_step() as profile:
+        if cooperative:
+            step_version, step_kwargs, cached, claimed_path = _claim_step(exp_step_name, step_impl, cache_map, cache_dir)
         else:
+            step_version, step_kwargs, cached = _lookup_step(exp_step_name, step_impl, cache_map, cache_dir)
+            claimed_path = None
+        if cached is None:
+            start_time = datetime.datetime.now().strftime("%H:%M:%S")
+            try:
+                if isinstance(step_impl, SingletonStep):
+                    execution_result = step_wrapper(step_impl.step_fn, cache_map, cache_dir)(**step_kwargs)
+                else:
+                    execution_result = execute_map_reduce_step(exp_step_name, step_impl, cache_map, cache_dir, cooperative)
+            finally:
+                if claimed_path is not None:
+                    _release_claim(cache_dir, claimed_path)
+            end_time = datetime.datetime.now().strftime("%H:%M:%S")
+    if cached is not None:
+        return _record_cached_step(cached, profile)
+    return _record_executed_step(exp_step_name, step_impl, step_version, step_kwargs, start_time, end_time,
+                                 execution_result, cache_dir, profile)
+
+def _schedule_steps(experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]], 
+                    cache_map: Dict[str, str], cache_dir: str,
+                    max_workers: int, executor: str, cooperative: bool = False):
+    """Run the steps of an experiment on a pool, starting each step as soon as its dependencies have finished.
+
+    Yields the name of each step along with its finished future, in order of completion.
+    The caller is expected to add the step's result path to ``cache_map`` before resuming
+    the generator, so that dependent steps see it when they are submitted.
+    """
+    step_names = list(experiment_steps.keys())
+    dependencies = {
+        step_name: _get_step_dependencies(experiment_steps[step_name], step_names[:i])
+        for i, step_name in enumerate(step_names)
+    }
+    pending_steps = step_names.copy()
+    finished_steps = set()
+    running = {}
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        while pending_steps or running:
+            for step_name in pending_steps.copy():
+                if all(dependency in finished_steps for dependency in dependencies[step_name]):
+                    pending_steps.remove(step_name)
+                    if executor == "process":
+                        # worker processes read their inputs from the cache directory.
+                        result_registry.flush()
+                    future = pool.submit(_execute_step, step_name, experiment_steps[step_name],
+                                         dict(cache_map), cache_dir, cooperative)
+                    running[future] = step_name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step_name = running.pop(future)
+                yield step_name, future
+                finished_steps.add(step_name)
+
+def conduct(cache_dir: str, experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]], experiment_name: str,
+            max_workers: int = 1, executor: str = "thread", write_behind: bool = False, trace_memory: bool = False,
+            cooperative: bool = False, prefetch_bytes: int = 0, targets: Optional[List[str]] = None,
+            dry_run: bool = False):
+    """Run the steps of an experiment, caching their results in cache_dir.
+
+    Args:
+        cache_dir (str): Directory to cache the step results in.
+        experiment_steps (OrderedDict[str, Union[SingletonStep, MapReduceStep]]): The steps, in order.
+        experiment_name (str): Name of the experiment. The run metadata is written to outputs/{experiment_name}/run_####.json,
+            and the run is recorded in the experiment's run store (see run_store.RunStore).
+        max_workers (int): Maximum number of steps to run at the same time. With more than one worker,
+            each step starts as soon as the steps it depends on have finished.
+        executor (str): "thread", "process" or "async". With "process", the step functions must be picklable
+            (i.e., defined at the top level of a module). With "async", the steps run on an event loop, with at most 
+            max_workers running at a time; async def step functions are awaited, and other step functions run on threads.
+        write_behind (bool): Keep the results computed in this run in memory and pass them to downstream steps directly,
+            writing them to cache_dir on a background thread. All writes have finished when conduct returns.
+            Note that downstream steps then share the same result object. Each result is dropped from memory
+            as soon as the last step that refers to it (in its params) has finished, and the most bytes of
+            results held at once (by their serialized size) is recorded as the run's peak_resident_bytes in the run store.
+        trace_memory (bool): Record the peak memory allocated by each step in its profile, using tracemalloc.
+            This slows down the steps. Memory is only traced in this process, so steps run with the "process"
+            executor have no peak, and the peaks are only accurate for steps that do not run at the same time
+            as other steps (e.g., with max_workers=1).
+        cooperative (bool): Share the work with other conduct processes (on this or other machines) running the
+            same steps with the same cache_dir. Each step and map item that is not cached is claimed with a lease
+            file in cache_dir/leases before it runs; the other processes wait for its result, and the map items of
+            map reduce steps are split between the processes. Leases of processes that died are taken over (see leases).
+        prefetch_bytes (int): Load the cached results of upstream steps on background threads, holding at most
+            this many bytes (by their size on disk) until the steps that need them run. A step's inputs are then
+            loaded concurrently, and the inputs of the next step, map item or batch of map items, and the map results 
+            to reduce start loading before they are needed (see prefetch.Prefetcher). 0 turns prefetching off.
+        targets (Optional[List[str]]): Only run these steps and the steps they depend on. The run metadata
+            then only has these steps.
+        dry_run (bool): Log which steps (and map items) would run, which would be cached, and which would
+            be skipped (see targets), and return the planner.RunPlan, without running, reading or writing anything.
+
+    Each step's metadata has a "profile" with its wall time, CPU time, time spent reading and writing
+    the cache, bytes read and written, and whether its result was found in the cache (see StepProfile).
+    Pass the returned metadata to export_chrome_trace to view the run on a timeline.
+    """
+    _check_executor(executor)
+    for curr_step_name, curr_step_impl in experiment_steps.items():
+        if not isinstance(curr_step_impl, (SingletonStep, MapReduceStep)):
             raise ValueError(f"Step {curr_step_name} is not a valid step type.")
-        if should_execute:
-            steps_to_execute.append(curr_step_name) 
+    if dry_run:
+        from .planner import plan_steps
+        plan = plan_steps(cache_dir, experiment_steps, targets)
+        logger.info(plan.summary())
+        return plan
+    if targets is not None:
+        from .planner import select_steps
+        experiment_steps = select_steps(experiment_steps, targets)
+    liveness = _ResultLiveness(experiment_steps)
+    run_store = get_run_store(experiment_name)
+    run_num, run_fname = run_store.allocate_run()
+    started = time.time()
+    # pick up the artifacts written by other processes since the index was last read.
+    get_cache_index(cache_dir).refresh()
 
-    steps_metadata = []
+    # the metadata is keyed by step name so that it can be written out in the order of
+    # experiment_steps, regardless of the order in which the steps finish.
+    steps_metadata = {}
     cache_map = {}
+    owns_registry = write_behind and result_registry.activate()
+    owns_tracing = trace_memory and not tracemalloc.is_tracing()
+    if owns_tracing:
+        tracemalloc.start()
+    owns_prefetcher = prefetch_bytes > 0 and prefetcher.activate(prefetch_bytes)
+    # the artifacts found missing while loading them, which are recomputed by running the steps again.
+    missing_cache_paths = set()
+    # the metadata of the steps executed by an attempt that found an artifact missing. Running the steps again
+    # finds their results cached, but the run record keeps them as executed.
+    executed_metadata = {}
     try:
-        for exp_step_name, step_impl in experiment_steps.items(): 
-            if exp_step_name not in steps_to_execute:
-                exp_step_version = step_impl.step_params['version'] if isinstance(step_impl, SingletonStep) else step_impl.constant_params['version']
-                if isinstance(step_impl, MapReduceStep):
-                    step_kwargs = {
-                        **step_impl.map_params,
-                        **step_impl.constant_params
-                    }
-                elif isinstance(step_impl, SingletonStep):
-                    step_kwargs = step_impl.step_params
-                cache_name = _get_step_cache_name(exp_step_name, exp_step_version, step_kwargs)
-                hash_name = hashlib.sha256(cache_name.encode()).hexdigest()
-                hashed_fcache_name = os.path.join(cache_dir, hash_name)
-                logger.info(f"Step {exp_step_name} is cached at {hashed_fcache_name}, continuing.")
-                step_kwargs["step_name"] = exp_step_name
-                metadata = create_metadata(step_kwargs['version'], step_kwargs, "00:00:00", "00:00:00",
-                                        cache_dir, "cached")
-                steps_metadata.append((exp_step_name, metadata))
-                # add to cache map
-                cache_map[exp_step_name] = hashed_fcache_name
-                continue
-            if isinstance(step_impl, SingletonStep):
-                step_fn = step_wrapper(step_impl.step_fn, cache_map, cache_dir)
-                step_kwargs = step_impl.step_params
-                step_version = step_kwargs["version"]
-                start_time = datetime.datetime.now().strftime("%H:%M:%S")
-                step_kwargs["step_name"] = exp_step_name
-                result_cache_path, execution_status = step_fn(**step_kwargs)
-                end_time = datetime.datetime.now().strftime("%H:%M:%S")
-                metadata = create_metadata(step_version, step_kwargs, start_time, end_time,
-                                        cache_dir, execution_status)
-                steps_metadata.append((exp_step_name, metadata))
-                cache_map[exp_step_name] = result_cache_path
-            elif isinstance(step_impl, MapReduceStep):
-                start_time = datetime.datetime.now().strftime("%H:%M:%S")
-                result_cache_path, map_red_metadata = execute_map_reduce_step(exp_step_name, step_impl, cache_map, cache_dir)
-                end_time = datetime.datetime.now().strftime("%H:%M:%S")
-                final_metadata = create_metadata(step_impl.constant_params["version"],
-                                                {**step_impl.map_params, **step_impl.constant_params, "step_name": exp_step_name},
-                                                start_time, end_time, execution_status="executed",
-                                                cache_dir=cache_dir)
-                map_red_metadata.append(final_metadata)
-                steps_metadata.append([exp_step_name, map_red_metadata])
-                cache_map[exp_step_name] = result_cache_path
+        while True:
+            try:
+                if executor == ASYNC_EXECUTOR:
+                    from .async_dag import iterate_async, schedule_steps_async
+                    for exp_step_name, task in iterate_async(schedule_steps_async(experiment_steps, cache_map, cache_dir, 
+                                                                                  max_workers, cooperative)):
+                        cache_map[exp_step_name], steps_metadata[exp_step_name] = task.result()
+                        liveness.step_finished(exp_step_name, cache_map)
+                elif max_workers > 1:
+                    for exp_step_name, future in _schedule_steps(experiment_steps, cache_map, cache_dir,
+                                                                 max_workers, executor, cooperative):
+                        cache_map[exp_step_name], steps_metadata[exp_step_name] = future.result()
+                        liveness.step_finished(exp_step_name, cache_map)
+                else:
+                    step_items = list(experiment_steps.items())
+                    for i, (exp_step_name, step_impl) in enumerate(step_items): 
+                        if i + 1 < len(step_items):
+                            _prefetch_step(*step_items[i + 1], cache_map, cache_dir, experiment_steps)
+                        cache_map[exp_step_name], steps_metadata[exp_step_name] = _execute_step(
+                            exp_step_name, step_impl, cache_map, cache_dir, cooperative)
+                        liveness.step_finished(exp_step_name, cache_map)
+                break
+            except MissingArtifactError as e:
+                if e.cache_path in missing_cache_paths:
+                    raise
+                missing_cache_paths.add(e.cache_path)
+                # the missing artifact is no longer in the index, so the step that produced it runs again. 
+                # the steps that ran in this attempt are cached by now.
+                logger.warning(f"{e}; running the steps again to recompute it.")
+                result_registry.flush()
+                executed_metadata.update((step_name, step_metadata) for step_name, step_metadata 
+                                         in steps_metadata.items() if _was_executed(step_metadata))
+                steps_metadata.clear()
+                cache_map.clear()
+                liveness = _ResultLiveness(experiment_steps)
+                get_cache_index(cache_dir).refresh()
+        _restore_executed_metadata(steps_metadata, executed_metadata)
+        # all results are persisted before the run is recorded.
+        result_registry.flush()
+        peak_resident_bytes = result_registry.get_peak_resident_bytes() if owns_registry else None
     except Exception as e:
         logger.error(f"Error occurred while running step {exp_step_name}: {e}")
+        _restore_executed_metadata(steps_metadata, executed_metadata)
+        step_version, step_kwargs = _get_step_version_and_kwargs(exp_step_name, experiment_steps[exp_step_name])
         metadata = create_metadata(step_version, step_kwargs, "00:00:00", "00:00:00",
                                         cache_dir, "failed")
-        steps_metadata.append([exp_step_name, metadata])
+        steps_metadata[exp_step_name] = [exp_step_name, metadata]
+        steps_metadata = _order_steps_metadata(steps_metadata, experiment_steps)
         with open(run_fname, 'w') as f:
             json.dump(steps_metadata, f, indent=4)
+        run_store.record_run(run_num, steps_metadata, started, "failed")
         raise e
+    finally:
+        if owns_registry:
+            result_registry.deactivate()
+        if owns_tracing:
+            tracemalloc.stop()
+        if owns_prefetcher:
+            prefetcher.deactivate()
 
+    steps_metadata = _order_steps_metadata(steps_metadata, experiment_steps)
     # write the metadata to a json file.
     with open(run_fname, 'w') as f:
         json.dump(steps_metadata, f, indent=4)
-    return steps_metadata
\ No newline at end of file
+    run_store.record_run(run_num, steps_metadata, started, "complete", peak_resident_bytes)
+    if peak_resident_bytes is not None:
+        logger.info(f"At most {peak_resident_bytes} bytes of results were held in memory at once.")
+    return steps_metadata
+
+def _get_step_status_and_path(step_metadata: List) -> Tuple[Optional[str], Optional[str]]:
+    metadata = step_metadata[1]
+    if isinstance(metadata, list):
+        # a map reduce step that was executed: the metadata of its map items, followed by its own.
+        metadata = metadata[-1]
+    return metadata.get("execution_status"), metadata.get("cache_path")
+
+def _was_executed(step_metadata: List) -> bool:
+    return _get_step_status_and_path(step_metadata)[0] == "executed"
+
+def _restore_executed_metadata(steps_metadata: Dict[str, Any], executed_metadata: Dict[str, Any]):
+    """Record the steps executed by an earlier attempt of the run as executed, rather than as cached by it."""
+    for step_name, step_metadata in executed_metadata.items():
+        if step_name not in steps_metadata:
+            continue
+        status, cache_path = _get_step_status_and_path(steps_metadata[step_name])
+        if status == "cached" and cache_path == _get_step_status_and_path(step_metadata)[1]:
+            steps_metadata[step_name] = step_metadata
+
+def _order_steps_metadata(steps_metadata: Dict[str, Any], experiment_steps: OrderedDict):
+    return [steps_metadata[step_name] for step_name in experiment_steps if step_name in steps_metadata]
@@ -1,23 +1,65 @@
-import dill
-from typing import Tuple, Dict
+from typing import Any, Dict, List, Optional, Tuple
 import json
 import os
-import loguru
 
-logger = loguru.logger
+from .log import logger
+from .run_store import OUTPUTS_DIR, get_run_fname, get_run_store
+from .serializers import DEFAULT_SERIALIZER
+from .storage import load_cached_artifact
+
 def load_latest_steps(experiment_name: str):
-    # load the latest file. It will be run_####.json under
-    # outputs/{experiment_name}
-    # the latest one will have the highest number.
-    # code:
-    fname = max([f for f in os.listdir(os.path.join("outputs", experiment_name)) if f.startswith("run_")])
-    with open(os.path.join("outputs", experiment_name, fname), 'r') as f:
+    """Load the metadata of the latest run of an experiment, found through its run store rather than by listing its run files."""
+    run = get_run_store(experiment_name).latest_run()
+    if run is None:
+        raise FileNotFoundError(f"No runs of experiment {experiment_name} have been recorded.")
+    return load_run(experiment_name, run["run"])
+
+def load_run(experiment_name: str, run_num: int):
+    """Load the metadata of a run of an experiment, as returned by conduct."""
+    with open(os.path.join(OUTPUTS_DIR, experiment_name, get_run_fname(run_num)), 'r') as f:
         return json.load(f)
 
+def get_step_history(experiment_name: str, step_name: str) -> List[Dict[str, Any]]:
+    """Get what each run of an experiment recorded about a step, oldest run first.
+
+    Returns:
+        For each run that included the step, a dict with the run number ("run"), the run's start time ("started")
+        and the step's "version", "execution_status" ("executed", "cached" or "failed") and "cache_path".
+    """
+    return [{"run": run["run"], "started": run["started"], **run["steps"][step_name]}
+            for run in get_run_store(experiment_name).runs() if step_name in run["steps"]]
+
+def find_runs(experiment_name: str, step_name: Optional[str] = None, 
+              execution_status: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Find the runs of an experiment in its run store, oldest first.
+
+    Args:
+        experiment_name (str): Name of the experiment.
+        step_name (Optional[str]): Only the runs that included this step.
+        execution_status (Optional[str]): Only the runs in which step_name had this status, e.g. "executed" or "cached".
+    """
+    runs = get_run_store(experiment_name).runs()
+    if step_name is not None:
+        runs = [run for run in runs if step_name in run["steps"] and 
+                (execution_status is None or run["steps"][step_name]["execution_status"] == execution_status)]
+    return runs
+
+def import_runs(experiment_name: str) -> int:
+    """Add the run files of an experiment that are not in its run store, e.g. run files copied from another machine.
+
+    Run files written before experiments had run stores are imported automatically the first time the store is used.
+
+    Returns:
+        The number of runs imported.
+    """
+    return get_run_store(experiment_name).import_run_files()
+
 def load_artifact(step: Tuple[str, Dict[str, str]]):
     artifact_path = step[1]["cache_path"]
-    with open(artifact_path, 'rb') as f:
-        return dill.load(f)
+    # the serializer and codec are recorded next to the artifact; the metadata is a fallback for artifacts without that record.
+    # runs recorded before the serializer was stored in the metadata always used dill.
+    serializer_name = step[1].get("serializer", DEFAULT_SERIALIZER)
+    return load_cached_artifact(artifact_path, serializer_name)
 
 def load_artifact_with_step_name(metadata, step_name):
     for step in metadata:
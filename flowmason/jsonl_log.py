@@ -0,0 +1,112 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Optional, Tuple
+import json
+import os
+import threading
+
+TMP_SUFFIX = ".tmp"
+
+class JsonlLog(ABC):
+    """An append-only log of JSON records, one per line, shared by concurrent processes.
+
+    The log is read once and then followed as other processes append to it: each refresh reads only the lines
+    appended since the last one, and reloads the whole log if it was replaced or removed. Records are appended
+    with a single O_APPEND write, so lines from concurrent processes are not interleaved. An append-only log is
+    used rather than a database, since it stays safe on network file systems where file locking is unreliable.
+
+    Subclasses keep the state the records describe, by applying each record as it is read or appended.
+    """
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._lock = threading.RLock()
+        self._offset = 0
+        self._file_id: Optional[Tuple[int, int]] = None
+
+    def refresh(self):
+        """Read the records appended since the last refresh, reloading the log if it was replaced or removed."""
+        with self._lock:
+            try:
+                stat = os.stat(self.index_path)
+            except FileNotFoundError:
+                self._reset()
+                self._on_missing()
+                return
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self._file_id or stat.st_size < self._offset:
+                self._reset()
+                self._file_id = file_id
+            if stat.st_size == self._offset:
+                return
+            with open(self.index_path, 'rb') as f:
+                f.seek(self._offset)
+                complete = _complete_lines(f.read())
+            for line in complete.splitlines():
+                if line.strip():
+                    self._apply(json.loads(line))
+            self._offset += len(complete)
+
+    @abstractmethod
+    def _apply(self, record: Dict[str, Any]):
+        """Update the state of the log with a record read from it or appended to it."""
+
+    @abstractmethod
+    def _clear(self):
+        """Forget the state of the log, before it is read again from the start."""
+
+    def _on_missing(self):
+        """Called by refresh when there is no log, after the state is cleared."""
+
+    def _append(self, record: Dict[str, Any]):
+        line = (json.dumps(record) + "\n").encode()
+        with self._lock:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            # a single O_APPEND write, so that lines from concurrent processes are not interleaved.
+            fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._apply(record)
+
+    def _create(self):
+        """Create the log if there is none, leaving it empty."""
+        os.close(os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666))
+
+    def _skip_to_end(self):
+        """Mark the log as read up to its end, once the records in it have all been applied."""
+        stat = os.stat(self.index_path)
+        self._file_id = (stat.st_dev, stat.st_ino)
+        self._offset = stat.st_size
+
+    def _rewrite(self, records: Iterable[Dict[str, Any]]):
+        """Replace the log atomically with records, followed by the lines appended since the last refresh.
+
+        Other processes reload the log on their next refresh.
+        """
+        with self._lock:
+            tmp_path = f"{self.index_path}.{os.getpid()}{TMP_SUFFIX}"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for record in records:
+                        f.write((json.dumps(record) + "\n").encode())
+                    with open(self.index_path, 'rb') as old_log:
+                        old_log.seek(self._offset)
+                        f.write(_complete_lines(old_log.read()))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.index_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._reset()
+            self.refresh()
+
+    def _reset(self):
+        self._clear()
+        self._offset = 0
+        self._file_id = None
+
+def _complete_lines(data: bytes) -> bytes:
+    # a line without its newline is still being appended; it is read on the next refresh.
+    return data[:data.rfind(b"\n") + 1]
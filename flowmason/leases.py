@@ -0,0 +1,209 @@
+"""Claims on steps, for conduct processes that share a cache directory (see conduct's cooperative argument).
+
+Before running a step (or a map item of a map reduce step) that is not cached, a process claims it by
+creating a lease file, cache_dir/leases/<hashed name>.lease. Other processes then wait for the result
+instead of computing it again. While a process holds leases, a heartbeat thread touches them; a lease
+whose heartbeat has stopped for LEASE_TIMEOUT seconds, or whose owner is a process on this machine that
+has exited, is taken over by the next process that needs the step.
+
+Leases only prevent duplicate work. Results are written atomically whether or not they were claimed, so
+two processes that run the same step (e.g., after a lease was taken over from a process that was only
+slow) leave one complete result behind.
+"""
+from typing import Any, Dict, Optional, Tuple
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .log import logger
+from .storage import artifact_exists
+
+LEASES_DIRNAME = "leases"
+LEASE_SUFFIX = ".lease"
+# seconds between the touches of the leases held by a process.
+HEARTBEAT_INTERVAL = 10.0
+# seconds after the last heartbeat at which a lease is considered abandoned. Generous, since the
+# clocks of the machines sharing a network file system may differ by a few seconds.
+LEASE_TIMEOUT = 60.0
+# seconds between checks for a result that another process is computing.
+POLL_INTERVAL = 0.5
+
+def _pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class LeaseManager:
+    """The leases held by this process in a cache directory."""
+    def __init__(self, cache_dir: str, heartbeat_interval: Optional[float] = None, lease_timeout: Optional[float] = None):
+        self.cache_dir = cache_dir
+        self.leases_dir = os.path.join(cache_dir, LEASES_DIRNAME)
+        self.heartbeat_interval = HEARTBEAT_INTERVAL if heartbeat_interval is None else heartbeat_interval
+        self.lease_timeout = LEASE_TIMEOUT if lease_timeout is None else lease_timeout
+        self.poll_interval = POLL_INTERVAL
+        self.owner = {"host": socket.gethostname(), "pid": os.getpid()}
+        self._lock = threading.Lock()
+        self._held: Dict[str, str] = {} # lease path -> token
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    def get_lease_path(self, cache_path: str) -> str:
+        return os.path.join(self.leases_dir, f"{os.path.basename(cache_path)}{LEASE_SUFFIX}")
+
+    def try_acquire(self, cache_path: str) -> bool:
+        """Take the lease on an artifact, unless a live process holds it."""
+        lease_path = self.get_lease_path(cache_path)
+        os.makedirs(self.leases_dir, exist_ok=True)
+        token = uuid.uuid4().hex
+        # a second attempt after an abandoned lease was broken.
+        for _ in range(2):
+            try:
+                fd = os.open(lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                lease = self._read_lease(lease_path)
+                if lease is None: # released in the meantime.
+                    continue
+                lease_info, heartbeat = lease
+                if self._is_live(lease_info, heartbeat):
+                    return False
+                logger.warning(f"Taking over the lease on {os.path.basename(cache_path)} from {lease_info.get('host')}:"
+                               f"{lease_info.get('pid')}, whose heartbeat stopped {time.time() - heartbeat:.0f} seconds ago.")
+                self._break_lease(lease_path, lease_info)
+                continue
+            try:
+                os.write(fd, json.dumps({**self.owner, "token": token, "acquired": time.time()}).encode())
+            finally:
+                os.close(fd)
+            with self._lock:
+                self._held[lease_path] = token
+                self._start_heartbeat()
+            return True
+        return False
+
+    def claim(self, cache_path: str) -> bool:
+        """Claim an artifact that is about to be computed.
+
+        Returns:
+            True if this process now holds the lease. False if another process holds it, or has cached
+            the artifact since it was looked up.
+        """
+        if not self.try_acquire(cache_path):
+            return False
+        if artifact_exists(cache_path):
+            self.release(cache_path)
+            return False
+        return True
+
+    def poll(self, cache_path: str) -> Optional[bool]:
+        """Check on an artifact claimed by another process.
+
+        Returns:
+            True if the artifact has been cached, False if its lease was released (or abandoned) without it
+            being cached and this process has claimed it instead, or None if it is still being computed.
+        """
+        if artifact_exists(cache_path):
+            return True
+        if self.try_acquire(cache_path):
+            # the other process may have cached the artifact and released its lease since the check above.
+            if artifact_exists(cache_path):
+                self.release(cache_path)
+                return True
+            return False
+        return None
+
+    def wait_for(self, cache_path: str) -> bool:
+        """Wait for an artifact claimed by another process. Returns whether it was cached (see poll)."""
+        while True:
+            status = self.poll(cache_path)
+            if status is not None:
+                return status
+            time.sleep(self.poll_interval)
+
+    def release(self, cache_path: str):
+        lease_path = self.get_lease_path(cache_path)
+        with self._lock:
+            token = self._held.pop(lease_path, None)
+        if token is None:
+            return
+        lease = self._read_lease(lease_path)
+        if lease is None or lease[0].get("token") != token:
+            logger.warning(f"The lease on {os.path.basename(cache_path)} was taken over by another process before it was released.")
+            return
+        try:
+            os.remove(lease_path)
+        except FileNotFoundError:
+            pass
+
+    def _is_live(self, lease_info: Dict[str, Any], heartbeat: float) -> bool:
+        if time.time() - heartbeat > self.lease_timeout:
+            return False
+        if lease_info.get("host") == self.owner["host"] and isinstance(lease_info.get("pid"), int):
+            return _pid_exists(lease_info["pid"])
+        return True
+
+    def _read_lease(self, lease_path: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Get the contents of a lease file and the time of its last heartbeat, or None if it does not exist."""
+        try:
+            heartbeat = os.path.getmtime(lease_path)
+            with open(lease_path, 'r') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            return json.loads(content), heartbeat
+        except json.JSONDecodeError:
+            # the owner is still writing it.
+            return {}, heartbeat
+
+    def _break_lease(self, lease_path: str, lease_info: Dict[str, Any]):
+        """Remove an abandoned lease, unless another process has taken it over first."""
+        broken_path = f"{lease_path}.{uuid.uuid4().hex}.broken"
+        try:
+            os.rename(lease_path, broken_path)
+        except FileNotFoundError:
+            return
+        broken = self._read_lease(broken_path)
+        if broken is not None and broken[0].get("token") != lease_info.get("token"):
+            # a fresh lease, taken over by another process since lease_info was read; put it back.
+            try:
+                os.link(broken_path, lease_path)
+            except FileExistsError:
+                pass
+        os.remove(broken_path)
+
+    def _start_heartbeat(self):
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="flowmason-heartbeat", daemon=True)
+            self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                lease_paths = list(self._held)
+                if not lease_paths:
+                    # restarted by the next try_acquire.
+                    self._heartbeat_thread = None
+                    return
+            for lease_path in lease_paths:
+                try:
+                    os.utime(lease_path)
+                except FileNotFoundError:
+                    logger.warning(f"Lost the lease {lease_path}, which was taken over by another process.")
+
+_lease_managers: Dict[Tuple[str, int], LeaseManager] = {}
+_lease_managers_lock = threading.Lock()
+
+def get_lease_manager(cache_dir: str) -> LeaseManager:
+    """Get this process's lease manager for a cache directory."""
+    key = (os.path.abspath(cache_dir), os.getpid())
+    with _lease_managers_lock:
+        if key not in _lease_managers:
+            _lease_managers[key] = LeaseManager(cache_dir)
+        return _lease_managers[key]
@@ -0,0 +1,10 @@
+class _LazyLogger:
+    """Forwards to loguru's logger, which is only imported when something is logged.
+
+    Importing loguru takes longer than importing flowmason, so it is put off until something is logged.
+    """
+    def __getattr__(self, name):
+        import loguru
+        return getattr(loguru.logger, name)
+
+logger = _LazyLogger()
@@ -0,0 +1,134 @@
+"""Planning a run without running it: which steps would run, and which would be cached (see conduct's dry_run argument).
+
+A plan only consults the cache index, so it reads no artifacts, writes nothing, and logs nothing. A cache directory
+without an index is scanned without creating one, and the artifacts cached before digests were recorded are hashed
+without recording their digests.
+"""
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, OrderedDict, Union
+
+from .cache_index import get_cache_index, read_only_index
+from .dag import (MapReduceStep, SingletonStep, _get_map_items, _get_reduce_kwargs, _get_step_dependencies, 
+                  _get_step_version_and_kwargs, _lookup_cache, _lookup_map_chain, get_map_item_key)
+
+# map items that would run are listed in the summary up to this number.
+MAX_LISTED_MAP_ITEMS = 10
+
+@dataclass
+class PlannedStep:
+    step_name: str
+    # "cached", "run", or "skipped" if the step is not needed for the targets.
+    status: str
+    cache_path: Optional[str] = None
+    # for map reduce steps: the keys (see get_map_item_key) of the map items whose chain would run,
+    # and the number of map items whose chain is cached.
+    map_items_to_run: List[str] = field(default_factory=list)
+    num_map_items_cached: int = 0
+
+@dataclass
+class RunPlan:
+    steps: List[PlannedStep]
+
+    def get_steps(self, status: str) -> List[str]:
+        return [step.step_name for step in self.steps if step.status == status]
+
+    def summary(self) -> str:
+        lines = []
+        for step in self.steps:
+            line = f"{step.step_name}: {step.status}"
+            if step.status == "cached":
+                line += f" ({step.cache_path})"
+            elif step.map_items_to_run:
+                listed = ", ".join(step.map_items_to_run[:MAX_LISTED_MAP_ITEMS])
+                if len(step.map_items_to_run) > MAX_LISTED_MAP_ITEMS:
+                    listed += ", ..."
+                line += (f" ({len(step.map_items_to_run)} map items would run, {step.num_map_items_cached} "
+                         f"are cached: {listed})")
+            elif step.num_map_items_cached:
+                line += f" (all {step.num_map_items_cached} map items are cached; only the reduce would run)"
+            lines.append(line)
+        lines.append(f"{len(self.get_steps('run'))} steps would run, {len(self.get_steps('cached'))} are cached "
+                     f"and {len(self.get_steps('skipped'))} are skipped.")
+        return "\n".join(lines)
+
+def select_steps(experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]],
+                 targets: Iterable[str]) -> OrderedDict[str, Union[SingletonStep, MapReduceStep]]:
+    """Get the targets and the steps they depend on (directly or through other steps), in experiment order."""
+    needed = set(targets)
+    unknown_targets = needed.difference(experiment_steps)
+    if unknown_targets:
+        raise ValueError(f"Targets {sorted(unknown_targets)} are not steps of the experiment.")
+    step_names = list(experiment_steps.keys())
+    for i in reversed(range(len(step_names))):
+        if step_names[i] in needed:
+            needed.update(_get_step_dependencies(experiment_steps[step_names[i]], step_names[:i]))
+    return OrderedDict((step_name, step_impl) for step_name, step_impl in experiment_steps.items()
+                       if step_name in needed)
+
+def plan_steps(cache_dir: str, experiment_steps: OrderedDict[str, Union[SingletonStep, MapReduceStep]],
+               targets: Optional[Iterable[str]] = None) -> RunPlan:
+    """Find which steps of an experiment conduct would run, and which it would find in the cache.
+
+    Steps downstream of a step that would run are planned to run too, since their cache names depend on
+    the results of the steps upstream of them. They may still turn out to be cached, if the upstream step
+    reproduces its cached result.
+
+    Args:
+        cache_dir (str): The cache directory that conduct would use.
+        experiment_steps (OrderedDict[str, Union[SingletonStep, MapReduceStep]]): The steps, in order.
+        targets (Optional[Iterable[str]]): Only plan these steps and the steps they depend on; the others are skipped.
+    """
+    selected_steps = experiment_steps if targets is None else select_steps(experiment_steps, targets)
+    with read_only_index():
+        get_cache_index(cache_dir).refresh()
+        step_names = list(experiment_steps.keys())
+        cache_map = {}
+        steps_to_run = set()
+        planned_steps = []
+        for i, (step_name, step_impl) in enumerate(experiment_steps.items()):
+            if step_name not in selected_steps:
+                planned_steps.append(PlannedStep(step_name, "skipped"))
+                continue
+            upstream_runs = any(dependency in steps_to_run
+                                for dependency in _get_step_dependencies(step_impl, step_names[:i]))
+            if isinstance(step_impl, SingletonStep):
+                planned_step = _plan_singleton_step(step_name, step_impl, cache_map, cache_dir, upstream_runs)
+            else:
+                planned_step = _plan_map_reduce_step(step_name, step_impl, cache_map, cache_dir, upstream_runs)
+            if planned_step.status == "cached":
+                cache_map[step_name] = planned_step.cache_path
+            else:
+                steps_to_run.add(step_name)
+            planned_steps.append(planned_step)
+        return RunPlan(planned_steps)
+
+def _plan_singleton_step(step_name: str, step_impl: SingletonStep, cache_map, cache_dir: str,
+                         upstream_runs: bool) -> PlannedStep:
+    if upstream_runs:
+        return PlannedStep(step_name, "run")
+    step_version, step_kwargs = _get_step_version_and_kwargs(step_name, step_impl)
+    cache_path, is_cached = _lookup_cache(step_name, step_version, step_kwargs, cache_map, cache_dir)
+    return PlannedStep(step_name, "cached", cache_path) if is_cached else PlannedStep(step_name, "run")
+
+def _plan_map_reduce_step(step_name: str, step_impl: MapReduceStep, cache_map, cache_dir: str,
+                          upstream_runs: bool) -> PlannedStep:
+    map_items = _get_map_items(step_impl.map_params)
+    if upstream_runs:
+        return PlannedStep(step_name, "run", map_items_to_run=[get_map_item_key(map_item) for map_item in map_items])
+    # the same lookup as _lookup_map_reduce_cache, keeping the keys of the items that would run.
+    map_items_to_run, final_result_paths = [], []
+    for map_item in map_items:
+        chain_cache_paths = _lookup_map_chain(step_name, step_impl, map_item, cache_map, cache_dir)
+        if chain_cache_paths is None:
+            map_items_to_run.append(get_map_item_key(map_item))
+        else:
+            final_result_paths.append(chain_cache_paths[-1])
+    planned_step = PlannedStep(step_name, "run", map_items_to_run=map_items_to_run,
+                               num_map_items_cached=len(final_result_paths))
+    if not map_items_to_run:
+        cache_path, is_cached = _lookup_cache(step_name, step_impl.constant_params["version"],
+                                              _get_reduce_kwargs(step_name, step_impl, final_result_paths),
+                                              cache_map, cache_dir)
+        if is_cached:
+            planned_step.status, planned_step.cache_path = "cached", cache_path
+    return planned_step
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple
+import os
+import threading
+import time
+
+from .log import logger
+from .profiling import record_read
+from .result_registry import result_registry
+from .storage import get_artifact_version, load_cached_artifact
+
+# threads loading artifacts; reading and decompressing release the GIL, so a few threads overlap well.
+PREFETCH_THREADS = 4
+
+class Prefetcher:
+    """Loads the results of upstream steps on background threads, ahead of the steps that need them.
+
+    A step's inputs are then loaded concurrently rather than one after another, and the inputs of the next step
+    to run start loading while the current one computes (see conduct's prefetch_bytes argument). Like the result
+    registry, the prefetcher is only used by the process that activated it.
+
+    Prefetched results are held until a step takes them, up to max_bytes (estimated by their size on disk).
+    Once over budget, the oldest results that no step has taken yet are dropped.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loads: OrderedDict[str, Tuple[Future, int]] = OrderedDict()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._owner_pid: Optional[int] = None
+        self.max_bytes = 0
+        self.current_bytes = 0
+
+    @property
+    def active(self) -> bool:
+        return self._pool is not None and self._owner_pid == os.getpid()
+
+    def activate(self, max_bytes: int) -> bool:
+        """Start prefetching, holding at most max_bytes of results. Returns False if the prefetcher was already active."""
+        if self.active:
+            return False
+        self._pool = ThreadPoolExecutor(max_workers=PREFETCH_THREADS, thread_name_prefix="flowmason-prefetch")
+        self._owner_pid = os.getpid()
+        self.max_bytes = max_bytes
+        return True
+
+    def deactivate(self):
+        """Cancel the loads that have not started, and drop the results that no step has taken."""
+        with self._lock:
+            for future, _ in self._loads.values():
+                future.cancel()
+            self._loads.clear()
+            self.current_bytes = 0
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        self._owner_pid = None
+
+    def prefetch(self, cache_paths: Iterable[str]):
+        """Start loading the artifacts at cache_paths, unless they are already loading or do not fit in the budget."""
+        if not self.active:
+            return
+        for cache_path in cache_paths:
+            if cache_path in result_registry:
+                continue
+            with self._lock:
+                if cache_path in self._loads:
+                    continue
+                try:
+                    _, size = get_artifact_version(cache_path)
+                except FileNotFoundError:
+                    continue
+                if not self._make_room(size):
+                    logger.debug(f"Not prefetching {cache_path}, which does not fit in the prefetch budget.")
+                    continue
+                self._loads[cache_path] = (self._pool.submit(load_cached_artifact, cache_path), size)
+                self.current_bytes += size
+
+    def submit(self, fn: Callable, *args):
+        """Run fn on a prefetch thread, e.g. to look up which steps will run before prefetching their inputs."""
+        if self.active:
+            self._pool.submit(fn, *args)
+
+    def take(self, cache_path: str) -> Optional[Future]:
+        """Get the load of a prefetched artifact, or None if it was not prefetched. The prefetcher no longer holds it."""
+        with self._lock:
+            load = self._loads.pop(cache_path, None)
+            if load is None:
+                return None
+            future, size = load
+            self.current_bytes -= size
+        if future.cancelled():
+            return None
+        start = time.perf_counter()
+        future.exception() # wait for the load.
+        # the step is charged for the time it waited on the load, rather than the time the load took.
+        record_read(time.perf_counter() - start, size)
+        return future
+
+    def discard(self, cache_path: str):
+        """Drop a prefetched artifact that no step will take."""
+        with self._lock:
+            load = self._loads.pop(cache_path, None)
+            if load is not None:
+                load[0].cancel()
+                self.current_bytes -= load[1]
+
+    def _make_room(self, size: int) -> bool:
+        """Drop the oldest finished loads until size more bytes fit in the budget. Returns whether they fit."""
+        if size > self.max_bytes:
+            return False
+        for cache_path in list(self._loads):
+            if self.current_bytes + size <= self.max_bytes:
+                break
+            future, loaded_size = self._loads[cache_path]
+            if future.done():
+                del self._loads[cache_path]
+                self.current_bytes -= loaded_size
+        return self.current_bytes + size <= self.max_bytes
+
+prefetcher = Prefetcher()
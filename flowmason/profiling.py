@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+import json
+import time
+import tracemalloc
+
+@dataclass
+class StepProfile:
+    """Where a step (or a map item of a map reduce step) spent its time. Times are in seconds."""
+    start: float # time.time() when the step started, for placing it on a timeline
+    cache: str = "miss" # "hit" if the step's result was found in the cache
+    wall_time: float = 0.0
+    cpu_time: Optional[float] = None # CPU time of the thread running the step; not measured with the async executor
+    serialize_time: float = 0.0 # writing results to the cache, including compression
+    deserialize_time: float = 0.0 # reading results (of this step's inputs) from the cache
+    bytes_written: int = 0
+    bytes_read: int = 0
+    peak_memory: Optional[int] = None # bytes allocated by Python at the peak, above the start; only with trace_memory
+    reduce_time: Optional[float] = None # time spent in reduce_fn, for map reduce steps
+    batch_items: Optional[int] = None # number of map items in the batch, for batched steps
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+_current_profile: ContextVar[Optional[StepProfile]] = ContextVar("flowmason_step_profile", default=None)
+
+@contextmanager
+def profile_step(measure_cpu: bool = True):
+    """Profile the step run in this block. Cache reads and writes in the block (and on threads started
+    with a copy of its context, e.g. with asyncio.to_thread) are recorded in the yielded StepProfile.
+
+    Peak memory is measured while tracemalloc is tracing. The peak is process-wide, so it is only
+    accurate for steps that do not run at the same time as other steps.
+    """
+    profile = StepProfile(start=time.time())
+    # the highest peak seen before the peak was reset by a step run inside this one.
+    profile._traced_peak = 0
+    enclosing_profile = _current_profile.get()
+    token = _current_profile.set(profile)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        if enclosing_profile is not None:
+            # e.g., the map reduce step of a map item.
+            enclosing_profile._traced_peak = max(enclosing_profile._traced_peak, peak_memory)
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    cpu_start = time.thread_time() if measure_cpu else None
+    try:
+        yield profile
+    finally:
+        profile.wall_time = time.perf_counter() - start
+        if measure_cpu:
+            profile.cpu_time = time.thread_time() - cpu_start
+        if tracing and tracemalloc.is_tracing():
+            peak_memory = max(profile._traced_peak, tracemalloc.get_traced_memory()[1])
+            profile.peak_memory = max(0, peak_memory - current_memory)
+        _current_profile.reset(token)
+
+def record_write(seconds: float, num_bytes: int):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.serialize_time += seconds
+        profile.bytes_written += num_bytes
+
+def record_read(seconds: float, num_bytes: int):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.deserialize_time += seconds
+        profile.bytes_read += num_bytes
+
+def record_reduce(seconds: float):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.reduce_time = (profile.reduce_time or 0.0) + seconds
+
+def timed_reduce_fn(reduce_fn):
+    """Wrap a reduce function so that the time spent in it is recorded as the reduce time of the current step."""
+    def wrapper(*args):
+        start = time.perf_counter()
+        try:
+            return reduce_fn(*args)
+        finally:
+            record_reduce(time.perf_counter() - start)
+    return wrapper
+
+def _iter_profiled_steps(run_metadata: List):
+    """Yield (name, category, metadata) for every step and map item of a run that has a profile."""
+    for step_name, step_metadata in run_metadata:
+        if isinstance(step_metadata, list):
+            # a map reduce step that was executed: the metadata of its map items, followed by its own.
+            for map_step_name, map_step_metadata in step_metadata[:-1]:
+                yield map_step_metadata["kwargs"].get("step_name", map_step_name), "map", map_step_metadata
+            step_metadata = step_metadata[-1]
+        yield step_name, "step", step_metadata
+
+def export_chrome_trace(run_metadata: List, trace_path: str):
+    """Write the profiles of the steps of a run as a Chrome trace, which can be opened in chrome://tracing or ui.perfetto.dev.
+
+    Args:
+        run_metadata (List): The metadata of a run, as returned by conduct or load_latest_steps.
+        trace_path (str): Path of the JSON file to write.
+    """
+    events = []
+    for name, category, metadata in _iter_profiled_steps(run_metadata):
+        profile = metadata.get("profile")
+        if profile is None: # e.g., runs recorded before steps were profiled, or failed steps.
+            continue
+        events.append({
+            "name": name,
+            "cat": f"{category},{profile['cache']}",
+            "ph": "X",
+            "ts": profile["start"] * 1e6,
+            "dur": profile["wall_time"] * 1e6,
+            "pid": 1,
+            "args": profile
+        })
+    # steps that overlap in time go on separate rows.
+    row_ends = []
+    for event in sorted(events, key=lambda event: (event["ts"], -event["dur"])):
+        row = next((i for i, row_end in enumerate(row_ends) if row_end <= event["ts"]), len(row_ends))
+        if row == len(row_ends):
+            row_ends.append(0.0)
+        row_ends[row] = event["ts"] + event["dur"]
+        event["tid"] = row
+    with open(trace_path, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Optional
+import os
+import threading
+
+class ResultRegistry:
+    """Keeps the results computed during a conduct call in memory, and persists them on a background writer thread.
+
+    Downstream steps in the same conduct call get the live result object instead of reading it back from
+    the cache directory. The registry is only used by the process that activated it; worker processes
+    (e.g., of a process pool) write and read their results synchronously.
+
+    Once no step needs a result anymore, conduct releases it, so that only the results that are still
+    needed are kept in memory. Released results are still written, and read back from the cache directory.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[str, Any] = {}
+        self._writes: Dict[str, Future] = {}
+        self._digests: Dict[str, str] = {}
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._owner_pid: Optional[int] = None
+        # the serialized (uncompressed) size of each result held in memory, as an estimate of its size in memory.
+        self._sizes: Dict[str, int] = {}
+        self._resident_bytes = 0
+        self._peak_resident_bytes = 0
+
+    @property
+    def active(self) -> bool:
+        return self._writer is not None and self._owner_pid == os.getpid()
+
+    def activate(self) -> bool:
+        """Start keeping results in memory. Returns False if the registry was already active."""
+        if self.active:
+            return False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flowmason-writer")
+        self._owner_pid = os.getpid()
+        return True
+
+    def deactivate(self):
+        """Wait for all pending writes, then drop the in-memory results."""
+        try:
+            self.flush()
+        finally:
+            self._writer.shutdown(wait=True)
+            with self._lock:
+                self._results.clear()
+                self._writes.clear()
+                self._digests.clear()
+                self._sizes.clear()
+                self._resident_bytes = self._peak_resident_bytes = 0
+            self._writer = None
+            self._owner_pid = None
+
+    def put(self, cache_path: str, result: Any, digest: str, size: int, write_fn: Callable[[], str]):
+        """Register a result, whose serialized bytes have digest and size, and schedule write_fn, which persists it."""
+        with self._lock:
+            self._resident_bytes += size - self._sizes.get(cache_path, 0)
+            self._peak_resident_bytes = max(self._peak_resident_bytes, self._resident_bytes)
+            self._sizes[cache_path] = size
+            self._results[cache_path] = result
+            self._digests[cache_path] = digest
+            self._writes[cache_path] = self._writer.submit(write_fn)
+
+    def release(self, cache_path: str):
+        """Drop the in-memory copy of a result. Its write still goes ahead."""
+        if not self.active:
+            return
+        with self._lock:
+            if cache_path in self._results:
+                del self._results[cache_path]
+                self._resident_bytes -= self._sizes.pop(cache_path)
+
+    def __contains__(self, cache_path: str) -> bool:
+        return self.active and cache_path in self._results
+
+    def is_registered(self, cache_path: str) -> bool:
+        """Whether a result was put in the registry, whether or not it has been released since."""
+        return self.active and cache_path in self._writes
+
+    def get(self, cache_path: str) -> Any:
+        return self._results[cache_path]
+
+    def get_digest(self, cache_path: str) -> Optional[str]:
+        """Get the digest of a registered result, which is known before its write has finished. None if it is not registered."""
+        if not self.active:
+            return None
+        with self._lock:
+            return self._digests.get(cache_path)
+
+    def wait_for_write(self, cache_path: str):
+        """Block until a registered result has been written, raising its write error. Does nothing if it is not registered."""
+        if not self.active:
+            return
+        with self._lock:
+            write = self._writes.get(cache_path)
+        if write is not None:
+            write.result()
+
+    def flush(self):
+        """Block until every pending write has finished, raising the first write error."""
+        if not self.active:
+            return
+        with self._lock:
+            writes = list(self._writes.values())
+        for write in writes:
+            write.result()
+
+    def get_peak_resident_bytes(self) -> int:
+        """The most bytes of results held in memory at once since the registry was activated, by their serialized size."""
+        with self._lock:
+            return self._peak_resident_bytes
+
+result_registry = ResultRegistry()
@@ -0,0 +1,172 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+
+from .jsonl_log import JsonlLog
+from .log import logger
+
+OUTPUTS_DIR = "outputs"
+RUNS_INDEX_FILENAME = "runs.jsonl"
+RUN_FILE_PREFIX = "run_"
+
+def get_run_fname(run_num: int) -> str:
+    return f"{RUN_FILE_PREFIX}{str(run_num).zfill(4)}.json"
+
+def _parse_run_num(fname: str) -> Optional[int]:
+    if not (fname.startswith(RUN_FILE_PREFIX) and fname.endswith(".json")):
+        return None
+    try:
+        return int(fname[len(RUN_FILE_PREFIX):-len(".json")])
+    except ValueError:
+        return None
+
+def summarize_steps(steps_metadata: List) -> Dict[str, Dict[str, Any]]:
+    """Get what the run index records about each step of a run: its version, execution status and cache path."""
+    summary = {}
+    for step_name, step_metadata in steps_metadata:
+        if isinstance(step_metadata, list):
+            # a map reduce step that was executed: the metadata of its map items, followed by its own.
+            step_metadata = step_metadata[-1]
+        summary[step_name] = {
+            "version": step_metadata.get("version"),
+            "execution_status": step_metadata.get("execution_status"),
+            "cache_path": step_metadata.get("cache_path")
+        }
+    return summary
+
+class RunStore(JsonlLog):
+    """Append-only index of the runs of an experiment.
+
+    Each line of outputs/<experiment>/runs.jsonl records a finished run: its number, run file, start and
+    end time, status ("complete" or "failed"), and the version, execution status and cache path of each
+    of its steps. Like the cache index, the log is read once and then followed as other processes append
+    to it, so finding the latest run or the history of a step does not read any run files. The run files
+    themselves hold the full metadata of each run.
+
+    Run numbers are allocated by creating the run file exclusively, so concurrent runs of an experiment
+    never get the same number.
+    """
+    def __init__(self, experiment_dir: str):
+        super().__init__(os.path.join(experiment_dir, RUNS_INDEX_FILENAME))
+        self.experiment_dir = experiment_dir
+        self._runs: Dict[int, Dict[str, Any]] = {}
+
+    def allocate_run(self) -> Tuple[int, str]:
+        """Reserve the next run number by creating its (empty) run file.
+
+        Returns:
+            Tuple of the run number and the path of its run file.
+        """
+        self.refresh()
+        os.makedirs(self.experiment_dir, exist_ok=True)
+        run_num = max(self._runs, default=-1) + 1
+        while True:
+            run_fname = os.path.join(self.experiment_dir, get_run_fname(run_num))
+            try:
+                with open(run_fname, 'x') as f:
+                    # a valid run without steps, until the run is recorded.
+                    f.write("[]")
+                return run_num, run_fname
+            except FileExistsError:
+                # taken by a run that is still in progress, or that has not been indexed.
+                run_num += 1
+
+    def record_run(self, run_num: int, steps_metadata: List, started: float, status: str,
+                   peak_resident_bytes: Optional[int] = None):
+        """Record a run whose metadata has been written to its run file.
+
+        Args:
+            peak_resident_bytes (Optional[int]): The most bytes of results the run held in memory at once
+                (with conduct's write_behind argument).
+        """
+        record = {
+            "run": run_num,
+            "file": get_run_fname(run_num),
+            "started": started,
+            "finished": time.time(),
+            "status": status,
+            "steps": summarize_steps(steps_metadata)
+        }
+        if peak_resident_bytes is not None:
+            record["peak_resident_bytes"] = peak_resident_bytes
+        self._append(record)
+
+    def runs(self) -> List[Dict[str, Any]]:
+        """The recorded runs, in order of their run numbers."""
+        self.refresh()
+        with self._lock:
+            return [self._runs[run_num] for run_num in sorted(self._runs)]
+
+    def latest_run(self) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        with self._lock:
+            return self._runs[max(self._runs)] if self._runs else None
+
+    def get_run_path(self, run: Dict[str, Any]) -> str:
+        return os.path.join(self.experiment_dir, run["file"])
+
+    def import_run_files(self) -> int:
+        """Record the run files that are not in the index yet, e.g. those written before the experiment had an index.
+
+        Runs still in progress have empty run files; they record themselves when they finish.
+
+        Returns:
+            The number of runs imported.
+        """
+        with self._lock:
+            os.makedirs(self.experiment_dir, exist_ok=True)
+            # create the (possibly empty) log, so that the run files are only imported once.
+            self._create()
+            self.refresh()
+            num_imported = 0
+            for fname in sorted(os.listdir(self.experiment_dir)):
+                run_num = _parse_run_num(fname)
+                if run_num is None or run_num in self._runs:
+                    continue
+                run_path = os.path.join(self.experiment_dir, fname)
+                try:
+                    with open(run_path, 'r') as f:
+                        steps_metadata = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    logger.warning(f"Skipping run file {run_path}: {e}")
+                    continue
+                if not steps_metadata:
+                    continue
+                failed = any(not isinstance(metadata, list) and metadata.get("execution_status") == "failed"
+                             for _, metadata in steps_metadata)
+                modified = os.path.getmtime(run_path)
+                self._append({
+                    "run": run_num,
+                    "file": fname,
+                    "started": modified,
+                    "finished": modified,
+                    "status": "failed" if failed else "complete",
+                    "steps": summarize_steps(steps_metadata)
+                })
+                num_imported += 1
+            return num_imported
+
+    def _apply(self, record: Dict[str, Any]):
+        self._runs[record["run"]] = record
+
+    def _clear(self):
+        self._runs = {}
+
+    def _on_missing(self):
+        if os.path.isdir(self.experiment_dir):
+            self.import_run_files()
+
+_run_stores: Dict[str, RunStore] = {}
+_run_stores_lock = threading.Lock()
+
+def get_run_store(experiment_name: str, outputs_dir: str = OUTPUTS_DIR) -> RunStore:
+    """Get the process-wide run store of an experiment."""
+    experiment_dir = os.path.join(outputs_dir, experiment_name)
+    key = os.path.abspath(experiment_dir)
+    with _run_stores_lock:
+        run_store = _run_stores.get(key)
+        if run_store is None:
+            run_store = _run_stores[key] = RunStore(experiment_dir)
+    return run_store
@@ -0,0 +1,129 @@
+from abc import ABC, abstractmethod
+from typing import Any, BinaryIO, Dict
+import mmap
+import pickle
+import struct
+
+class Serializer(ABC):
+    """Writes a step result to a binary file and loads it back from a cache path.
+
+    Subclasses implement dump and load_stream; load reads the cache path through load_stream unless overridden.
+    """
+    @abstractmethod
+    def dump(self, obj: Any, f: BinaryIO):
+        pass
+
+    def load(self, cache_path: str) -> Any:
+        with open(cache_path, 'rb') as f:
+            return self.load_stream(f)
+
+    @abstractmethod
+    def load_stream(self, f: BinaryIO) -> Any:
+        """Load a result from a (possibly decompressing) binary stream, which may not support memory-mapping."""
+
+class DillSerializer(Serializer):
+    def dump(self, obj: Any, f: BinaryIO):
+        import dill
+        dill.dump(obj, f)
+
+    def load_stream(self, f: BinaryIO) -> Any:
+        import dill
+        return dill.load(f)
+
+class Pickle5Serializer(Serializer):
+    """Pickle protocol 5, with large buffers (e.g., NumPy arrays) stored out-of-band.
+
+    The file holds a header, the pickle stream, and then each out-of-band buffer at a 64-byte aligned
+    offset. Loading an uncompressed file memory-maps it and hands the buffers to the unpickler without
+    copying them, so arrays in the result are read-only views of the file.
+    """
+    MAGIC = b"FMPKL5\x00\x00"
+    ALIGNMENT = 64
+
+    def dump(self, obj: Any, f: BinaryIO):
+        buffers = []
+        stream = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        raw_buffers = [buffer.raw() for buffer in buffers]
+        offset = len(self.MAGIC) + 16 + 16 * len(raw_buffers) + len(stream)
+        buffer_table = []
+        for raw_buffer in raw_buffers:
+            offset = self._align(offset)
+            buffer_table.append((offset, raw_buffer.nbytes))
+            offset += raw_buffer.nbytes
+        f.write(self.MAGIC)
+        f.write(struct.pack("<QQ", len(stream), len(raw_buffers)))
+        for buffer_offset, buffer_size in buffer_table:
+            f.write(struct.pack("<QQ", buffer_offset, buffer_size))
+        f.write(stream)
+        position = len(self.MAGIC) + 16 + 16 * len(raw_buffers) + len(stream)
+        for (buffer_offset, _), raw_buffer in zip(buffer_table, raw_buffers):
+            f.write(b"\x00" * (buffer_offset - position))
+            f.write(raw_buffer)
+            position = buffer_offset + raw_buffer.nbytes
+
+    def load(self, cache_path: str) -> Any:
+        with open(cache_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._loads(memoryview(mapped), cache_path)
+
+    def load_stream(self, f: BinaryIO) -> Any:
+        return self._loads(memoryview(f.read()), getattr(f, "name", "stream"))
+
+    def _loads(self, view: memoryview, cache_path: str) -> Any:
+        if bytes(view[:len(self.MAGIC)]) != self.MAGIC:
+            raise ValueError(f"{cache_path} is not a pickle5 artifact.")
+        position = len(self.MAGIC)
+        stream_size, num_buffers = struct.unpack_from("<QQ", view, position)
+        position += 16
+        buffers = []
+        for _ in range(num_buffers):
+            buffer_offset, buffer_size = struct.unpack_from("<QQ", view, position)
+            buffers.append(view[buffer_offset:buffer_offset + buffer_size])
+            position += 16
+        return pickle.loads(view[position:position + stream_size], buffers=buffers)
+
+    def _align(self, offset: int) -> int:
+        return (offset + self.ALIGNMENT - 1) // self.ALIGNMENT * self.ALIGNMENT
+
+class NpySerializer(Serializer):
+    """NumPy's .npy format. Only works for arrays; uncompressed loads return a read-only memory-mapped array."""
+    def dump(self, obj: Any, f: BinaryIO):
+        import numpy as np
+        if not isinstance(obj, np.ndarray):
+            raise TypeError(f"The npy serializer can only store numpy arrays, not {type(obj)}.")
+        np.save(f, obj, allow_pickle=False)
+
+    def load(self, cache_path: str) -> Any:
+        import numpy as np
+        return np.load(cache_path, mmap_mode='r', allow_pickle=False)
+
+    def load_stream(self, f: BinaryIO) -> Any:
+        import numpy as np
+        return np.load(f, allow_pickle=False)
+
+SERIALIZERS: Dict[str, Serializer] = {
+    "dill": DillSerializer(),
+    "pickle5": Pickle5Serializer(),
+    "npy": NpySerializer()
+}
+DEFAULT_SERIALIZER = "dill"
+_default_serializer = DEFAULT_SERIALIZER
+
+def register_serializer(name: str, serializer: Serializer):
+    if not isinstance(serializer, Serializer):
+        raise TypeError(f"Serializer {name} must be an instance of a Serializer subclass, not {type(serializer)}.")
+    SERIALIZERS[name] = serializer
+
+def set_default_serializer(name: str):
+    """Set the serializer used by steps that do not pick one with the "serializer" step param."""
+    global _default_serializer
+    get_serializer(name)
+    _default_serializer = name
+
+def resolve_serializer_name(step_kwargs: Dict[str, Any]) -> str:
+    return step_kwargs.get("serializer", _default_serializer)
+
+def get_serializer(name: str) -> Serializer:
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown serializer {name}. Expected one of {list(SERIALIZERS.keys())}.")
+    return SERIALIZERS[name]
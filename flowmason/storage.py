@@ -0,0 +1,426 @@
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+from .artifact_cache import artifact_cache
+from .cache_index import (BLOBS_DIRNAME, ENTRY_INFO_SUFFIX, SEGMENTS_DIRNAME, SHARD_WIDTH, TMP_SUFFIX, CacheIndex, 
+                          get_cache_index, is_read_only)
+from .compression import open_compressed_reader, open_compressed_writer
+from .profiling import record_read, record_write
+from .result_registry import result_registry
+from .serializers import DEFAULT_SERIALIZER, get_serializer
+
+# packed artifacts larger than this are written to their own file anyway.
+PACK_MAX_ARTIFACT_BYTES = 1 << 20
+# a new segment file is started once the current one is this large.
+SEGMENT_MAX_BYTES = 256 << 20
+# check the digest of each artifact as it is read; see set_verify_digests.
+_verify_digests = False
+
+class CorruptArtifactError(Exception):
+    pass
+
+class MissingArtifactError(Exception):
+    """An artifact in the cache index whose file is gone or corrupt, e.g. deleted by hand. It has been removed from the index."""
+    def __init__(self, cache_path: str):
+        super().__init__(cache_path)
+        self.cache_path = cache_path
+
+    def __str__(self) -> str:
+        return f"The cached artifact {self.cache_path} is missing or corrupt"
+
+class CacheRelativeArtifact:
+    """Base class of artifacts that refer to other artifacts in their cache directory by their paths relative to it.
+
+    The cache directory is not serialized; it is set when the artifact is read, so the artifact still loads after
+    the cache directory is moved or from another working directory, and its digest does not depend on where it is.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("cache_dir", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.cache_dir = None
+
+class _ArtifactTooLargeError(Exception):
+    pass
+
+class _HashingWriter:
+    """Wraps a binary file, computing the SHA-256 digest of everything written to it."""
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, data):
+        self.sha.update(data)
+        return self.f.write(data)
+
+class _BoundedBuffer(io.BytesIO):
+    """In-memory file that gives up (raising _ArtifactTooLargeError) once more than max_bytes are written to it."""
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+
+    def write(self, data):
+        if self.tell() + memoryview(data).nbytes > self.max_bytes:
+            raise _ArtifactTooLargeError()
+        return super().write(data)
+
+class _SegmentWriter:
+    """Appends packed artifacts to segment files in cache_dir/segments.
+
+    Each process appends to its own segment file, so appends from different processes never interleave
+    and the offset of each artifact is known without locking the file.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._f = None
+        self._pid = None
+        self.segment = None
+
+    def append(self, data: bytes) -> Tuple[str, int]:
+        """Append data to the current segment, returning the segment (relative to cache_dir) and the offset of data in it."""
+        with self._lock:
+            # a forked worker must not append to the segment of its parent, and a segment deleted along with its
+            # cache directory must not be appended to.
+            if (self._f is None or self._pid != os.getpid() or self._f.tell() >= SEGMENT_MAX_BYTES
+                    or os.fstat(self._f.fileno()).st_nlink == 0):
+                self._open_segment()
+            offset = self._f.tell()
+            self._f.write(data)
+            self._f.flush()
+            return self.segment, offset
+
+    def _open_segment(self):
+        os.makedirs(os.path.join(self.cache_dir, SEGMENTS_DIRNAME), exist_ok=True)
+        self._pid = os.getpid()
+        self.segment = os.path.join(SEGMENTS_DIRNAME, f"{self._pid}-{uuid.uuid4().hex}.seg")
+        self._f = open(os.path.join(self.cache_dir, self.segment), 'xb')
+
+_segment_writers: Dict[str, _SegmentWriter] = {}
+_segment_writers_lock = threading.Lock()
+
+def _get_segment_writer(cache_dir: str) -> _SegmentWriter:
+    key = os.path.abspath(cache_dir)
+    with _segment_writers_lock:
+        if key not in _segment_writers:
+            _segment_writers[key] = _SegmentWriter(cache_dir)
+        return _segment_writers[key]
+
+def set_verify_digests(verify: bool):
+    """Check that the serialized bytes of each artifact read from the cache still have the digest recorded
+    when it was written, raising CorruptArtifactError otherwise. This reads each artifact twice."""
+    global _verify_digests
+    _verify_digests = verify
+
+def _write_atomically(path: str, write_fn, finish_fn=None):
+    """Call write_fn on a temporary file next to path, then rename it to path.
+
+    A crash part of the way through leaves path untouched, rather than truncated.
+
+    Args:
+        finish_fn: Called with the temporary file and the result of write_fn before the rename, returning
+            the file to rename to path instead (see _share_blob).
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+    try:
+        with open(tmp_path, 'xb') as f:
+            result = write_fn(f)
+        if finish_fn is not None:
+            tmp_path = finish_fn(tmp_path, result)
+        os.replace(tmp_path, path)
+        return result
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def get_artifact_path(cache_dir: str, hashed_name: str) -> str:
+    """Get the cache path of an artifact, in a subdirectory of cache_dir named after the first characters of its hashed name.
+
+    Spreading the artifacts over subdirectories keeps each directory small, even for caches with millions of artifacts.
+    """
+    return os.path.join(cache_dir, hashed_name[:SHARD_WIDTH], hashed_name)
+
+def get_blob_path(cache_dir: str, digest: str, codec: Optional[str]) -> str:
+    """Get the path of the blob shared by the artifact files whose serialized bytes have digest, compressed with codec."""
+    blob_name = digest if codec is None else f"{digest}.{codec.replace(':', '-')}"
+    return os.path.join(cache_dir, BLOBS_DIRNAME, digest[:SHARD_WIDTH], blob_name)
+
+def _share_blob(blob_path: str, tmp_path: str) -> str:
+    """Deduplicate a freshly written artifact file against the identical artifacts cached before it.
+
+    If the blob of its contents exists, the written file is discarded in favour of a new hard link to the blob.
+    Otherwise, the written file becomes the blob. Either way, the artifact and the blob then share their bytes on disk.
+
+    Returns:
+        The file to rename into place.
+    """
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    link_path = f"{tmp_path[:-len(TMP_SUFFIX)]}.link{TMP_SUFFIX}"
+    try:
+        os.link(blob_path, link_path)
+    except FileNotFoundError:
+        try:
+            os.link(tmp_path, blob_path)
+        except OSError:
+            # written by another process in the meantime, or the file system has no hard links.
+            pass
+        return tmp_path
+    except OSError:
+        return tmp_path
+    os.remove(tmp_path)
+    return link_path
+
+def get_cache_dir(cache_path: str) -> str:
+    """Get the cache directory of a cache path, which is either in a subdirectory of the cache directory or (for
+    artifacts cached before the subdirectories were introduced) directly in it."""
+    parent = os.path.dirname(cache_path)
+    shard = os.path.basename(parent)
+    if len(shard) == SHARD_WIDTH and len(os.path.basename(cache_path)) == 64 and os.path.basename(cache_path).startswith(shard):
+        return os.path.dirname(parent)
+    return parent
+
+def find_artifact(cache_dir: str, hashed_name: str, refresh: bool = True) -> Tuple[str, bool]:
+    """Find a cached artifact by its hashed name.
+
+    Returns:
+        Tuple of the cache path and whether the artifact is cached. Artifacts cached directly in cache_dir
+        are still found; otherwise, the returned path is where the artifact should be cached.
+    """
+    cache_path = get_artifact_path(cache_dir, hashed_name)
+    if artifact_exists(cache_path, refresh):
+        return cache_path, True
+    legacy_cache_path = os.path.join(cache_dir, hashed_name)
+    if artifact_exists(legacy_cache_path, refresh):
+        return legacy_cache_path, True
+    return cache_path, False
+
+def get_index_for_path(cache_path: str) -> CacheIndex:
+    return get_cache_index(get_cache_dir(cache_path))
+
+def _serialize(dump_fn: Callable[[Any], None], codec: Optional[str], f) -> str:
+    with open_compressed_writer(f, codec) as compressed:
+        writer = _HashingWriter(compressed)
+        dump_fn(writer)
+    return writer.sha.hexdigest()
+
+def serialize_artifact(result: Any, serializer_name: str) -> Tuple[bytes, str]:
+    """Serialize a result in memory, e.g. to know its digest before it is written with write_serialized_artifact.
+
+    The serialization is recorded as a write in the profile of the current step, since the write itself may
+    happen on another thread (e.g., the result registry's writer thread) after the step has finished.
+
+    Returns:
+        Tuple of the serialized (uncompressed) bytes and their SHA-256 digest.
+    """
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    digest = _serialize(partial(get_serializer(serializer_name).dump, result), None, buffer)
+    data = buffer.getvalue()
+    record_write(time.perf_counter() - start, len(data))
+    return data, digest
+
+def write_artifact(cache_path: str, result: Any, serializer_name: str, codec: Optional[str] = None,
+                   pack: bool = False, extra_entry_info: Optional[Dict[str, Any]] = None) -> str:
+    """Serialize a result to cache_path, streaming it through the codec.
+
+    The artifact is recorded in the cache index (with the digest of the serialized bytes, serializer, codec
+    and size on disk) only after it has been renamed into place, so an indexed artifact is always complete.
+
+    Args:
+        pack (bool): Append the artifact to a segment file shared with other artifacts rather than writing it to
+            its own file, if it is at most PACK_MAX_ARTIFACT_BYTES. The cache path then only exists in the index.
+        extra_entry_info (Optional[Dict[str, Any]]): More to record in the artifact's index entry.
+
+    Returns:
+        The SHA-256 digest of the serialized (uncompressed) bytes.
+    """
+    start = time.perf_counter()
+    digest, size = _write_artifact(cache_path, partial(get_serializer(serializer_name).dump, result), serializer_name, 
+                                   codec, pack, extra_entry_info or {})
+    record_write(time.perf_counter() - start, size)
+    return digest
+
+def write_serialized_artifact(cache_path: str, data: bytes, serializer_name: str, codec: Optional[str] = None,
+                              pack: bool = False) -> str:
+    """Like write_artifact, for a result already serialized with serialize_artifact, which recorded the write."""
+    digest, _ = _write_artifact(cache_path, lambda f: f.write(data), serializer_name, codec, pack, {})
+    return digest
+
+def _write_artifact(cache_path: str, dump_fn: Callable[[Any], None], serializer_name: str, codec: Optional[str], 
+                    pack: bool, extra_entry_info: Dict[str, Any]) -> Tuple[str, int]:
+    entry_info = {"serializer": serializer_name, "codec": codec, **extra_entry_info}
+    if pack:
+        buffer = _BoundedBuffer(PACK_MAX_ARTIFACT_BYTES)
+        try:
+            digest = _serialize(dump_fn, codec, buffer)
+        except _ArtifactTooLargeError:
+            pass
+        else:
+            index = get_index_for_path(cache_path)
+            # an identical packed artifact is pointed to rather than appended again.
+            identical_entry = index.find_packed(digest, codec)
+            if identical_entry is not None:
+                segment, offset, num_bytes_written = identical_entry["segment"], identical_entry["offset"], 0
+            else:
+                segment, offset = _get_segment_writer(get_cache_dir(cache_path)).append(buffer.getbuffer())
+                num_bytes_written = buffer.tell()
+            index.add(cache_path, {**entry_info, "digest": digest, "size": buffer.tell(),
+                                   "segment": segment, "offset": offset})
+            return digest, num_bytes_written
+
+    def write_fn(f):
+        digest = _serialize(dump_fn, codec, f)
+        f.flush()
+        return digest, f.tell()
+
+    def share_blob(tmp_path, written):
+        digest, _ = written
+        return _share_blob(get_blob_path(cache_dir, digest, codec), tmp_path)
+
+    cache_dir = get_cache_dir(cache_path)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    digest, size = _write_atomically(cache_path, write_fn, share_blob)
+    blob_path = get_blob_path(cache_dir, digest, codec)
+    if os.path.exists(blob_path) and os.path.samefile(blob_path, cache_path):
+        entry_info["blob"] = os.path.relpath(blob_path, cache_dir)
+    get_index_for_path(cache_path).add(cache_path, {**entry_info, "digest": digest, "size": size})
+    return digest, size
+
+def read_entry_info(cache_path: str) -> Dict[str, Any]:
+    """Get what was recorded about a cached artifact when it was written (its digest, serializer, codec and size).
+
+    Artifacts written before the cache directory had an index may have their entry info in a file next to them.
+    Artifacts cached before either existed have no entry info; they were written with dill, uncompressed.
+    """
+    entry_info = get_index_for_path(cache_path).get(cache_path)
+    if entry_info is not None:
+        return entry_info
+    try:
+        with open(f"{cache_path}{ENTRY_INFO_SUFFIX}", 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _read_packed_bytes(cache_path: str, entry_info: Dict[str, Any]) -> bytes:
+    segment_path = os.path.join(get_cache_dir(cache_path), entry_info["segment"])
+    with open(segment_path, 'rb') as f:
+        f.seek(entry_info["offset"])
+        data = f.read(entry_info["size"])
+    if len(data) != entry_info["size"]:
+        raise CorruptArtifactError(f"{segment_path} ends before {cache_path}, which was packed at offset {entry_info['offset']}.")
+    return data
+
+def _read_packed_artifact(cache_path: str, entry_info: Dict[str, Any]) -> Any:
+    with open_compressed_reader(io.BytesIO(_read_packed_bytes(cache_path, entry_info)), entry_info["codec"]) as f:
+        return get_serializer(entry_info["serializer"]).load_stream(f)
+
+def _verify_digest(cache_path: str, entry_info: Dict[str, Any]):
+    """Hash the serialized bytes of an artifact, raising CorruptArtifactError if they do not have the recorded digest."""
+    sha = hashlib.sha256()
+    raw = io.BytesIO(_read_packed_bytes(cache_path, entry_info)) if "segment" in entry_info else open(cache_path, 'rb')
+    with raw, open_compressed_reader(raw, entry_info.get("codec")) as f:
+        for chunk in iter(partial(f.read, 1 << 20), b''):
+            sha.update(chunk)
+    if sha.hexdigest() != entry_info["digest"]:
+        raise CorruptArtifactError(f"The contents of {cache_path} do not have the digest {entry_info['digest']} "
+                                   f"recorded when it was written.")
+
+def read_artifact(cache_path: str, default_serializer: str = DEFAULT_SERIALIZER) -> Any:
+    start = time.perf_counter()
+    entry_info = read_entry_info(cache_path)
+    if _verify_digests and "digest" in entry_info:
+        _verify_digest(cache_path, entry_info)
+    artifact = _read_artifact(cache_path, entry_info, default_serializer)
+    if isinstance(artifact, CacheRelativeArtifact):
+        artifact.cache_dir = get_cache_dir(cache_path)
+    record_read(time.perf_counter() - start, entry_info.get("size", 0))
+    return artifact
+
+def _read_artifact(cache_path: str, entry_info: Dict[str, Any], default_serializer: str) -> Any:
+    if "segment" in entry_info:
+        return _read_packed_artifact(cache_path, entry_info)
+    if "size" in entry_info and os.path.getsize(cache_path) != entry_info["size"]:
+        raise CorruptArtifactError(f"{cache_path} is {os.path.getsize(cache_path)} bytes, but {entry_info['size']} bytes were written.")
+    serializer = get_serializer(entry_info.get("serializer", default_serializer))
+    codec = entry_info.get("codec")
+    if codec is None:
+        return serializer.load(cache_path)
+    with open(cache_path, 'rb') as raw, open_compressed_reader(raw, codec) as f:
+        return serializer.load_stream(f)
+
+def get_artifact_version(cache_path: str) -> Tuple[Any, int]:
+    """Get an identifier that changes whenever the artifact at cache_path is rewritten, and the artifact's size on disk."""
+    entry_info = read_entry_info(cache_path)
+    if "segment" in entry_info:
+        # packed artifacts are never rewritten in place; a new write appends them elsewhere.
+        return (entry_info["segment"], entry_info["offset"]), entry_info["size"]
+    stat = os.stat(cache_path)
+    # the inode changes when an artifact is rewritten as a link to the blob of an older, identical artifact.
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size), stat.st_size
+
+def load_cached_artifact(cache_path: str, default_serializer: str = DEFAULT_SERIALIZER) -> Any:
+    """Load an artifact through the process-wide artifact cache.
+
+    Raises:
+        MissingArtifactError: If the artifact's file is missing or corrupt. The artifact is then no longer cached,
+            so the step that produced it runs again the next time it is looked up.
+    """
+    try:
+        return artifact_cache.load(cache_path, partial(read_artifact, default_serializer=default_serializer),
+                                   get_artifact_version(cache_path))
+    except (FileNotFoundError, CorruptArtifactError) as e:
+        get_index_for_path(cache_path).remove(cache_path)
+        artifact_cache.invalidate(cache_path)
+        raise MissingArtifactError(cache_path) from e
+
+def artifact_exists(cache_path: str, refresh: bool = True) -> bool:
+    """Whether an artifact is cached, according to the cache index rather than the file system.
+
+    Args:
+        cache_path (str): Path of the artifact.
+        refresh (bool): Re-read the index if the artifact is not in it, in case another process has just written it.
+    """
+    if result_registry.is_registered(cache_path):
+        return True
+    return get_index_for_path(cache_path).get(cache_path, refresh_on_miss=refresh) is not None
+
+def get_artifact_digest(cache_path: str) -> str:
+    """Get the SHA-256 digest of the serialized bytes of a cached artifact.
+
+    The digest is recorded next to the artifact when it is cached. Artifacts cached before
+    digests were recorded are hashed the first time their digest is needed (and every time
+    in a read_only_index block, which does not record it).
+    """
+    pending_digest = result_registry.get_digest(cache_path)
+    if pending_digest is not None:
+        return pending_digest
+    entry_info = read_entry_info(cache_path)
+    if "digest" not in entry_info:
+        sha = hashlib.sha256()
+        with open(cache_path, 'rb') as f:
+            for chunk in iter(partial(f.read, 1 << 20), b''):
+                sha.update(chunk)
+        entry_info = {
+            "serializer": DEFAULT_SERIALIZER,
+            "codec": None,
+            "size": os.path.getsize(cache_path),
+            **entry_info,
+            "digest": sha.hexdigest()
+        }
+        if not is_read_only():
+            get_index_for_path(cache_path).add(cache_path, entry_info)
+    return entry_info["digest"]
@@ -0,0 +1,52 @@
+import os
+import dill
+import pytest
+from flowmason.artifact_cache import ArtifactCache
+
+@pytest.fixture
+def artifact_paths(tmp_path):
+    paths = []
+    for i in range(3):
+        path = os.path.join(tmp_path, f"artifact_{i}")
+        with open(path, 'wb') as f:
+            dill.dump(str(i) * 1000, f)
+        paths.append(path)
+    return paths
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return dill.load(f)
+
+def test_hits_and_misses(artifact_paths):
+    cache = ArtifactCache(max_bytes=10 ** 6)
+    first = cache.load(artifact_paths[0], _load)
+    second = cache.load(artifact_paths[0], _load)
+    assert first is second
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_lru_eviction_within_budget(artifact_paths):
+    sizes = [os.path.getsize(path) for path in artifact_paths]
+    cache = ArtifactCache(max_bytes=sizes[0] + sizes[1])
+    cache.load(artifact_paths[0], _load)
+    cache.load(artifact_paths[1], _load)
+    cache.load(artifact_paths[0], _load) # artifact_1 is now the least recently used
+    cache.load(artifact_paths[2], _load)
+    assert cache.current_bytes <= cache.max_bytes
+    cache.load(artifact_paths[0], _load)
+    assert cache.stats()["hits"] == 2
+    cache.load(artifact_paths[1], _load)
+    assert cache.stats()["misses"] == 4
+
+def test_modified_file_is_reloaded(artifact_paths):
+    cache = ArtifactCache(max_bytes=10 ** 6)
+    cache.load(artifact_paths[0], _load)
+    with open(artifact_paths[0], 'wb') as f:
+        dill.dump("changed", f)
+    assert cache.load(artifact_paths[0], _load) == "changed"
+    assert cache.stats()["misses"] == 2
+
+def test_disabled_by_default(artifact_paths):
+    cache = ArtifactCache()
+    assert cache.load(artifact_paths[0], _load) is not cache.load(artifact_paths[0], _load)
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "run_benchmarks.py")
+
+def test_quick_benchmarks(tmp_path):
+    output_path = tmp_path / "results.json"
+    subprocess.run([sys.executable, BENCHMARKS_SCRIPT, "--quick", "--output", str(output_path)], check=True, cwd=tmp_path)
+    with open(output_path, 'r') as f:
+        report = json.load(f)
+    names = {result["name"] for result in report["results"]}
+    assert {"map_reduce.cold", "map_reduce.warm", "map_reduce.plan", "dag.plan", "step_wrapper", "cache.write",
+            "cache.read"} <= names
+    assert all(result["seconds"] >= 0 for result in report["results"])
+    # the benchmarks run in a temporary directory.
+    assert sorted(os.listdir(tmp_path)) == ["results.json"]
+
+    compared = subprocess.run([sys.executable, BENCHMARKS_SCRIPT, "--quick", "--output", str(tmp_path / "again.json"),
+                               "--compare", str(output_path)], check=True, cwd=tmp_path, capture_output=True, text=True)
+    assert "x)" in compared.stdout and ": new" not in compared.stdout
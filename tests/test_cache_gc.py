@@ -0,0 +1,101 @@
+import time
+import pytest
+import os
+from collections import OrderedDict
+from flowmason.dag import conduct, SingletonStep, MapReduceStep
+from flowmason.cache_gc import collect_garbage, get_live_cache_paths
+from flowmason.cache_index import get_cache_index
+
+def _step_add(step_name, version, arg1: float):
+    return "x" * 1000 + str(arg1)
+
+def _run(cache_dir, version, arg1=1.0):
+    steps = OrderedDict()
+    steps["step_add"] = SingletonStep(_step_add, {"version": version, "arg1": arg1})
+    return conduct(cache_dir, steps, "test_gc")
+
+def test_evicts_unreferenced_artifacts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = "cache"
+    live_path = _run(cache_dir, "001")[0][1]["cache_path"]
+    superseded_path = _run(cache_dir, "002")[0][1]["cache_path"]
+    # the first run still refers to version 001.
+    report = collect_garbage(cache_dir, grace_period=0)
+    assert report.evicted == []
+    report = collect_garbage(cache_dir, keep_runs=1, dry_run=True, grace_period=0)
+    assert [artifact.cache_path for artifact in report.evicted] == [live_path]
+    assert os.path.exists(live_path)
+    report = collect_garbage(cache_dir, keep_runs=1, grace_period=0)
+    assert [artifact.reason for artifact in report.evicted] == ["unreferenced"]
+    assert not os.path.exists(live_path)
+    assert not get_cache_index(cache_dir).has(live_path)
+    assert os.path.exists(superseded_path)
+
+def test_evicts_least_recently_used_down_to_budget(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = "cache"
+    paths = [_run(cache_dir, "001", arg1)[0][1]["cache_path"] for arg1 in range(3)]
+    run_files = sorted(f for f in os.listdir("outputs/test_gc") if f.startswith("run_"))
+    now = time.time()
+    for i, run_file in enumerate(run_files):
+        os.utime(os.path.join("outputs/test_gc", run_file), (now + 10 + i, now + 10 + i))
+    # the first run is used again most recently.
+    os.utime(os.path.join("outputs/test_gc", run_files[0]), (now + 20, now + 20))
+    live = get_live_cache_paths()
+    assert live[os.path.abspath(paths[0])] == (pytest.approx(now + 20), True)
+    size = os.path.getsize(paths[0])
+    report = collect_garbage(cache_dir, max_bytes=size, grace_period=0)
+    assert [artifact.cache_path for artifact in report.evicted] == [paths[1], paths[2]]
+    assert all(artifact.reason == "over budget" for artifact in report.evicted)
+    assert report.remaining_bytes == size
+
+def test_grace_period_protects_new_artifacts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = "cache"
+    _run(cache_dir, "001")
+    report = collect_garbage(cache_dir, max_bytes=0)
+    assert report.evicted == []
+
+def test_removes_segments_without_live_artifacts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = "cache"
+    steps = OrderedDict()
+    steps["step_add"] = SingletonStep(_step_add, {"version": "001", "arg1": 1.0, "pack": True})
+    conduct(cache_dir, steps, "test_gc")
+    assert len(os.listdir("cache/segments")) == 1
+    report = collect_garbage(cache_dir, max_bytes=0, grace_period=0)
+    assert len(report.evicted) == 1
+    assert os.listdir("cache/segments") == []
+
+def test_identical_artifacts_are_counted_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = "cache"
+    # _step_add returns the same result for versions 001 and 002.
+    paths = [_run(cache_dir, version)[0][1]["cache_path"] for version in ("001", "002")]
+    assert os.path.samefile(paths[0], paths[1])
+    size = os.path.getsize(paths[0])
+    report = collect_garbage(cache_dir, max_bytes=size, grace_period=0)
+    assert report.total_bytes == size and report.evicted == []
+    report = collect_garbage(cache_dir, keep_runs=1, grace_period=0)
+    assert [(artifact.cache_path, artifact.size) for artifact in report.evicted] == [(paths[0], 0)]
+    blob_path = os.path.join(cache_dir, get_cache_index(cache_dir).get(paths[1])["blob"])
+    assert os.path.exists(blob_path)
+    report = collect_garbage(cache_dir, max_bytes=0, grace_period=0)
+    assert [(artifact.cache_path, artifact.size) for artifact in report.evicted] == [(paths[1], size)]
+    assert not os.path.exists(blob_path)
+
+def test_keeps_the_map_items_of_cached_map_reduce_steps(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    def make_steps(arg1s):
+        steps = OrderedDict()
+        map_steps = OrderedDict()
+        map_steps["step_add"] = SingletonStep(_step_add, {"version": "001"})
+        steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": arg1s}, {"version": "001"}, len)
+        return steps
+    conduct("cache", make_steps([1.0, 2.0, 3.0]), "test_gc")
+    metadata = conduct("cache", make_steps([1.0, 2.0, 3.0]), "test_gc")
+    assert metadata[0][1]["execution_status"] == "cached"
+    assert collect_garbage("cache", keep_runs=1, grace_period=0).evicted == []
+    metadata = conduct("cache", make_steps([1.0, 2.0, 3.0, 4.0]), "test_gc")
+    assert sorted(map_metadata["execution_status"] for _, map_metadata in metadata[0][1][:-1]) == [
+        "cached", "cached", "cached", "executed"]
@@ -0,0 +1,68 @@
+import os
+import dill
+from flowmason.cache_index import CacheIndex, INDEX_FILENAME
+
+def test_imports_existing_artifacts_once(tmp_path):
+    cache_dir = str(tmp_path)
+    with open(os.path.join(cache_dir, "legacy_artifact"), 'wb') as f:
+        dill.dump(3.1, f)
+    index = CacheIndex(cache_dir)
+    index.refresh()
+    entry = index.get(os.path.join(cache_dir, "legacy_artifact"))
+    assert entry["serializer"] == "dill"
+    assert entry["size"] == os.path.getsize(os.path.join(cache_dir, "legacy_artifact"))
+    # files added behind the index's back are not picked up by re-scanning.
+    with open(os.path.join(cache_dir, "other_artifact"), 'wb') as f:
+        dill.dump(3.2, f)
+    index.refresh()
+    assert not index.has(os.path.join(cache_dir, "other_artifact"))
+
+def test_follows_appends_from_other_processes(tmp_path):
+    cache_dir = str(tmp_path)
+    reader = CacheIndex(cache_dir)
+    reader.refresh()
+    writer = CacheIndex(cache_dir)
+    writer.add(os.path.join(cache_dir, "artifact"), {"size": 10, "digest": "abc"})
+    assert not reader.has(os.path.join(cache_dir, "artifact"))
+    assert reader.get(os.path.join(cache_dir, "artifact"))["digest"] == "abc"
+    writer.remove(os.path.join(cache_dir, "artifact"))
+    reader.refresh()
+    assert reader.get(os.path.join(cache_dir, "artifact"), refresh_on_miss=False) is None
+
+def test_ignores_partially_written_line(tmp_path):
+    cache_dir = str(tmp_path)
+    index = CacheIndex(cache_dir)
+    index.add(os.path.join(cache_dir, "artifact"), {"size": 10})
+    with open(os.path.join(cache_dir, INDEX_FILENAME), 'ab') as f:
+        f.write(b'{"path": "half_writ')
+    reader = CacheIndex(cache_dir)
+    reader.refresh()
+    assert [os.path.basename(path) for path, _ in reader.entries()] == ["artifact"]
+
+def test_reloads_when_index_is_removed(tmp_path):
+    cache_dir = str(tmp_path)
+    index = CacheIndex(cache_dir)
+    index.add(os.path.join(cache_dir, "artifact"), {"size": 10})
+    os.remove(os.path.join(cache_dir, INDEX_FILENAME))
+    index.refresh()
+    assert not index.has(os.path.join(cache_dir, "artifact"))
+
+def test_compact_keeps_one_line_per_artifact(tmp_path):
+    cache_dir = str(tmp_path)
+    index = CacheIndex(cache_dir)
+    index.refresh()
+    other = CacheIndex(cache_dir)
+    other.refresh()
+    for i in range(3):
+        index.add(os.path.join(cache_dir, "artifact"), {"size": i})
+    index.add(os.path.join(cache_dir, "evicted"), {"size": 10})
+    index.remove(os.path.join(cache_dir, "evicted"))
+    index.compact()
+    with open(os.path.join(cache_dir, INDEX_FILENAME), 'r') as f:
+        assert len(f.readlines()) == 1
+    assert index.get(os.path.join(cache_dir, "artifact"))["size"] == 2
+    # other processes reload the compacted log, and keep following it.
+    other.refresh()
+    assert [(os.path.basename(path), entry["size"]) for path, entry in other.entries()] == [("artifact", 2)]
+    index.add(os.path.join(cache_dir, "new_artifact"), {"size": 5})
+    assert other.get(os.path.join(cache_dir, "new_artifact"))["size"] == 5
@@ -0,0 +1,106 @@
+import os
+import shutil
+from collections import OrderedDict
+import pytest
+from flowmason import ChunkedArtifact, load_artifact
+from flowmason.cache_gc import collect_garbage
+from flowmason.cache_index import get_cache_index
+from flowmason.chunks import count_cached_chunks
+from flowmason.dag import conduct, SingletonStep
+from flowmason.storage import artifact_exists, load_cached_artifact
+
+NUM_CHUNKS = 5
+yielded = []
+# the chunk at which _step_count_from is interrupted, if any.
+interrupt_at = []
+
+def _step_count(step_name, version, num_chunks: int):
+    for i in range(num_chunks):
+        yielded.append(i)
+        yield [i] * 100
+
+def _step_count_from(step_name, version, num_chunks: int, start_chunk=0):
+    for i in range(start_chunk, num_chunks):
+        if i in interrupt_at:
+            raise RuntimeError("interrupted")
+        yielded.append(i)
+        yield [i] * 100
+
+def _step_sum(step_name, version, chunks):
+    assert isinstance(chunks, ChunkedArtifact) and len(chunks) == NUM_CHUNKS
+    return sum(chunk[0] for chunk in chunks)
+
+def _make_steps(step_fn=_step_count, **step_kwargs):
+    steps = OrderedDict()
+    steps["step_count"] = SingletonStep(step_fn, {"version": "001", "num_chunks": NUM_CHUNKS, **step_kwargs})
+    steps["step_sum"] = SingletonStep(_step_sum, {"version": "001", "chunks": "step_count"})
+    return steps
+
+@pytest.fixture(autouse=True)
+def _clear_yielded():
+    yielded.clear()
+    interrupt_at.clear()
+
+def test_chunks_stream_to_downstream_steps(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_chunks", write_behind=True)
+    assert load_cached_artifact(metadata[1][1]["cache_path"]) == sum(range(NUM_CHUNKS))
+    chunks = load_artifact(metadata[0])
+    assert isinstance(chunks, ChunkedArtifact)
+    # the chunks are loaded one at a time, as they are iterated over.
+    chunk_iter = iter(chunks)
+    assert next(chunk_iter) == [0] * 100
+    assert list(chunk_iter) == [[i] * 100 for i in range(1, NUM_CHUNKS)]
+    assert chunks.load_chunk(3) == [3] * 100
+
+    metadata = conduct("cache", _make_steps(), "test_chunks")
+    assert [step_metadata["execution_status"] for _, step_metadata in metadata] == ["cached", "cached"]
+    assert yielded == list(range(NUM_CHUNKS))
+
+def test_resumes_from_the_first_missing_chunk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    interrupt_at.append(3)
+    with pytest.raises(RuntimeError):
+        conduct("cache", _make_steps(_step_count_from), "test_chunks")
+    assert yielded == [0, 1, 2]
+
+    yielded.clear()
+    interrupt_at.clear()
+    metadata = conduct("cache", _make_steps(_step_count_from), "test_chunks")
+    assert yielded == [3, 4]
+    assert count_cached_chunks(metadata[0][1]["cache_path"]) == NUM_CHUNKS
+    assert load_cached_artifact(metadata[1][1]["cache_path"]) == sum(range(NUM_CHUNKS))
+
+def test_generators_without_start_chunk_skip_cached_chunks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_chunks")
+    cache_path = metadata[0][1]["cache_path"]
+    chunk_paths = load_artifact(metadata[0]).chunk_paths
+    chunk_mtimes = [os.path.getmtime(chunk_path) for chunk_path in chunk_paths]
+    # as if the run had been interrupted before the step's result was cached.
+    os.remove(cache_path)
+    get_cache_index("cache").remove(cache_path)
+    metadata = conduct("cache", _make_steps(), "test_chunks")
+    assert metadata[0][1]["execution_status"] == "executed"
+    assert [os.path.getmtime(chunk_path) for chunk_path in chunk_paths] == chunk_mtimes
+    assert load_cached_artifact(metadata[1][1]["cache_path"]) == sum(range(NUM_CHUNKS))
+
+def test_chunks_are_collected_with_their_artifact(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_chunks")
+    chunk_paths = load_artifact(metadata[0]).chunk_paths
+    assert collect_garbage("cache", grace_period=0).evicted == []
+    assert all(artifact_exists(chunk_path) for chunk_path in chunk_paths)
+    conduct("cache", _make_steps(num_chunks=NUM_CHUNKS + 1), "test_chunks", targets=["step_count"])
+    report = collect_garbage("cache", keep_runs=1, grace_period=0)
+    assert {metadata[0][1]["cache_path"], *chunk_paths} <= {artifact.cache_path for artifact in report.evicted}
+    assert not any(artifact_exists(chunk_path) for chunk_path in chunk_paths)
+
+def test_chunks_load_after_the_cache_directory_is_moved(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_chunks")
+    cache_path = metadata[0][1]["cache_path"]
+    shutil.move("cache", "moved/cache")
+    monkeypatch.chdir(tmp_path / "moved")
+    chunks = load_cached_artifact(cache_path)
+    assert [chunk[0] for chunk in chunks] == list(range(NUM_CHUNKS))
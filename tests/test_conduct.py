@@ -1,13 +1,22 @@
+import asyncio
 import math
+import time
 import dill
 import json
 import pdb
 import shutil
+import threading
 import ipdb
 import os
 import pytest
+import numpy as np
 from collections import OrderedDict
-from flowmason.dag import conduct, MapReduceStep, SingletonStep
+from flowmason import dag
+from flowmason.dag import conduct, MapReduceStep, SingletonStep, get_map_items_to_execute, get_singleton_map_reduce_cache_name
+from flowmason.artifact_cache import artifact_cache
+from flowmason.inspector import load_artifact, load_latest_steps
+from flowmason.run_store import get_run_store
+from flowmason.storage import load_cached_artifact
 
 def _step_toy_fn(step_name, version, 
                  arg1: float):
@@ -207,3 +216,520 @@ def test_map_reduce_should_execute_updated_singletons(cache_dir):
         # TODO: need to fix this
         assert obj[0][1][first_step_index][1]['execution_status'] == "cached"
         assert obj[0][1][second_step_index][1]['execution_status'] == "executed"
+
+def _step_sleepy_toy_fn(step_name, version,
+                        arg1: float, sleep_seconds_ignore: float):
+    time.sleep(sleep_seconds_ignore)
+    return 3.1 + arg1
+
+def _make_fan_out_steps():
+    step_dict = OrderedDict()
+    step_dict['step_singleton'] = SingletonStep(_step_toy_fn, {
+        'version': "001", 
+        'arg1': 2.9
+    })
+    for i in range(3):
+        step_dict[f'step_fan_out_{i}'] = SingletonStep(_step_sleepy_toy_fn, {
+            'version': "001", 
+            'arg1': 'step_singleton',
+            'sleep_seconds_ignore': 0.5
+        })
+    return step_dict
+
+def _max_concurrent(steps_metadata):
+    """The most steps that were running at the same moment, according to the start and wall time in their profiles."""
+    events = []
+    for step_metadata in steps_metadata:
+        profile = step_metadata['profile']
+        events += [(profile['start'], 1), (profile['start'] + profile['wall_time'], -1)]
+    running = max_running = 0
+    # at equal times, ends are counted before starts.
+    for _, change in sorted(events):
+        running += change
+        max_running = max(max_running, running)
+    return max_running
+
+def _strip_times(run_metadata):
+    for _, metadata in run_metadata:
+        metadata.pop('start_time')
+        metadata.pop('end_time')
+        metadata.pop('profile')
+    return run_metadata
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_conduct_matches_sequential(cache_dir, executor):
+    sequential_metadata = conduct(cache_dir, _make_fan_out_steps(), "test_orchestration")
+    shutil.rmtree(cache_dir)
+    parallel_metadata = conduct(cache_dir, _make_fan_out_steps(), "test_orchestration", 
+                                max_workers=3, executor=executor)
+    # the fan-out steps (which sleep for 0.5 seconds each) ran at the same time.
+    assert _max_concurrent([metadata for _, metadata in parallel_metadata[1:]]) > 1
+    assert json.loads(json.dumps(_strip_times(parallel_metadata))) == json.loads(json.dumps(_strip_times(sequential_metadata)))
+    with open("outputs/test_orchestration/run_0001.json", 'r') as f:
+        obj = json.load(f)
+        assert [step[0] for step in obj] == list(_make_fan_out_steps().keys())
+        for step in obj[1:]:
+            assert step[1]['execution_status'] == "executed"
+            assert dill.load(open(step[1]['cache_path'], 'rb')) == 3.1 + 2.9 + 3.1
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_map_reduce_matches_sequential(cache_dir, executor):
+    def make_step_dict(max_workers):
+        map_reduce_dict = OrderedDict()
+        map_reduce_dict['step_toy_fn'] = SingletonStep(_step_toy_fn, {
+            'version': '001'
+        })
+        map_reduce_dict['step_toy_fn_two'] = SingletonStep(_step_toy_fn, {
+            'version': '001',
+            'arg1': 'step_toy_fn'
+        })
+        step_dict = OrderedDict()
+        step_dict['step_map_reduce'] = MapReduceStep(
+            map_reduce_dict,
+            {"arg1": [2.9, 3.0, 3.1, 3.2, 3.3]}, 
+            {"version": "001"},
+            sum, max_workers=max_workers, executor=executor)
+        return step_dict
+    sequential_metadata = conduct(cache_dir, make_step_dict(1), "test_orchestration")
+    shutil.rmtree(cache_dir)
+    parallel_metadata = conduct(cache_dir, make_step_dict(3), "test_orchestration")
+    sequential_steps = sequential_metadata[0][1]
+    parallel_steps = parallel_metadata[0][1]
+    assert [(name, metadata['cache_path']) for name, metadata in parallel_steps[:-1]] == \
+        [(name, metadata['cache_path']) for name, metadata in sequential_steps[:-1]]
+    assert parallel_steps[-1]['cache_path'] == sequential_steps[-1]['cache_path']
+    assert abs(dill.load(open(parallel_steps[-1]['cache_path'], 'rb')) - sum([(3.1 + x) + 3.1 for x in [2.9, 3.0, 3.1, 3.2, 3.3]])) < 1e-6
+
+def test_map_reduce_workers_default_to_threads(cache_dir):
+    # locally defined step functions cannot be pickled for worker processes.
+    def step_local(step_name, version, arg1: float):
+        return arg1 * 2
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(OrderedDict([("step_local", SingletonStep(step_local, {'version': "001"}))]),
+                                                 {"arg1": [1.0, 2.0, 3.0]}, {"version": "001"}, sum, max_workers=2)
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert load_cached_artifact(metadata[0][1][-1]['cache_path']) == 12.0
+
+def _concat(left, right):
+    return left + right
+
+@pytest.mark.parametrize("reduce_mode", ["fold", "tree"])
+def test_associative_reduce_modes(cache_dir, reduce_mode):
+    map_reduce_dict = OrderedDict()
+    map_reduce_dict['step_listify'] = SingletonStep(_step_listify_fn, {
+        'version': '001'
+    })
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(
+        map_reduce_dict,
+        {"arg1": list(range(7))}, 
+        {"version": "001"},
+        _concat, reduce_mode=reduce_mode)
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    # the reduce function is not commutative, so this also checks that the order of the map results is preserved.
+    assert dill.load(open(metadata[0][1][-1]['cache_path'], 'rb')) == list(range(7))
+
+def _step_listify_fn(step_name, version, arg1):
+    return [arg1]
+
+def test_singleton_map_reduce_cache_name_is_deprecated():
+    with pytest.warns(DeprecationWarning):
+        cache_name = get_singleton_map_reduce_cache_name("step_map_reduce", "arg1=2.9", "step_toy_fn", "001",
+                                                         {"version": "001"}, {"arg1": 2.9})
+    assert "step_map_reduce_step_toy_fn_arg1=2.9" in cache_name
+
+def test_map_reduce_cache_keyed_by_map_item(cache_dir):
+    def make_map_reduce_step(arg1_values):
+        return MapReduceStep(
+            OrderedDict([
+                ("step_toy_fn", SingletonStep(_step_toy_fn, {
+                    'version': '001'
+                })), 
+                ("step_toy_fn_two", SingletonStep(_step_toy_fn, {
+                    'version': '001',
+                    'arg1': 'step_toy_fn'
+                }))
+            ]),
+            {"arg1": arg1_values}, 
+            {"version": "001"}, 
+            sum)
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = make_map_reduce_step([2.9, 3.0])
+    conduct(cache_dir, step_dict, "test_orchestration")
+
+    # insert a new item in the middle; only its chain (and the reduce) should be executed.
+    map_reduce_step = make_map_reduce_step([2.9, 2.8, 3.0])
+    assert get_map_items_to_execute('step_map_reduce', map_reduce_step, {}, cache_dir) == [{"arg1": 2.8}]
+    step_dict['step_map_reduce'] = map_reduce_step
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    statuses = [step_metadata['execution_status'] for _, step_metadata in metadata[0][1][:-1]]
+    assert statuses == ["cached", "cached", "executed", "executed", "cached", "cached"]
+    assert abs(dill.load(open(metadata[0][1][-1]['cache_path'], 'rb')) - sum([(3.1 + x) + 3.1 for x in [2.9, 2.8, 3.0]])) < 1e-6
+
+def _step_round_fn(step_name, version, arg1: float):
+    return round(arg1)
+
+def test_early_cutoff_on_identical_upstream_result(cache_dir):
+    # bumping the version of the upstream step re-executes it, but it produces the same bytes,
+    # so the downstream step should still be cached.
+    def make_step_dict(upstream_version):
+        step_dict = OrderedDict()
+        step_dict['step_round'] = SingletonStep(_step_round_fn, {
+            'version': upstream_version, 
+            'arg1': 2.9
+        })
+        step_dict['step_singleton_two'] = SingletonStep(_step_toy_fn, {
+            'version': "001", 
+            'arg1': 'step_round'
+        })
+        return step_dict
+    conduct(cache_dir, make_step_dict("001"), "test_orchestration")
+    metadata = conduct(cache_dir, make_step_dict("002"), "test_orchestration")
+    assert metadata[0][1]['execution_status'] == "executed"
+    assert metadata[1][1]['execution_status'] == "cached"
+    assert dill.load(open(metadata[1][1]['cache_path'], 'rb')) == 3 + 3.1
+
+def test_downstream_executes_on_changed_upstream_result(cache_dir):
+    step_dict = OrderedDict()
+    step_dict['step_singleton'] = SingletonStep(_step_toy_fn, {
+        'version': "001", 
+        'arg1': 2.9
+    })
+    step_dict['step_singleton_two'] = SingletonStep(_step_toy_fn, {
+        'version': "001", 
+        'arg1': 'step_singleton'
+    })
+    conduct(cache_dir, step_dict, "test_orchestration")
+    step_dict['step_singleton'].step_params['arg1'] = 3.9
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert metadata[0][1]['execution_status'] == "executed"
+    assert metadata[1][1]['execution_status'] == "executed"
+    assert dill.load(open(metadata[1][1]['cache_path'], 'rb')) == 3.1 + 3.9 + 3.1
+
+def _step_sum_fn(step_name, version, arg1: float, arg2: float):
+    return arg1 + arg2
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_missing_artifact_is_recomputed(cache_dir, max_workers):
+    def make_step_dict(downstream_version):
+        step_dict = OrderedDict()
+        step_dict['step_singleton'] = SingletonStep(_step_toy_fn, {
+            'version': "001", 
+            'arg1': 2.9
+        })
+        # runs before the missing artifact is found, in the first attempt.
+        step_dict['step_independent'] = SingletonStep(_step_toy_fn, {
+            'version': downstream_version, 
+            'arg1': 1.0
+        })
+        step_dict['step_singleton_two'] = SingletonStep(_step_sum_fn, {
+            'version': downstream_version, 
+            'arg1': 'step_singleton',
+            'arg2': 'step_independent'
+        })
+        return step_dict
+    metadata = conduct(cache_dir, make_step_dict("001"), "test_orchestration")
+    # deleted outside of collect_garbage, so the index still lists it.
+    os.remove(metadata[0][1]['cache_path'])
+    metadata = conduct(cache_dir, make_step_dict("002"), "test_orchestration", max_workers=max_workers)
+    assert metadata[0][1]['execution_status'] == "executed"
+    # executed by the first attempt, so recorded as executed although the second attempt found it cached.
+    assert metadata[1][1]['execution_status'] == "executed"
+    assert load_artifact(metadata[2]) == 2.9 + 3.1 + 1.0 + 3.1
+    run_steps = get_run_store("test_orchestration").latest_run()["steps"]
+    assert [run_steps[step_name]["execution_status"] for step_name in run_steps] == ["executed"] * 3
+
+_loaded_ids = []
+
+def _step_make_list_fn(step_name, version, arg1: float):
+    return [arg1]
+
+def _step_record_id_fn(step_name, version, arg1: list):
+    _loaded_ids.append(id(arg1))
+    return arg1 + [3.1]
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_write_behind_hands_off_live_results(cache_dir, max_workers):
+    _loaded_ids.clear()
+    step_dict = OrderedDict()
+    step_dict['step_make_list'] = SingletonStep(_step_make_list_fn, {
+        'version': "001", 
+        'arg1': 2.9
+    })
+    step_dict['step_consumer_one'] = SingletonStep(_step_record_id_fn, {
+        'version': "001", 
+        'arg1': 'step_make_list'
+    })
+    step_dict['step_consumer_two'] = SingletonStep(_step_record_id_fn, {
+        'version': "002", 
+        'arg1': 'step_make_list'
+    })
+    metadata = conduct(cache_dir, step_dict, "test_orchestration", max_workers=max_workers, write_behind=True)
+    # both consumers got the same in-memory object instead of loading it from the cache.
+    assert len(set(_loaded_ids)) == 1
+    # everything is on disk once conduct returns.
+    for _, step_metadata in metadata:
+        assert os.path.exists(step_metadata['cache_path'])
+    assert dill.load(open(metadata[2][1]['cache_path'], 'rb')) == [2.9, 3.1]
+    metadata = conduct(cache_dir, step_dict, "test_orchestration", write_behind=True)
+    assert [step_metadata['execution_status'] for _, step_metadata in metadata] == ["cached"] * 3
+
+_consumer_started = threading.Event()
+_upstream_written = threading.Event()
+
+def _step_consumer_fn(step_name, version, arg1: list):
+    _consumer_started.set()
+    return _upstream_written.is_set()
+
+def test_write_behind_overlaps_writes_with_downstream_steps(cache_dir, monkeypatch):
+    _consumer_started.clear()
+    _upstream_written.clear()
+    write_serialized_artifact = dag.write_serialized_artifact
+    def slow_write(cache_path, *args, **kwargs):
+        # the upstream write only finishes once the consumer has started, or gives up after a while.
+        _consumer_started.wait(timeout=10)
+        digest = write_serialized_artifact(cache_path, *args, **kwargs)
+        _upstream_written.set()
+        return digest
+    monkeypatch.setattr(dag, "write_serialized_artifact", slow_write)
+    step_dict = OrderedDict()
+    step_dict['step_make_list'] = SingletonStep(_step_make_list_fn, {
+        'version': "001", 
+        'arg1': 2.9
+    })
+    step_dict['step_consumer'] = SingletonStep(_step_consumer_fn, {
+        'version': "001", 
+        'arg1': 'step_make_list'
+    })
+    metadata = conduct(cache_dir, step_dict, "test_orchestration", write_behind=True)
+    # the consumer started (with its cache name computed from the upstream digest) before the upstream write finished.
+    assert load_artifact(metadata[1]) is False
+
+def test_artifact_cache_shared_by_consumers(cache_dir):
+    step_dict = _make_fan_out_steps()
+    for step in list(step_dict.values())[1:]:
+        step.step_params['sleep_seconds_ignore'] = 0.0
+    artifact_cache.clear()
+    artifact_cache.configure(10 ** 6)
+    try:
+        conduct(cache_dir, step_dict, "test_orchestration")
+        # the three fan-out steps load the result of step_singleton once from disk.
+        assert artifact_cache.stats()["misses"] == 1
+        assert artifact_cache.stats()["hits"] == 2
+        metadata = load_latest_steps("test_orchestration")
+        assert load_artifact(metadata[1]) == 3.1 + 2.9 + 3.1
+        assert load_artifact(metadata[1]) == 3.1 + 2.9 + 3.1
+        assert artifact_cache.stats()["hits"] == 3
+    finally:
+        artifact_cache.configure(0)
+        artifact_cache.clear()
+
+def _step_embeddings_fn(step_name, version, num_rows: int):
+    return np.arange(num_rows * 4, dtype=np.float64).reshape(num_rows, 4)
+
+def _step_row_sums_fn(step_name, version, embeddings):
+    return embeddings.sum(axis=1)
+
+@pytest.mark.parametrize("serializer", ["pickle5", "npy"])
+def test_step_serializer_param(cache_dir, serializer):
+    step_dict = OrderedDict()
+    step_dict['step_embeddings'] = SingletonStep(_step_embeddings_fn, {
+        'version': "001", 
+        'num_rows': 3,
+        'serializer': serializer
+    })
+    step_dict['step_row_sums'] = SingletonStep(_step_row_sums_fn, {
+        'version': "001", 
+        'embeddings': 'step_embeddings'
+    })
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert metadata[0][1]['serializer'] == serializer
+    assert metadata[1][1]['serializer'] == "dill"
+    np.testing.assert_array_equal(load_artifact(metadata[0]), _step_embeddings_fn(None, None, 3))
+    np.testing.assert_array_equal(load_artifact(metadata[1]), [6.0, 22.0, 38.0])
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert [step_metadata['execution_status'] for _, step_metadata in metadata] == ["cached", "cached"]
+
+def test_step_codec_param(cache_dir):
+    step_dict = OrderedDict()
+    step_dict['step_singleton'] = SingletonStep(_step_toy_fn, {
+        'version': "001", 
+        'arg1': 2.9,
+        'codec': 'lzma:9'
+    })
+    step_dict['step_singleton_two'] = SingletonStep(_step_toy_fn, {
+        'version': "001", 
+        'arg1': 'step_singleton'
+    })
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert load_artifact(metadata[0]) == 3.1 + 2.9
+    assert load_artifact(metadata[1]) == 3.1 + 2.9 + 3.1
+    # changing the codec does not invalidate the cache entry.
+    step_dict['step_singleton'].step_params.pop('codec')
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert [step_metadata['execution_status'] for _, step_metadata in metadata] == ["cached", "cached"]
+
+def test_packed_map_reduce(cache_dir):
+    map_reduce_dict = OrderedDict()
+    map_reduce_dict['step_toy_fn'] = SingletonStep(_step_toy_fn, {
+        'version': '001'
+    })
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(
+        map_reduce_dict,
+        {"arg1": [float(x) for x in range(50)]}, 
+        {"version": "001", "pack": True},
+        sum)
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    # the map results and the reduce result are appended to one segment instead of getting a file each.
+    assert sorted(os.listdir(cache_dir)) == ["index.jsonl", "segments"]
+    assert load_artifact(metadata[0][1][3]) == 3.1 + 3.0
+    assert abs(load_artifact(("step_map_reduce", metadata[0][1][-1])) - sum(3.1 + x for x in range(50))) < 1e-6
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert metadata[0][1]['execution_status'] == "cached"
+
+_batch_calls = []
+
+def _step_batched_scale_fn(step_name, version, arg1, factor):
+    _batch_calls.append(list(step_name))
+    return list(np.asarray(arg1) * factor)
+
+def _make_batched_steps(map_values, batch_size, batched=True):
+    map_reduce_dict = OrderedDict()
+    map_reduce_dict['step_toy_fn'] = SingletonStep(_step_toy_fn, {
+        'version': '001'
+    })
+    map_reduce_dict['step_scale'] = SingletonStep(_step_batched_scale_fn, {
+        'version': '001',
+        'arg1': 'step_toy_fn',
+        'factor': 2.0
+    }, batched=batched)
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(
+        map_reduce_dict,
+        {"arg1": map_values}, 
+        {"version": "001"},
+        sum, batch_size=batch_size)
+    return step_dict
+
+def test_batched_map_steps(cache_dir):
+    _batch_calls.clear()
+    metadata = conduct(cache_dir, _make_batched_steps([1.0, 2.0, 3.0, 4.0, 5.0], 2), "test_orchestration")
+    assert [len(step_names) for step_names in _batch_calls] == [2, 2, 1]
+    assert abs(load_artifact(("step_map_reduce", metadata[0][1][-1])) - sum((3.1 + x) * 2.0 for x in range(1, 6))) < 1e-6
+    # results are cached and reported per map item.
+    assert [name for name, _ in metadata[0][1][:-1]] == ["step_toy_fn", "step_scale"] * 5
+    assert load_artifact(metadata[0][1][3]) == (3.1 + 2.0) * 2.0
+    # only the new map items are passed to the batched step.
+    _batch_calls.clear()
+    metadata = conduct(cache_dir, _make_batched_steps([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0], 4), "test_orchestration")
+    assert len(_batch_calls) == 1
+    assert [step_name.split("=")[-1] for step_name in _batch_calls[0]] == ["6.0", "7.0"]
+
+def _step_scale_fn(step_name, version, arg1, factor):
+    return arg1 * factor
+
+def test_batched_and_unbatched_steps_share_cache(cache_dir):
+    unbatched = _make_batched_steps([1.0, 2.0, 3.0], None, batched=False)
+    unbatched['step_map_reduce'].step_fns['step_scale'].step_fn = _step_scale_fn
+    unbatched_metadata = conduct(cache_dir, unbatched, "test_orchestration")
+    metadata = conduct(cache_dir, _make_batched_steps([1.0, 2.0, 3.0], 3), "test_orchestration")
+    assert metadata[0][1]['execution_status'] == "cached"
+    assert metadata[0][1]['cache_path'] == unbatched_metadata[0][1][-1]['cache_path']
+
+def _step_bad_batch_fn(step_name, version, arg1):
+    return [arg1[0]]
+
+def test_batched_step_must_return_one_result_per_item(cache_dir):
+    map_reduce_dict = OrderedDict()
+    map_reduce_dict['step_bad'] = SingletonStep(_step_bad_batch_fn, {'version': '001'}, batched=True)
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(map_reduce_dict, {"arg1": [1.0, 2.0]}, {"version": "001"}, sum, batch_size=2)
+    with pytest.raises(ValueError):
+        conduct(cache_dir, step_dict, "test_orchestration")
+
+async def _step_async_fetch_fn(step_name, version, arg1: float, delay_ignore: float = 0.2):
+    await asyncio.sleep(delay_ignore)
+    return arg1 * 10
+
+def test_async_map_reduce_runs_map_items_concurrently(cache_dir):
+    map_reduce_dict = OrderedDict()
+    map_reduce_dict['step_fetch'] = SingletonStep(_step_async_fetch_fn, {
+        'version': '001'
+    })
+    map_reduce_dict['step_toy_fn'] = SingletonStep(_step_toy_fn, {
+        'version': '001',
+        'arg1': 'step_fetch'
+    })
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(
+        map_reduce_dict,
+        {"arg1": [float(x) for x in range(40)]}, 
+        {"version": "001"},
+        sum, max_workers=20, executor="async")
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    # 40 items of 0.2 seconds each, at most 20 at a time.
+    fetch_metadata = [map_metadata for name, map_metadata in metadata[0][1][:-1] if name == "step_fetch"]
+    assert 1 < _max_concurrent(fetch_metadata) <= 20
+    assert abs(load_artifact(("step_map_reduce", metadata[0][1][-1])) - sum(x * 10 + 3.1 for x in range(40))) < 1e-6
+    assert [name for name, _ in metadata[0][1][:4]] == ["step_fetch", "step_toy_fn"] * 2
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert metadata[0][1]['execution_status'] == "cached"
+
+def test_async_map_reduce_inside_running_event_loop(cache_dir):
+    step_dict = OrderedDict()
+    step_dict['step_map_reduce'] = MapReduceStep(
+        OrderedDict([("step_fetch", SingletonStep(_step_async_fetch_fn, {'version': '001', 'delay_ignore': 0.0}))]),
+        {"arg1": [1.0, 2.0, 3.0]}, 
+        {"version": "001"},
+        sum, max_workers=3, executor="async")
+    async def run_from_coroutine():
+        # e.g. in a notebook, or any async def caller.
+        return conduct(cache_dir, step_dict, "test_orchestration")
+    metadata = asyncio.run(run_from_coroutine())
+    assert load_artifact(("step_map_reduce", metadata[0][1][-1])) == 60.0
+
+def test_async_executor_runs_ready_steps_concurrently(cache_dir):
+    step_dict = OrderedDict()
+    for i in range(4):
+        step_dict[f'step_fetch_{i}'] = SingletonStep(_step_async_fetch_fn, {
+            'version': "001", 
+            'arg1': float(i),
+            'delay_ignore': 0.5
+        })
+    step_dict['step_toy_fn'] = SingletonStep(_step_toy_fn, {
+        'version': "001", 
+        'arg1': 'step_fetch_3'
+    })
+    metadata = conduct(cache_dir, step_dict, "test_orchestration", max_workers=4, executor="async")
+    assert _max_concurrent([step_metadata for _, step_metadata in metadata[:4]]) > 1
+    assert [name for name, _ in metadata] == list(step_dict.keys())
+    assert load_artifact(metadata[-1]) == 30.0 + 3.1
+
+def test_async_step_with_sync_executor(cache_dir):
+    step_dict = OrderedDict()
+    step_dict['step_fetch'] = SingletonStep(_step_async_fetch_fn, {
+        'version': "001", 
+        'arg1': 2.0,
+        'delay_ignore': 0.0
+    })
+    metadata = conduct(cache_dir, step_dict, "test_orchestration")
+    assert load_artifact(metadata[0]) == 20.0
+
+async def _step_async_fail_fn(step_name, version):
+    raise RuntimeError("stand-in service is down")
+
+def test_async_executor_records_failed_step(cache_dir):
+    step_dict = OrderedDict()
+    step_dict['step_fetch'] = SingletonStep(_step_async_fetch_fn, {
+        'version': "001", 
+        'arg1': 2.0,
+        'delay_ignore': 0.5
+    })
+    step_dict['step_fail'] = SingletonStep(_step_async_fail_fn, {
+        'version': "001"
+    })
+    with pytest.raises(RuntimeError):
+        conduct(cache_dir, step_dict, "test_orchestration", max_workers=2, executor="async")
+    metadata = load_latest_steps("test_orchestration")
+    assert metadata == [["step_fail", {**metadata[0][1], "execution_status": "failed"}]]
@@ -0,0 +1,110 @@
+import json
+import multiprocessing
+import os
+import socket
+import time
+from collections import OrderedDict
+from flowmason import leases
+from flowmason.dag import conduct, MapReduceStep, SingletonStep
+from flowmason.leases import LeaseManager
+
+LOG_FNAME = "executions.log"
+
+def _log_execution(step_name):
+    # a single O_APPEND write per line, so that lines from the two processes are not interleaved.
+    with open(LOG_FNAME, 'a') as f:
+        f.write(f"{os.getpid()} {step_name}\n")
+
+def _step_prepare(step_name, version):
+    _log_execution(step_name)
+    time.sleep(0.3)
+    return 10.0
+
+def _step_square(step_name, version, arg1: float, offset: float):
+    _log_execution(step_name)
+    time.sleep(0.2)
+    return arg1 * arg1 + offset
+
+def _make_steps():
+    steps = OrderedDict()
+    steps["step_prepare"] = SingletonStep(_step_prepare, {"version": "001"})
+    map_steps = OrderedDict()
+    map_steps["step_square"] = SingletonStep(_step_square, {"version": "001", "offset": "step_prepare"})
+    steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": [float(x) for x in range(12)]}, {"version": "001"}, sum,
+                                             executor="thread")
+    return steps
+
+def _run_worker(results_fname):
+    metadata = conduct("cache", _make_steps(), "test_leases", cooperative=True)
+    with open(results_fname, 'w') as f:
+        json.dump(metadata, f)
+
+def test_processes_share_work(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(leases, "POLL_INTERVAL", 0.05)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_run_worker, args=(f"results_{i}.json",)) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+    with open(LOG_FNAME, 'r') as f:
+        executions = [line.split() for line in f.read().splitlines()]
+    executed_steps = [step_name for _, step_name in executions]
+    # every step and map item ran exactly once, and the map items were split between the processes.
+    assert sorted(executed_steps) == sorted(set(executed_steps))
+    assert len(executed_steps) == 13
+    assert len({pid for pid, step_name in executions if step_name != "step_prepare"}) == 2
+    results = []
+    for i in range(2):
+        with open(f"results_{i}.json", 'r') as f:
+            results.append(json.load(f))
+    assert results[0][-1][1][-1]["cache_path"] == results[1][-1][1][-1]["cache_path"]
+    # the leases are released.
+    assert os.listdir(os.path.join("cache", "leases")) == []
+    # both runs were recorded, under different run numbers.
+    assert sorted(f for f in os.listdir(os.path.join("outputs", "test_leases")) if f.startswith("run_")) == [
+        "run_0000.json", "run_0001.json"]
+
+def _hold_lease_and_exit(cache_dir, cache_path):
+    LeaseManager(cache_dir).try_acquire(cache_path)
+    os._exit(0)
+
+def test_leases_of_dead_processes_are_taken_over(tmp_path):
+    cache_dir = str(tmp_path)
+    cache_path = os.path.join(cache_dir, "ab", "ab" + "0" * 62)
+    manager = LeaseManager(cache_dir)
+    worker = multiprocessing.get_context("fork").Process(target=_hold_lease_and_exit, args=(cache_dir, cache_path))
+    worker.start()
+    worker.join()
+    assert os.path.exists(manager.get_lease_path(cache_path))
+    assert manager.try_acquire(cache_path)
+    manager.release(cache_path)
+    assert not os.path.exists(manager.get_lease_path(cache_path))
+
+def test_leases_without_heartbeat_are_taken_over(tmp_path):
+    cache_dir = str(tmp_path)
+    cache_path = os.path.join(cache_dir, "cd", "cd" + "0" * 62)
+    manager = LeaseManager(cache_dir, lease_timeout=30)
+    lease_path = manager.get_lease_path(cache_path)
+    os.makedirs(os.path.dirname(lease_path))
+    # held by a process on another machine.
+    with open(lease_path, 'w') as f:
+        json.dump({"host": f"not-{socket.gethostname()}", "pid": 1, "token": "other"}, f)
+    assert not manager.try_acquire(cache_path)
+    os.utime(lease_path, (time.time() - 60, time.time() - 60))
+    assert manager.try_acquire(cache_path)
+    with open(lease_path, 'r') as f:
+        assert json.load(f)["pid"] == os.getpid()
+
+def test_heartbeat_keeps_leases_alive(tmp_path):
+    cache_dir = str(tmp_path)
+    cache_path = os.path.join(cache_dir, "ef", "ef" + "0" * 62)
+    manager = LeaseManager(cache_dir, heartbeat_interval=0.05)
+    assert manager.try_acquire(cache_path)
+    lease_path = manager.get_lease_path(cache_path)
+    os.utime(lease_path, (0, 0))
+    time.sleep(0.3)
+    assert time.time() - os.path.getmtime(lease_path) < 5
+    manager.release(cache_path)
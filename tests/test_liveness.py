@@ -0,0 +1,87 @@
+import operator
+from collections import OrderedDict
+from flowmason.dag import conduct, SingletonStep, MapReduceStep, _get_chain_releases
+from flowmason.result_registry import result_registry
+from flowmason.run_store import get_run_store
+from flowmason.storage import load_cached_artifact
+
+PAYLOAD_BYTES = 1 << 20
+
+def _step_payload(step_name, version, fill: int):
+    return bytes([fill]) * PAYLOAD_BYTES
+
+def _step_increment(step_name, version, payload):
+    # the upstream result is still held by the registry while its last consumer runs.
+    return bytes([payload[0] + 1]) * PAYLOAD_BYTES
+
+def _step_first_byte(step_name, version, payload):
+    return payload[0]
+
+def _step_add(step_name, version, arg1: int, offset):
+    return arg1 + offset
+
+def _step_double(step_name, version, arg1: int, added):
+    return 2 * added
+
+def _make_chain():
+    steps = OrderedDict()
+    steps["step_a"] = SingletonStep(_step_payload, {"version": "001", "fill": 1})
+    steps["step_b"] = SingletonStep(_step_increment, {"version": "001", "payload": "step_a"})
+    steps["step_c"] = SingletonStep(_step_increment, {"version": "001", "payload": "step_b"})
+    steps["step_d"] = SingletonStep(_step_increment, {"version": "001", "payload": "step_c"})
+    steps["step_result"] = SingletonStep(_step_first_byte, {"version": "001", "payload": "step_d"})
+    return steps
+
+def test_results_are_released_after_their_last_consumer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    released = []
+    release = result_registry.release
+    def record_release(cache_path):
+        released.append(cache_path)
+        release(cache_path)
+    monkeypatch.setattr(result_registry, "release", record_release)
+    metadata = conduct("cache", _make_chain(), "test_liveness", write_behind=True)
+    assert load_cached_artifact(metadata[-1][1]["cache_path"]) == 4
+    assert released == [step_metadata["cache_path"] for _, step_metadata in metadata]
+    peak_resident_bytes = get_run_store("test_liveness").latest_run()["peak_resident_bytes"]
+    # two payloads at most: a step's input and its output, rather than all four.
+    assert 2 * PAYLOAD_BYTES <= peak_resident_bytes < 3 * PAYLOAD_BYTES
+
+def test_peak_counts_uncompressed_bytes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    steps = _make_chain()
+    for step in steps.values():
+        step.step_params["codec"] = "zlib"
+    conduct("cache", steps, "test_liveness", write_behind=True)
+    # the payloads compress to a few kilobytes each, but take a megabyte each in memory.
+    assert get_run_store("test_liveness").latest_run()["peak_resident_bytes"] >= 2 * PAYLOAD_BYTES
+
+def test_peak_is_only_recorded_with_write_behind(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conduct("cache", _make_chain(), "test_liveness")
+    assert "peak_resident_bytes" not in get_run_store("test_liveness").latest_run()
+
+def test_map_results_are_released(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    steps = OrderedDict()
+    steps["step_offset"] = SingletonStep(_step_payload, {"version": "001", "fill": 3})
+    steps["step_first_byte"] = SingletonStep(_step_first_byte, {"version": "001", "payload": "step_offset"})
+    map_steps = OrderedDict()
+    map_steps["step_add"] = SingletonStep(_step_add, {"version": "001", "offset": "step_first_byte"})
+    map_steps["step_double"] = SingletonStep(_step_double, {"version": "001", "added": "step_add"})
+    steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": [1, 2, 3]}, {"version": "001"}, operator.add,
+                                             reduce_mode="fold")
+    metadata = conduct("cache", steps, "test_liveness", write_behind=True)
+    assert load_cached_artifact(metadata[-1][1][-1]["cache_path"]) == 2 * (1 + 2 + 3 + 3 * 3)
+    # step_offset was released once step_first_byte had run, before the map items ran.
+    assert get_run_store("test_liveness").latest_run()["peak_resident_bytes"] < 2 * PAYLOAD_BYTES
+
+def test_chain_releases():
+    map_steps = OrderedDict()
+    map_steps["step_load"] = SingletonStep(_step_payload, {"version": "001"})
+    map_steps["step_log"] = SingletonStep(_step_payload, {"version": "001"})
+    map_steps["step_add"] = SingletonStep(_step_add, {"version": "001", "offset": "step_load"})
+    map_steps["step_double"] = SingletonStep(_step_double, {"version": "001", "added": "step_add"})
+    map_reduce_step = MapReduceStep(map_steps, {"arg1": [1]}, {"version": "001"}, sum)
+    assert _get_chain_releases(map_reduce_step) == {
+        "step_load": [], "step_log": ["step_log"], "step_add": ["step_load"], "step_double": ["step_add"]}
@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+import pytest
+from flowmason.dag import conduct, SingletonStep, MapReduceStep
+from flowmason.planner import RunPlan, select_steps
+
+def _step_constant(step_name, version, value):
+    return value
+
+def _step_add(step_name, version, first, second):
+    return first + second
+
+def _step_square(step_name, version, arg1: float, offset):
+    return arg1 * arg1 + offset
+
+def _make_steps(square_items=(1.0, 2.0, 3.0), add_version="001"):
+    steps = OrderedDict()
+    steps["step_one"] = SingletonStep(_step_constant, {"version": "001", "value": 1})
+    steps["step_two"] = SingletonStep(_step_constant, {"version": "001", "value": 2})
+    steps["step_add"] = SingletonStep(_step_add, {"version": add_version, "first": "step_one", "second": "step_two"})
+    map_steps = OrderedDict()
+    map_steps["step_square"] = SingletonStep(_step_square, {"version": "001", "offset": "step_one"})
+    steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": list(square_items)}, {"version": "001"}, sum)
+    steps["step_evaluate"] = SingletonStep(_step_add, {"version": "001", "first": "step_add", "second": "step_one"})
+    return steps
+
+def test_select_steps():
+    steps = _make_steps()
+    assert list(select_steps(steps, ["step_evaluate"])) == ["step_one", "step_two", "step_add", "step_evaluate"]
+    assert list(select_steps(steps, ["step_map_reduce"])) == ["step_one", "step_map_reduce"]
+    with pytest.raises(ValueError):
+        select_steps(steps, ["step_missing"])
+
+def test_targets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_planner", targets=["step_evaluate"])
+    assert [step_name for step_name, _ in metadata] == ["step_one", "step_two", "step_add", "step_evaluate"]
+    metadata = conduct("cache", _make_steps(), "test_planner")
+    assert [step_metadata["execution_status"] if isinstance(step_metadata, dict) else step_metadata[-1]["execution_status"]
+            for _, step_metadata in metadata] == ["cached", "cached", "cached", "executed", "cached"]
+
+def test_dry_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    plan = conduct("cache", _make_steps(), "test_planner", dry_run=True)
+    assert isinstance(plan, RunPlan)
+    assert plan.get_steps("run") == ["step_one", "step_two", "step_add", "step_map_reduce", "step_evaluate"]
+    # nothing was run or recorded.
+    assert not os.path.exists("cache")
+    assert not os.path.exists(os.path.join("outputs", "test_planner"))
+
+    conduct("cache", _make_steps(), "test_planner")
+    plan = conduct("cache", _make_steps(square_items=(1.0, 2.0, 4.0), add_version="002"), "test_planner",
+                   dry_run=True, targets=["step_add", "step_map_reduce"])
+    assert plan.get_steps("cached") == ["step_one", "step_two"]
+    assert plan.get_steps("run") == ["step_add", "step_map_reduce"]
+    assert plan.get_steps("skipped") == ["step_evaluate"]
+    map_reduce_plan = plan.steps[3]
+    assert map_reduce_plan.map_items_to_run == ["arg1=4.0"]
+    assert map_reduce_plan.num_map_items_cached == 2
+    output = plan.summary()
+    assert "step_map_reduce: run (1 map items would run, 2 are cached: arg1=4.0)" in output
+    assert "2 steps would run, 2 are cached and 1 are skipped." in output
+    # the dry runs were not recorded.
+    with open(os.path.join("outputs", "test_planner", "runs.jsonl"), 'r') as f:
+        assert len(f.readlines()) == 1
+
+    # the plan matches what conduct then does.
+    metadata = conduct("cache", _make_steps(square_items=(1.0, 2.0, 4.0), add_version="002"), "test_planner",
+                       targets=["step_add", "step_map_reduce"])
+    map_reduce_metadata = metadata[3][1]
+    assert sorted(map_metadata["execution_status"] for _, map_metadata in map_reduce_metadata[:-1]) == [
+        "cached", "cached", "executed"]
+
+def _list_files(dir_name):
+    return sorted(os.path.join(root, fname) for root, _, fnames in os.walk(dir_name) for fname in fnames)
+
+def test_dry_run_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conduct("cache", _make_steps(), "test_planner")
+    # as if the results were cached before the cache directory had an index, so they have no recorded digests.
+    os.remove(os.path.join("cache", "index.jsonl"))
+    cache_files = _list_files("cache")
+    plan = conduct("cache", _make_steps(), "test_planner", dry_run=True)
+    assert plan.get_steps("cached") == ["step_one", "step_two", "step_add", "step_map_reduce", "step_evaluate"]
+    assert _list_files("cache") == cache_files
+    # the results are indexed, with their digests, once a run may write to the cache directory.
+    metadata = conduct("cache", _make_steps(), "test_planner")
+    assert all(isinstance(step_metadata, dict) and step_metadata["execution_status"] == "cached"
+               for _, step_metadata in metadata)
+    with open(os.path.join("cache", "index.jsonl"), 'r') as f:
+        assert any("digest" in json.loads(line) for line in f)
+
+def test_import_is_lazy():
+    modules = subprocess.run([sys.executable, "-c", "import json, sys, flowmason; print(json.dumps(sorted(sys.modules)))"],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    imported = set(json.loads(modules))
+    assert not imported & {"loguru", "dill", "ipdb", "pdb"}
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from flowmason import prefetch, storage
+from flowmason.dag import conduct, SingletonStep, MapReduceStep
+from flowmason.prefetch import Prefetcher, prefetcher
+
+def _step_make_list(step_name, version, length: int):
+    return list(range(length))
+
+def _step_combine(step_name, version, first, second, third):
+    return sum(first) + sum(second) + sum(third)
+
+def _step_square(step_name, version, arg1: float, offset):
+    return arg1 * arg1 + sum(offset)
+
+def _make_steps(version="001"):
+    steps = OrderedDict()
+    for i, name in enumerate(["step_first", "step_second", "step_third"]):
+        steps[name] = SingletonStep(_step_make_list, {"version": "001", "length": 1000 + i})
+    steps["step_combine"] = SingletonStep(_step_combine, {"version": version, "first": "step_first",
+                                                          "second": "step_second", "third": "step_third"})
+    map_steps = OrderedDict()
+    map_steps["step_square"] = SingletonStep(_step_square, {"version": version, "offset": "step_first"})
+    steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": [1.0, 2.0, 3.0, 4.0]}, {"version": version}, sum)
+    return steps
+
+def _results(metadata):
+    return [(step_name, step_metadata["cache_path"] if isinstance(step_metadata, dict) else step_metadata[-1]["cache_path"])
+            for step_name, step_metadata in metadata]
+
+def test_prefetch_gives_the_same_results(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conduct("cache", _make_steps(), "test_prefetch")
+    without_prefetch = conduct("cache", _make_steps("002"), "test_prefetch")
+    with_prefetch = conduct("cache_prefetch", _make_steps(), "test_prefetch")
+    with_prefetch = conduct("cache_prefetch", _make_steps("002"), "test_prefetch", prefetch_bytes=1 << 20)
+    assert [metadata["execution_status"] if isinstance(metadata, dict) else metadata[-1]["execution_status"]
+            for _, metadata in with_prefetch] == ["cached"] * 3 + ["executed"] * 2
+    assert [storage.load_cached_artifact(path) for _, path in _results(with_prefetch)] == \
+        [storage.load_cached_artifact(path) for _, path in _results(without_prefetch)]
+    # step_combine was charged for reading its three inputs.
+    assert with_prefetch[3][1]["profile"]["bytes_read"] == sum(
+        storage.get_artifact_version(path)[1] for _, path in _results(with_prefetch)[:3])
+    assert not prefetcher.active
+
+def test_inputs_load_concurrently(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conduct("cache", _make_steps(), "test_prefetch")
+    loading = set()
+    max_concurrent = []
+    lock = threading.Lock()
+    load_cached_artifact = storage.load_cached_artifact
+    def slow_load(cache_path, *args, **kwargs):
+        with lock:
+            loading.add(cache_path)
+            max_concurrent.append(len(loading))
+        time.sleep(0.2)
+        with lock:
+            loading.discard(cache_path)
+        return load_cached_artifact(cache_path, *args, **kwargs)
+    monkeypatch.setattr(prefetch, "load_cached_artifact", slow_load)
+    steps = _make_steps("002")
+    steps.pop("step_map_reduce")
+    conduct("cache", steps, "test_prefetch", prefetch_bytes=1 << 20)
+    assert max(max_concurrent) == 3
+
+def test_budget_is_respected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_prefetch")
+    paths = [path for _, path in _results(metadata)[:3]]
+    sizes = [storage.get_artifact_version(path)[1] for path in paths]
+    budget = sizes[0] + sizes[1]
+    local_prefetcher = Prefetcher()
+    assert local_prefetcher.activate(budget)
+    try:
+        local_prefetcher.prefetch(paths[:2])
+        # waits for the loads, which can then be dropped for the third artifact.
+        assert all(future.result() is not None for future, _ in list(local_prefetcher._loads.values()))
+        local_prefetcher.prefetch(paths[2:])
+        assert local_prefetcher.current_bytes <= budget
+        assert paths[2] in local_prefetcher._loads and paths[0] not in local_prefetcher._loads
+        assert local_prefetcher.take(paths[2]).result() == list(range(1002))
+        assert local_prefetcher.take(paths[0]) is None
+    finally:
+        local_prefetcher.deactivate()
@@ -0,0 +1,77 @@
+import json
+from collections import OrderedDict
+from flowmason.dag import conduct, SingletonStep, MapReduceStep
+from flowmason.profiling import export_chrome_trace
+
+def _step_make_list(step_name, version, length: int):
+    return list(range(length))
+
+def _step_sum(step_name, version, values):
+    return sum(values)
+
+def _step_square(step_name, version, arg1: float):
+    return arg1 * arg1
+
+def _make_steps():
+    steps = OrderedDict()
+    steps["step_make_list"] = SingletonStep(_step_make_list, {"version": "001", "length": 10000})
+    steps["step_sum"] = SingletonStep(_step_sum, {"version": "001", "values": "step_make_list"})
+    map_steps = OrderedDict()
+    map_steps["step_square"] = SingletonStep(_step_square, {"version": "001"})
+    steps["step_map_reduce"] = MapReduceStep(map_steps, {"arg1": [1.0, 2.0, 3.0]}, {"version": "001"}, sum)
+    return steps
+
+def test_profiles_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_profiling")
+    make_list_profile = metadata[0][1]["profile"]
+    assert make_list_profile["cache"] == "miss"
+    assert make_list_profile["wall_time"] > 0
+    assert make_list_profile["cpu_time"] >= 0
+    assert make_list_profile["bytes_written"] > 0
+    assert "peak_memory" not in make_list_profile
+    sum_profile = metadata[1][1]["profile"]
+    # step_sum reads the list written by step_make_list.
+    assert sum_profile["bytes_read"] == make_list_profile["bytes_written"]
+    assert sum_profile["deserialize_time"] > 0
+    map_reduce_metadata = metadata[2][1]
+    assert [map_metadata["profile"]["cache"] for _, map_metadata in map_reduce_metadata[:-1]] == ["miss"] * 3
+    assert map_reduce_metadata[-1]["profile"]["reduce_time"] >= 0
+
+    metadata = conduct("cache", _make_steps(), "test_profiling")
+    assert [step_metadata["profile"]["cache"] for _, step_metadata in metadata] == ["hit"] * 3
+    assert metadata[0][1]["profile"]["bytes_written"] == 0
+
+def test_writes_are_recorded_with_write_behind(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_profiling")
+    written = metadata[0][1]["profile"]["bytes_written"]
+    metadata = conduct("cache_write_behind", _make_steps(), "test_profiling", write_behind=True)
+    make_list_profile = metadata[0][1]["profile"]
+    # the step is charged for serializing its result, rather than for the write on the writer thread.
+    assert make_list_profile["bytes_written"] == written
+    assert make_list_profile["serialize_time"] > 0
+    map_reduce_metadata = metadata[2][1]
+    assert all(map_metadata["profile"]["bytes_written"] > 0 for _, map_metadata in map_reduce_metadata[:-1])
+
+def test_trace_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_profiling", trace_memory=True)
+    # a list of 10000 ints takes well over 80KB.
+    assert metadata[0][1]["profile"]["peak_memory"] > 80000
+
+def test_export_chrome_trace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = conduct("cache", _make_steps(), "test_profiling")
+    export_chrome_trace(metadata, "trace.json")
+    with open("trace.json", 'r') as f:
+        events = json.load(f)["traceEvents"]
+    map_events = [event for event in events if event["cat"].startswith("map,")]
+    assert sorted(event["name"] for event in map_events) == [
+        f"step_map_reduce_step_square_arg1={arg1}" for arg1 in [1.0, 2.0, 3.0]]
+    assert sorted(event["name"] for event in events if event not in map_events) == [
+        "step_make_list", "step_map_reduce", "step_sum"]
+    # the map items run inside their map reduce step, so they are placed on another row.
+    map_reduce_event = next(event for event in events if event["name"] == "step_map_reduce")
+    assert all(event["tid"] != map_reduce_event["tid"] for event in map_events)
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
@@ -0,0 +1,68 @@
+import json
+import os
+import pytest
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flowmason.dag import conduct, SingletonStep
+from flowmason.inspector import find_runs, get_step_history, import_runs, load_latest_steps, load_run
+from flowmason.run_store import RunStore, get_run_store
+
+def _step_add(step_name, version, arg1: float):
+    return arg1 + 1
+
+def _step_fail(step_name, version, arg1):
+    raise ValueError("step failed")
+
+def _run(version="001", arg1=1.0, fail=False):
+    steps = OrderedDict()
+    steps["step_add"] = SingletonStep(_step_add, {"version": version, "arg1": arg1})
+    if fail:
+        steps["step_fail"] = SingletonStep(_step_fail, {"version": "001", "arg1": "step_add"})
+    return conduct("cache", steps, "test_runs")
+
+def test_step_history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _run()
+    _run()
+    latest = _run(arg1=2.0)
+    assert load_latest_steps("test_runs") == json.loads(json.dumps(latest))
+    history = get_step_history("test_runs", "step_add")
+    assert [(entry["run"], entry["execution_status"]) for entry in history] == [
+        (0, "executed"), (1, "cached"), (2, "executed")]
+    assert history[0]["cache_path"] == history[1]["cache_path"] != history[2]["cache_path"]
+    assert [run["run"] for run in find_runs("test_runs", "step_add", "cached")] == [1]
+    assert load_run("test_runs", 1)[0][1]["execution_status"] == "cached"
+
+def test_failed_runs_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ValueError):
+        _run(fail=True)
+    run = get_run_store("test_runs").latest_run()
+    assert run["status"] == "failed"
+    assert run["steps"]["step_fail"]["execution_status"] == "failed"
+
+def test_run_numbers_are_unique_across_stores(tmp_path):
+    experiment_dir = str(tmp_path / "test_runs")
+    # separate stores, as in separate processes.
+    stores = [RunStore(experiment_dir) for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        run_nums = list(pool.map(lambda store: store.allocate_run()[0], stores * 4))
+    assert sorted(run_nums) == list(range(32))
+
+def test_imports_run_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _run()
+    _run()
+    # a tree from before experiments had run stores.
+    os.remove(os.path.join("outputs", "test_runs", "runs.jsonl"))
+    with open(os.path.join("outputs", "test_runs", "run_0001.json"), 'r') as f:
+        run_1 = json.load(f)
+    assert load_latest_steps("test_runs") == run_1
+    assert [run["run"] for run in find_runs("test_runs")] == [0, 1]
+    with open(os.path.join("outputs", "test_runs", "run_0005.json"), 'w') as f:
+        json.dump(run_1, f)
+    assert import_runs("test_runs") == 1
+    assert import_runs("test_runs") == 0
+    assert get_run_store("test_runs").latest_run()["run"] == 5
+    assert _run()[0][1]["execution_status"] == "cached"
+    assert get_run_store("test_runs").latest_run()["run"] == 6
@@ -0,0 +1,50 @@
+import io
+import numpy as np
+import pytest
+from flowmason.serializers import Serializer, get_serializer, register_serializer
+
+def _dump(serializer_name, obj, path):
+    with open(path, 'wb') as f:
+        get_serializer(serializer_name).dump(obj, f)
+
+def test_pickle5_roundtrip_out_of_band(tmp_path):
+    path = str(tmp_path / "artifact")
+    obj = {"embeddings": np.arange(1000, dtype=np.float32).reshape(10, 100), 
+           "ids": np.arange(7), "name": "toy"}
+    _dump("pickle5", obj, path)
+    loaded = get_serializer("pickle5").load(path)
+    assert loaded["name"] == "toy"
+    np.testing.assert_array_equal(loaded["embeddings"], obj["embeddings"])
+    np.testing.assert_array_equal(loaded["ids"], obj["ids"])
+    # the arrays are views of the memory-mapped file rather than copies.
+    assert not loaded["embeddings"].flags.writeable
+    assert loaded["embeddings"].ctypes.data % 64 == 0
+
+def test_pickle5_roundtrip_without_buffers(tmp_path):
+    path = str(tmp_path / "artifact")
+    _dump("pickle5", [1, 2.5, "three"], path)
+    assert get_serializer("pickle5").load(path) == [1, 2.5, "three"]
+
+def test_npy_loads_memory_mapped(tmp_path):
+    path = str(tmp_path / "artifact")
+    _dump("npy", np.ones((4, 3)), path)
+    loaded = get_serializer("npy").load(path)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, np.ones((4, 3)))
+
+def test_npy_rejects_non_arrays():
+    with pytest.raises(TypeError):
+        get_serializer("npy").dump([1, 2], io.BytesIO())
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        get_serializer("parquet")
+
+def test_incomplete_serializer_fails_when_registered():
+    class DumpOnlySerializer(Serializer):
+        def dump(self, obj, f):
+            f.write(b"")
+    with pytest.raises(TypeError):
+        register_serializer("dump_only", DumpOnlySerializer())
+    with pytest.raises(TypeError):
+        register_serializer("not_a_serializer", object())
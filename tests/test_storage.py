@@ -0,0 +1,129 @@
+import os
+import dill
+import numpy as np
+import pytest
+from flowmason.storage import (PACK_MAX_ARTIFACT_BYTES, CorruptArtifactError, find_artifact, get_artifact_path, get_blob_path,
+                               get_cache_dir, load_cached_artifact, read_artifact, read_entry_info, set_verify_digests,
+                               write_artifact)
+
+@pytest.mark.parametrize("codec", [None, "zlib", "zlib:1", "lzma:9", "bz2"])
+@pytest.mark.parametrize("serializer_name", ["dill", "pickle5"])
+def test_roundtrip_with_codec(tmp_path, codec, serializer_name):
+    cache_path = str(tmp_path / "artifact")
+    result = {"values": np.zeros(10000), "name": "toy"}
+    digest = write_artifact(cache_path, result, serializer_name, codec)
+    loaded = read_artifact(cache_path)
+    np.testing.assert_array_equal(loaded["values"], result["values"])
+    entry_info = read_entry_info(cache_path)
+    assert entry_info["codec"] == codec
+    assert entry_info["size"] == os.path.getsize(cache_path)
+    assert entry_info["digest"] == digest
+    if codec is not None:
+        assert entry_info["size"] < 10000
+
+def test_npy_with_codec(tmp_path):
+    cache_path = str(tmp_path / "artifact")
+    write_artifact(cache_path, np.arange(12).reshape(3, 4), "npy", "lzma")
+    np.testing.assert_array_equal(read_artifact(cache_path), np.arange(12).reshape(3, 4))
+
+def test_compressed_output_is_deterministic(tmp_path):
+    digests = set()
+    contents = set()
+    for i in range(2):
+        cache_path = str(tmp_path / f"artifact_{i}")
+        digests.add(write_artifact(cache_path, list(range(1000)), "dill", "zlib"))
+        with open(cache_path, 'rb') as f:
+            contents.add(f.read())
+    assert len(digests) == 1
+    assert len(contents) == 1
+
+def test_failed_write_leaves_no_artifact(tmp_path):
+    cache_path = str(tmp_path / "artifact")
+    with pytest.raises(TypeError):
+        write_artifact(cache_path, [1, 2, 3], "npy")
+    assert os.listdir(tmp_path) == []
+
+def test_truncated_artifact_is_detected(tmp_path):
+    cache_path = str(tmp_path / "artifact")
+    write_artifact(cache_path, list(range(1000)), "dill")
+    with open(cache_path, 'r+b') as f:
+        f.truncate(10)
+    with pytest.raises(CorruptArtifactError):
+        read_artifact(cache_path)
+
+def test_artifacts_are_sharded_by_hash_prefix(tmp_path):
+    hashed_name = "ab" + "0" * 62
+    cache_path = get_artifact_path(str(tmp_path), hashed_name)
+    assert cache_path == str(tmp_path / "ab" / hashed_name)
+    assert get_cache_dir(cache_path) == str(tmp_path)
+    assert find_artifact(str(tmp_path), hashed_name) == (cache_path, False)
+    write_artifact(cache_path, 3.1, "dill")
+    assert find_artifact(str(tmp_path), hashed_name) == (cache_path, True)
+    assert read_artifact(cache_path) == 3.1
+
+def test_flat_artifacts_are_still_found(tmp_path):
+    hashed_name = "cd" + "0" * 62
+    with open(tmp_path / hashed_name, 'wb') as f:
+        dill.dump(3.1, f)
+    cache_path, is_cached = find_artifact(str(tmp_path), hashed_name)
+    assert is_cached and cache_path == str(tmp_path / hashed_name)
+    assert read_artifact(cache_path) == 3.1
+
+def test_packed_artifacts_share_a_segment(tmp_path):
+    cache_paths = [get_artifact_path(str(tmp_path), f"{i:064x}") for i in range(20)]
+    for i, cache_path in enumerate(cache_paths):
+        write_artifact(cache_path, {"item": i}, "pickle5", "zlib" if i % 2 else None, pack=True)
+    assert sorted(os.listdir(tmp_path)) == ["index.jsonl", "segments"]
+    assert len(os.listdir(tmp_path / "segments")) == 1
+    assert [read_artifact(cache_path) for cache_path in cache_paths] == [{"item": i} for i in range(20)]
+    assert load_cached_artifact(cache_paths[3]) == {"item": 3}
+
+def test_large_packed_artifacts_get_their_own_file(tmp_path):
+    cache_path = get_artifact_path(str(tmp_path), "ef" + "0" * 62)
+    write_artifact(cache_path, np.zeros(PACK_MAX_ARTIFACT_BYTES), "pickle5", pack=True)
+    assert os.path.exists(cache_path)
+    assert "segment" not in read_entry_info(cache_path)
+    np.testing.assert_array_equal(read_artifact(cache_path), np.zeros(PACK_MAX_ARTIFACT_BYTES))
+
+@pytest.mark.parametrize("codec", [None, "zlib:1"])
+def test_identical_artifacts_share_a_blob(tmp_path, codec):
+    cache_paths = [get_artifact_path(str(tmp_path), f"{i:064x}") for i in range(3)]
+    digests = [write_artifact(cache_path, list(range(1000)), "dill", codec) for cache_path in cache_paths[:2]]
+    write_artifact(cache_paths[2], list(range(1001)), "dill", codec)
+    blob_path = get_blob_path(str(tmp_path), digests[0], codec)
+    assert os.path.samefile(cache_paths[0], blob_path) and os.path.samefile(cache_paths[1], blob_path)
+    assert os.stat(blob_path).st_nlink == 3
+    assert not os.path.samefile(cache_paths[2], blob_path)
+    assert read_entry_info(cache_paths[1])["blob"] == os.path.relpath(blob_path, tmp_path)
+    # rewriting an artifact replaces its link, leaving the artifacts it shared a blob with alone.
+    write_artifact(cache_paths[0], "rewritten", "dill", codec)
+    assert read_artifact(cache_paths[0]) == "rewritten"
+    assert read_artifact(cache_paths[1]) == list(range(1000))
+
+def test_identical_packed_artifacts_are_appended_once(tmp_path):
+    cache_paths = [get_artifact_path(str(tmp_path), f"{i:064x}") for i in range(3)]
+    for cache_path in cache_paths:
+        write_artifact(cache_path, {"item": 1}, "pickle5", pack=True)
+    entries = [read_entry_info(cache_path) for cache_path in cache_paths]
+    assert len({(entry["segment"], entry["offset"]) for entry in entries}) == 1
+    assert os.path.getsize(tmp_path / entries[0]["segment"]) == entries[0]["size"]
+    assert [read_artifact(cache_path) for cache_path in cache_paths] == [{"item": 1}] * 3
+
+@pytest.mark.parametrize("pack", [False, True])
+def test_digests_are_verified_on_read(tmp_path, pack):
+    cache_path = get_artifact_path(str(tmp_path), "ab" + "0" * 62)
+    write_artifact(cache_path, b"x" * 1000, "dill", pack=pack)
+    entry_info = read_entry_info(cache_path)
+    data_path = tmp_path / entry_info["segment"] if pack else cache_path
+    offset = entry_info.get("offset", 0) + entry_info["size"] // 2
+    with open(data_path, 'r+b') as f:
+        f.seek(offset)
+        f.write(b"y")
+    # the corrupted byte is inside the bytes object, so it still loads.
+    assert read_artifact(cache_path) != b"x" * 1000
+    set_verify_digests(True)
+    try:
+        with pytest.raises(CorruptArtifactError):
+            read_artifact(cache_path)
+    finally:
+        set_verify_digests(False)